@@ -0,0 +1,190 @@
+"""
+Export the Trac attachments of tickets and wiki pages into a git repo,
+at the paths linked by `attachment_links.get_attachment_path`.
+
+Publish the repo and use its raw URL as `config.ATTACHMENT_ROOT`.
+
+    python attachment_export.py PATH/TO/Trac.db3 TRAC-ENV GIT-REPO
+
+The paths are hashed, and the files are read and hashed,
+by a pool of threads,
+and streamed into a single `git fast-import` process.
+Files with identical content are stored as a single blob.
+Attachments already in the repo are skipped,
+and at the end all the linked attachments are checked to be in the repo.
+"""
+import hashlib
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from attachment_links import get_attachment_path, trac_hash
+from git_fast_import import FastImport
+
+# Threads reading and hashing the attachment files.
+WORKERS = 8
+
+# Files read at once by the threads.
+BATCH_SIZE = 64
+
+
+def main(args):
+    """
+    Do the job.
+    """
+    if len(args) != 3:
+        print(
+            "Need to pass the path to DB file, Trac environment "
+            "and git repo as arguments.")
+        sys.exit(1)
+
+    db_file, trac_env, target_repo = args
+    attachments = get_attachments(db_file)
+
+    exported, duplicates, missing = export_attachments(
+        attachments, trac_env, target_repo)
+    print(
+        f'Exported {exported} attachments, '
+        f'{duplicates} with duplicate content.'
+        )
+    for realm, parent_id, filename in missing:
+        print(f'Missing file for {realm}:{parent_id} {filename}')
+
+    not_linked = verify_attachments(attachments, target_repo)
+    for path in not_linked:
+        print('Missing linked attachment', path)
+    if not_linked:
+        sys.exit(1)
+    print(f'All {len(attachments)} linked attachments are in the repo.')
+
+
+def get_attachments(db_file):
+    """
+    Return the (realm, parent ID, filename) of all the attachments,
+    from the SQLite3 db file.
+    """
+    db = sqlite3.connect(db_file)
+    try:
+        return [
+            (realm, parent_id, filename)
+            for realm, parent_id, filename in db.execute(
+                'SELECT type, id, filename FROM attachment ORDER BY time')
+            ]
+    finally:
+        db.close()
+
+
+def get_repo_path(realm, parent_id, filename):
+    """
+    Return the path in the repo, as linked from the migrated tickets.
+    """
+    return get_attachment_path('', parent_id, filename, realm=realm)[1:]
+
+
+def get_trac_path(trac_env, realm, parent_id, filename):
+    """
+    Return the path of the attachment in the Trac environment.
+
+    This is the layout of Trac 1.0 and newer.
+    """
+    parent_hash = trac_hash(parent_id)
+    extension = os.path.splitext(filename)[1]
+    return os.path.join(
+        trac_env, 'files', 'attachments', realm,
+        parent_hash[:3], parent_hash, trac_hash(filename) + extension,
+        )
+
+
+def _read_attachment(trac_env, attachment):
+    """
+    Return the content of the attachment file and its hash,
+    or None if it's missing.
+    """
+    path = get_trac_path(trac_env, *attachment)
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    return content, hashlib.sha1(content).hexdigest()
+
+
+def get_repo_files(repo):
+    """
+    Return the set of files in the current commit of the git repo.
+    """
+    result = subprocess.run(
+        ['git', 'ls-tree', '-r', '-z', '--name-only', 'HEAD'],
+        cwd=repo,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        )
+    if result.returncode:
+        # No commits yet.
+        return set()
+    return set(result.stdout.decode('utf-8').split('\0')) - {''}
+
+
+def export_attachments(attachments, trac_env, repo, workers=WORKERS):
+    """
+    Commit the attachments which are not already in the repo.
+
+    Return the number of exported attachments,
+    how many of them have the content of another attachment,
+    and the list of attachments without a file in the Trac environment.
+    """
+    existing = get_repo_files(repo)
+    pending = [
+        attachment for attachment in attachments
+        if get_repo_path(*attachment) not in existing
+        ]
+
+    files = {}
+    marks = {}
+    missing = []
+    duplicates = 0
+    read = partial(_read_attachment, trac_env)
+    with FastImport(repo) as git, ThreadPoolExecutor(workers) as pool:
+        # Only a batch of files is kept in memory.
+        for start in range(0, len(pending), BATCH_SIZE):
+            batch = pending[start:start + BATCH_SIZE]
+            for attachment, result in zip(batch, pool.map(read, batch)):
+                if result is None:
+                    missing.append(attachment)
+                    continue
+                content, digest = result
+                if digest in marks:
+                    duplicates += 1
+                else:
+                    marks[digest] = git.blob(content)
+                files[get_repo_path(*attachment)] = marks[digest]
+
+        if files:
+            committer = git.committer()
+            git.commit(
+                files,
+                author=committer,
+                timestamp=time.time(),
+                message=f'Export {len(files)} Trac attachments.',
+                )
+
+    return len(files), duplicates, missing
+
+
+def verify_attachments(attachments, repo):
+    """
+    Return the paths of the attachments which are not in the repo.
+    """
+    existing = get_repo_files(repo)
+    return [
+        path for path in (get_repo_path(*item) for item in attachments)
+        if path not in existing
+        ]
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,17 +1,25 @@
 import hashlib
+from functools import lru_cache
 
 
+@lru_cache(maxsize=4096)
 def trac_hash(text):
     """
     Hash filenames and ticket IDs in the same way as Trac.
+
+    The hashes are memoized, as the same ticket ID is hashed
+    for each of its attachments.
     """
     return hashlib.sha1(str(text).encode('utf-8')).hexdigest()
 
 
-def get_attachment_path(root, ticket_id, filename):
+def get_attachment_path(root, ticket_id, filename, realm='ticket'):
     """
     Process the root location, ticket ID and filename
     into the Trac attachment path.
+
+    For the attachments of wiki pages, the `realm` is `wiki`,
+    and the page name is used as ID.
     """
     ticket_hash = trac_hash(ticket_id)
 
@@ -19,7 +27,7 @@ def get_attachment_path(root, ticket_id, filename):
     if '.' in filename:
         extension = f'.{filename.split(".")[-1]}'
     return (
-        root.rstrip('/') + '/ticket/' +
+        root.rstrip('/') + '/' + realm + '/' +
         ticket_hash[:3] + '/' +
         ticket_hash + '/' +
         trac_hash(filename) + extension
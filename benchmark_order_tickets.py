@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Time `NumberPredictor.planRepoTickets` on large, gap-heavy Trac instances.
+
+    python benchmark_order_tickets.py [TICKET-COUNT ...]
+
+By default it plans 10k, 100k and 1M tickets,
+with Trac IDs spread over 3 times as many numbers,
+and the next GitHub number in the middle of them,
+both without and with placeholder issues as fillers.
+"""
+import random
+import sys
+import time
+
+from ticket_migrate_golden_comet_preview import NumberPredictor
+
+DEFAULT_COUNTS = (10_000, 100_000, 1_000_000)
+
+
+def make_tickets(count, seed=0):
+    """
+    Return `count` tickets with IDs having many gaps, and the next number.
+    """
+    generator = random.Random(seed)
+    ids = generator.sample(range(1, 3 * count), count)
+    tickets = [{'t_id': t_id, 'component': 'ftp'} for t_id in ids]
+    return tickets, count
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_COUNTS
+    for count in counts:
+        tickets, start = make_tickets(count)
+        # Without fillers, and with enough fillers to match all the IDs.
+        for max_fillers in (0, 2 * count):
+            before = time.perf_counter()
+            ordered, numbers, fillers = NumberPredictor.planRepoTickets(
+                tickets, start, max_fillers)
+            elapsed = time.perf_counter() - before
+
+            matches = sum(
+                1 for ticket, number in zip(ordered, numbers)
+                if ticket['t_id'] == number)
+            print(
+                f'{count:>9} tickets: {elapsed:.3f}s, '
+                f'{matches} matching GitHub numbers, '
+                f'{len(fillers)} fillers.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Rewrite the Trac ticket references in the commit messages of a git history,
+as a filter between `git fast-export` and `git fast-import`:
+
+    git fast-export --all --signed-tags=strip --reencode=yes |
+        python commit_message_filter.py [--before=EPOCH] |
+        (cd PATH/TO/NEW-REPO && git fast-import)
+
+The references are replaced with the GitHub issues from
+`tickets_created.tsv`:
+
+* `Fixes #1234`, `refs #1234` and other references after a keyword
+  become `Fixes owner/repo#number`.
+  A `#1234` without a keyword, like in `Merge pull request #12`,
+  is kept.
+* `trac:1234`, `trac#1234` and `ticket:1234` become `owner/repo#number`.
+* Trac ticket URLs become GitHub issue URLs.
+
+With `--before`, only the commits done before that Unix time are changed,
+as the later ones already use GitHub numbers.
+The blobs are copied to the output without being parsed.
+"""
+import re
+import sys
+from collections import Counter
+
+import ticket_store
+
+try:
+    import config
+except ModuleNotFoundError:
+    # In the tests, we monkeypatch this module.
+    config = None
+
+# Bytes copied at once, for the blobs.
+COPY_SIZE = 1024 * 1024
+
+KEYWORDS = (
+    r'fix(?:e[sd])?|close[sd]?|resolve[sd]?|refs?|references|see|ticket')
+
+
+def reference_regex(trac_ticket_prefix):
+    """
+    Return the pattern matching all the forms of Trac references.
+    """
+    return re.compile(
+        rf'\b(?P<keyword>(?:{KEYWORDS}):?\s+)#(?P<keyword_id>\d+)\b'
+        r'|\b(?:trac[:#]|ticket:)(?P<trac_id>\d+)\b'
+        rf'|{re.escape(trac_ticket_prefix)}(?P<url_id>\d+)\b',
+        re.IGNORECASE,
+        )
+
+
+class MessageRewriter:
+    """
+    Replace the Trac references in commit messages,
+    counting the references which were not migrated.
+    """
+
+    def __init__(self, store, trac_ticket_prefix, before=None):
+        self.store = store
+        self.before = before
+        self.regex = reference_regex(trac_ticket_prefix)
+        self.commits = 0
+        self.changed = 0
+        self.unknown = Counter()
+
+    def replaceMatch(self, match):
+        trac_id = (
+            match.group('keyword_id') or
+            match.group('trac_id') or
+            match.group('url_id')
+            )
+        found = self.store.lookupWithOwner(int(trac_id))
+        if found is None:
+            self.unknown[int(trac_id)] += 1
+            return match.group(0)
+
+        owner, repo, number = found
+        if match.group('url_id'):
+            return f'https://github.com/{owner}/{repo}/issues/{number}'
+        return f'{match.group("keyword") or ""}{owner}/{repo}#{number}'
+
+    def rewrite(self, message, timestamp=None):
+        """
+        Return the bytes `message` of a commit done at `timestamp`,
+        with the references replaced.
+        """
+        self.commits += 1
+        if self.before is not None and timestamp is not None:
+            if timestamp >= self.before:
+                return message
+
+        # Messages which are not UTF-8 are kept as they are.
+        text = message.decode('utf-8', 'surrogateescape')
+        new_text = self.regex.sub(self.replaceMatch, text)
+        if new_text == text:
+            return message
+        self.changed += 1
+        return new_text.encode('utf-8', 'surrogateescape')
+
+
+def filter_stream(source, target, rewriter):
+    """
+    Copy the fast-export `source` stream to `target`,
+    with the commit messages rewritten.
+    """
+    command = None
+    timestamp = None
+    while True:
+        line = source.readline()
+        if not line:
+            break
+
+        if not line.startswith(b'data '):
+            if line[:1].isalpha():
+                word = line.split(b' ', 1)[0].strip()
+                if word in (b'commit', b'blob', b'tag', b'reset'):
+                    command = word
+                    timestamp = None
+                elif word == b'committer':
+                    # committer NAME <EMAIL> TIMESTAMP TIMEZONE
+                    timestamp = int(line.split()[-2])
+            target.write(line)
+            continue
+
+        size = line[5:].strip()
+        if size.startswith(b'<<'):
+            raise ValueError('Delimited data is not supported.')
+        size = int(size)
+
+        if command == b'commit':
+            message = rewriter.rewrite(_read(source, size), timestamp)
+            target.write(b'data %d\n' % (len(message),))
+            target.write(message)
+            command = None
+            continue
+
+        target.write(line)
+        while size:
+            chunk = source.read(min(size, COPY_SIZE))
+            if not chunk:
+                raise ValueError('Truncated stream.')
+            target.write(chunk)
+            size -= len(chunk)
+
+
+def _read(source, size):
+    """
+    Return exactly `size` bytes from the source.
+    """
+    data = source.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated stream.')
+    return data
+
+
+def main(args):
+    """
+    Filter stdin to stdout.
+    """
+    before = None
+    for arg in args:
+        if arg.startswith('--before='):
+            before = int(arg.split('=', 1)[1])
+        else:
+            sys.stderr.write(f'Unknown argument: {arg}\n')
+            sys.exit(1)
+
+    store = ticket_store.load(
+        'tickets_created.tsv', config.TRAC_TICKET_PREFIX)
+    rewriter = MessageRewriter(store, config.TRAC_TICKET_PREFIX, before)
+    filter_stream(sys.stdin.buffer, sys.stdout.buffer, rewriter)
+    sys.stdout.buffer.flush()
+
+    # The output is the stream, so the summary goes to stderr.
+    sys.stderr.write(
+        f'Changed {rewriter.changed} of {rewriter.commits} commit messages.\n')
+    if rewriter.unknown:
+        sys.stderr.write('Ticket IDs not migrated: ' + ', '.join(
+            f'{trac_id} ({count}x)'
+            for trac_id, count in sorted(rewriter.unknown.items())) + '\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -22,8 +22,15 @@ ASSIGNABLE_USERS = {
 TRAC_TICKET_PREFIX = 'https://trac.chevah.com/ticket/'
 MIGRATED_WIKI_PREFIX = 'https://example.org/wiki/'
 
-# GitHub repository for Trac tickets.
-REPOSITORY = 'trac-migration-staging'
+# Trac ticket Component to GitHub repository mapping.
+REPOSITORY_MAPPING = {
+    'client': 'client',
+    'commons': 'commons',
+    'trac-migration-staging': 'trac-migration-staging',
+    }
+
+# GitHub repository for Trac tickets with Component not in the mapping.
+FALLBACK_REPOSITORY = 'trac-migration-staging'
 
 # Owner of GitHub repositories where to create issues.
 OWNER = 'chevah'
@@ -48,3 +55,13 @@ ALLOWED_KEYWORDS = {
     'windows',
     'tests',
     }
+
+# Organization to add projects in, for the classic API.
+PROJECT_ORG = 'chevah'
+
+# None or a tuple of (name, email)
+# This is used for Trac users that don't have GitHub mapping.
+DEFAULT_GITHUB_USER = None
+
+# Wiki page file extension.
+FILE_EXTENSION = '.rst'
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the parts of the GitHub API used by the migration.
+
+It allows running and benchmarking a full submission offline:
+
+    python fake_github.py --port 8000 --import-duration 0.5
+    GITHUB_API_URL=http://127.0.0.1:8000 python ticket_migrate_golden_comet_preview.py trac.db
+
+Supported endpoints:
+
+* issues and pulls listing, issue creation, retrieval and update
+* the issue import (golden-comet preview) API, with pending durations
+* issue comments
+* milestones
+* classic projects, their columns and cards
+* GraphQL queries for the IDs of issues, as sent by `github_graphql`
+
+Every response has rate limit headers, and each GET response an ETag.
+Content-creating requests over the secondary limit get a 403.
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeGitHub:
+    """
+    The in-memory state of the fake GitHub, and the API endpoints.
+
+    `import_duration` is the number of seconds an import stays pending.
+    `fail_import` is called with each imported issue data,
+    and returns a list of errors for imports which should fail, or None.
+    `secondary_limit` is the number of content-creating requests
+    allowed in `secondary_window` seconds.
+    """
+    def __init__(
+            self,
+            import_duration=0,
+            fail_import=None,
+            rate_limit=5000,
+            rate_reset_interval=3600,
+            secondary_limit=80,
+            secondary_window=60,
+            ):
+        self.import_duration = import_duration
+        self.fail_import = fail_import or (lambda data: None)
+        self.rate_limit = rate_limit
+        self.rate_reset_interval = rate_reset_interval
+        self.secondary_limit = secondary_limit
+        self.secondary_window = secondary_window
+
+        self.lock = threading.Lock()
+        self.base_url = ''
+        self.next_id = 1000
+
+        # Repository name -> number -> issue or pull request.
+        self.issues = defaultdict(dict)
+        self.pulls = defaultdict(dict)
+        # Repository name -> issue number -> list of comments.
+        self.comments = defaultdict(lambda: defaultdict(list))
+        # Repository name -> milestone title -> milestone.
+        self.milestones = defaultdict(dict)
+        self.imports = {}
+        self.projects = {}
+        self.columns = {}
+        self.cards = {}
+
+        # How many times each endpoint was called.
+        self.calls = Counter()
+        self.remaining = rate_limit
+        self.reset_time = int(time.time()) + rate_reset_interval
+        self.content_times = []
+
+    def newId(self):
+        """
+        Return a new global ID.
+        """
+        self.next_id += 1
+        return self.next_id
+
+    def nextNumber(self, repo):
+        """
+        Issues and pull requests share the numbers of a repository.
+        """
+        return max(
+            [0] + list(self.issues[repo]) + list(self.pulls[repo])) + 1
+
+    def addPull(self, repo):
+        """
+        Create a pull request, taking the next number of the repository.
+        """
+        with self.lock:
+            number = self.nextNumber(repo)
+            self.pulls[repo][number] = {'number': number, 'id': self.newId()}
+            return number
+
+    def addIssue(self, repo, data):
+        """
+        Create an issue, taking the next number of the repository.
+        """
+        number = self.nextNumber(repo)
+        issue_id = self.newId()
+        issue = {
+            'id': issue_id,
+            'node_id': f'I_{issue_id}',
+            'number': number,
+            'title': data.get('title', ''),
+            'body': data.get('body', ''),
+            'state': 'closed' if data.get('closed') else 'open',
+            'labels': data.get('labels', []),
+            'milestone': data.get('milestone'),
+            'url': f'{self.base_url}/repos/{{owner}}/{repo}/issues/{number}',
+            'html_url': f'https://github.com/{{owner}}/{repo}/issues/{number}',
+            }
+        self.issues[repo][number] = issue
+        return issue
+
+    def rateLimitHeaders(self):
+        """
+        Return the primary rate limit headers.
+        """
+        if time.time() >= self.reset_time:
+            self.remaining = self.rate_limit
+            self.reset_time = int(time.time()) + self.rate_reset_interval
+        return {
+            'X-RateLimit-Limit': str(self.rate_limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': str(self.reset_time),
+            'X-RateLimit-Used': str(self.rate_limit - self.remaining),
+            'X-RateLimit-Resource': 'core',
+            }
+
+    def isSecondaryLimited(self):
+        """
+        Record a content-creating request,
+        and return the number of seconds to retry after,
+        or 0 if the request is allowed.
+        """
+        now = time.time()
+        window_start = now - self.secondary_window
+        self.content_times = [t for t in self.content_times if t > window_start]
+        if len(self.content_times) >= self.secondary_limit:
+            return int(1 + self.content_times[0] - window_start)
+        self.content_times.append(now)
+        return 0
+
+    def handle(self, method, path, query, data, headers):
+        """
+        Dispatch a request, and return (status, headers, JSON data).
+        """
+        with self.lock:
+            rate_headers = self.rateLimitHeaders()
+            if self.remaining <= 0:
+                return 403, rate_headers, {
+                    'message': 'API rate limit exceeded.',
+                    'documentation_url': 'https://docs.github.com/rest/overview/resources-in-the-rest-api#rate-limiting',  # noqa
+                    }
+
+            if method in ('POST', 'PATCH') and path != '/graphql':
+                retry_after = self.isSecondaryLimited()
+                if retry_after:
+                    self.remaining -= 1
+                    return 403, {
+                        **self.rateLimitHeaders(),
+                        'Retry-After': str(retry_after),
+                        }, {
+                        'message': (
+                            'You have exceeded a secondary rate limit. '
+                            'Please wait a few minutes before you try again.'
+                            ),
+                        'documentation_url': 'https://docs.github.com/rest/overview/resources-in-the-rest-api#secondary-rate-limits',  # noqa
+                        }
+
+            for route_method, pattern, name in ROUTES:
+                match = re.fullmatch(pattern, path)
+                if route_method == method and match:
+                    self.calls[name] += 1
+                    status, body = getattr(self, name)(
+                        data=data, query=query, **match.groupdict())
+                    break
+            else:
+                status, body = 404, {'message': 'Not Found'}
+
+            extra_headers = {}
+            if method == 'GET' and status == 200:
+                etag = '"{}"'.format(hashlib.sha1(
+                    json.dumps(body, sort_keys=True).encode()).hexdigest())
+                extra_headers['ETag'] = etag
+                if headers.get('If-None-Match') == etag:
+                    # Conditional requests don't count against the limit.
+                    return 304, {**self.rateLimitHeaders(), **extra_headers}, None
+
+            self.remaining -= 1
+            return status, {**self.rateLimitHeaders(), **extra_headers}, body
+
+    def withOwner(self, owner, data):
+        """
+        Fill in the owner in the URLs of an issue.
+        """
+        return {
+            k: v.replace('{owner}', owner) if isinstance(v, str) else v
+            for k, v in data.items()
+            }
+
+    def listIssues(self, owner, repo, query, data):
+        """
+        List issues and pulls, newest first, like GitHub does.
+        """
+        items = {**self.issues[repo], **self.pulls[repo]}
+        return 200, self.paginate(items, query, owner)
+
+    def listPulls(self, owner, repo, query, data):
+        return 200, self.paginate(self.pulls[repo], query, owner)
+
+    def paginate(self, items, query, owner):
+        """
+        Return a page of items, ordered by descending number.
+        """
+        per_page = int(query.get('per_page', 30))
+        page = int(query.get('page', 1))
+        ordered = [items[n] for n in sorted(items, reverse=True)]
+        start = (page - 1) * per_page
+        return [
+            self.withOwner(owner, item)
+            for item in ordered[start:start + per_page]
+            ]
+
+    def createIssue(self, owner, repo, query, data):
+        issue = self.addIssue(repo, data)
+        return 201, self.withOwner(owner, issue)
+
+    def getIssue(self, owner, repo, number, query, data):
+        issue = self.issues[repo].get(int(number))
+        if not issue:
+            return 404, {'message': 'Not Found'}
+        return 200, self.withOwner(owner, issue)
+
+    def updateIssue(self, owner, repo, number, query, data):
+        issue = self.issues[repo].get(int(number))
+        if not issue:
+            return 404, {'message': 'Not Found'}
+        issue.update(data)
+        return 200, self.withOwner(owner, issue)
+
+    def createComment(self, owner, repo, number, query, data):
+        if int(number) not in self.issues[repo]:
+            return 404, {'message': 'Not Found'}
+        comment_id = self.newId()
+        comment = {
+            'id': comment_id,
+            'body': data['body'],
+            'html_url': (
+                f'https://github.com/{owner}/{repo}/issues/{number}'
+                f'#issuecomment-{comment_id}'
+                ),
+            }
+        self.comments[repo][int(number)].append(comment)
+        return 201, comment
+
+    def startImport(self, owner, repo, query, data):
+        """
+        Queue an issue import, which stays pending for `import_duration`.
+        """
+        import_id = self.newId()
+        url = f'{self.base_url}/repos/{owner}/{repo}/import/issues/{import_id}'
+        self.imports[import_id] = {
+            'owner': owner,
+            'repo': repo,
+            'data': data,
+            'ready_at': time.time() + self.import_duration,
+            'response': {
+                'id': import_id,
+                'status': 'pending',
+                'url': url,
+                'import_issues_url': (
+                    f'{self.base_url}/repos/{owner}/{repo}/import/issues'),
+                'repository_url': f'{self.base_url}/repos/{owner}/{repo}',
+                },
+            }
+        return 202, self.imports[import_id]['response']
+
+    def checkImport(self, owner, repo, import_id, query, data):
+        """
+        Report the import status, creating the issue once it is ready.
+        """
+        job = self.imports.get(int(import_id))
+        if not job:
+            return 404, {'message': 'Not Found'}
+
+        response = job['response']
+        if response['status'] == 'pending' and time.time() >= job['ready_at']:
+            errors = self.fail_import(job['data'])
+            if errors:
+                response.update({'status': 'failed', 'errors': errors})
+            else:
+                issue = self.addIssue(repo, job['data']['issue'])
+                self.comments[repo][issue['number']].extend(
+                    job['data'].get('comments', []))
+                response.update({
+                    'status': 'imported',
+                    'issue_url': (
+                        f'{self.base_url}/repos/{owner}/{repo}/issues/'
+                        f'{issue["number"]}'
+                        ),
+                    })
+        return 200, dict(response)
+
+    def createMilestone(self, owner, repo, query, data):
+        if data['title'] in self.milestones[repo]:
+            return 422, {
+                'message': 'Validation Failed',
+                'errors': [{
+                    'resource': 'Milestone',
+                    'code': 'already_exists',
+                    'field': 'title',
+                    }],
+                }
+        milestone = {
+            'id': self.newId(),
+            'number': len(self.milestones[repo]) + 1,
+            **data,
+            }
+        self.milestones[repo][data['title']] = milestone
+        return 201, milestone
+
+    def createProject(self, org, query, data):
+        project_id = self.newId()
+        self.projects[project_id] = {
+            'id': project_id,
+            'state': 'open',
+            'columns_url': f'{self.base_url}/projects/{project_id}/columns',
+            **data,
+            }
+        return 201, self.projects[project_id]
+
+    def updateProject(self, project_id, query, data):
+        project = self.projects.get(int(project_id))
+        if not project:
+            return 404, {'message': 'Not Found'}
+        project.update(data)
+        return 200, project
+
+    def createColumn(self, project_id, query, data):
+        if int(project_id) not in self.projects:
+            return 404, {'message': 'Not Found'}
+        column_id = self.newId()
+        self.columns[column_id] = {
+            'id': column_id, 'project_id': int(project_id), **data}
+        return 201, self.columns[column_id]
+
+    def createCard(self, column_id, query, data):
+        if int(column_id) not in self.columns:
+            return 404, {'message': 'Not Found'}
+        card_id = self.newId()
+        self.cards[card_id] = {
+            'id': card_id, 'column_id': int(column_id), **data}
+        return 201, self.cards[card_id]
+
+    def graphql(self, query, data):
+        """
+        Resolve the `issue(number: N)` fields of a repository query.
+        Other GraphQL queries are not supported.
+        """
+        match = re.search(
+            r'repository\(owner: "([^"]+)", name: "([^"]+)"\)', data['query'])
+        if not match:
+            return 200, {'errors': [{
+                'type': 'UNSUPPORTED',
+                'message': 'The fake GitHub only resolves issues.',
+                }]}
+
+        repo = match.group(2)
+        repository = {}
+        errors = []
+        for alias, number in re.findall(
+                r'(\w+): issue\(number: (\d+)\)', data['query']):
+            issue = self.issues[repo].get(int(number))
+            if issue is None:
+                repository[alias] = None
+                errors.append({
+                    'type': 'NOT_FOUND',
+                    'path': ['repository', alias],
+                    'message': (
+                        f'Could not resolve to an issue or pull request '
+                        f'with the number of {number}.'),
+                    })
+            else:
+                repository[alias] = {
+                    'id': issue['node_id'], 'databaseId': issue['id']}
+
+        body = {'data': {'repository': repository}}
+        if errors:
+            body['errors'] = errors
+        return 200, body
+
+
+_REPO = r'/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)'
+
+# (method, path pattern, FakeGitHub method name)
+ROUTES = [
+    ('GET', _REPO + r'/issues', 'listIssues'),
+    ('POST', _REPO + r'/issues', 'createIssue'),
+    ('GET', _REPO + r'/pulls', 'listPulls'),
+    ('GET', _REPO + r'/issues/(?P<number>\d+)', 'getIssue'),
+    ('PATCH', _REPO + r'/issues/(?P<number>\d+)', 'updateIssue'),
+    ('POST', _REPO + r'/issues/(?P<number>\d+)/comments', 'createComment'),
+    ('POST', _REPO + r'/import/issues', 'startImport'),
+    ('GET', _REPO + r'/import/issues/(?P<import_id>\d+)', 'checkImport'),
+    ('POST', _REPO + r'/milestones', 'createMilestone'),
+    ('POST', r'/orgs/(?P<org>[^/]+)/projects', 'createProject'),
+    ('PATCH', r'/projects/(?P<project_id>\d+)', 'updateProject'),
+    ('POST', r'/projects/(?P<project_id>\d+)/columns', 'createColumn'),
+    ('POST', r'/projects/columns/(?P<column_id>\d+)/cards', 'createCard'),
+    ('POST', r'/graphql', 'graphql'),
+    ]
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Translate HTTP requests to `FakeGitHub.handle` calls.
+    """
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def dispatch(self, method):
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        data = json.loads(self.rfile.read(length) or 'null')
+
+        status, headers, body = self.server.github.handle(
+            method, parts.path, query, data, self.headers)
+
+        content = b'' if body is None else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        """
+        Keep quiet, the migration output is noisy enough.
+        """
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    """
+    An HTTP server for a `FakeGitHub`, which can run in a thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, github, host='127.0.0.1', port=0):
+        super().__init__((host, port), Handler)
+        self.github = github
+        self.url = f'http://{host}:{self.server_address[1]}'
+        github.base_url = self.url
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05},
+            daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    """
+    Serve a fake GitHub until interrupted, then show the API call counts.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--import-duration', type=float, default=0,
+        help='Seconds for which each import stays pending.')
+    parser.add_argument(
+        '--fail-every', type=int, default=0,
+        help='Fail every Nth import.')
+    parser.add_argument('--rate-limit', type=int, default=5000)
+    parser.add_argument(
+        '--secondary-limit', type=int, default=80,
+        help='Content-creating requests allowed per minute.')
+    args = parser.parse_args()
+
+    imports = Counter()
+
+    def fail_import(data):
+        imports['count'] += 1
+        if args.fail_every and imports['count'] % args.fail_every == 0:
+            return [{'code': 'custom', 'message': 'Simulated failure.'}]
+
+    github = FakeGitHub(
+        import_duration=args.import_duration,
+        fail_import=fail_import,
+        rate_limit=args.rate_limit,
+        secondary_limit=args.secondary_limit,
+        )
+    server = FakeGitHubServer(github, port=args.port)
+    print(f'Serving a fake GitHub API at {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for name, count in sorted(github.calls.items()):
+            print(f'{name}\t{count}')
+
+
+if __name__ == '__main__':
+    main()
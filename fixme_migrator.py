@@ -1,95 +1,328 @@
+import mmap
 import os
 import re
+import subprocess
 import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-# The GitHub name of the project we're working on.
+import ticket_store
+
+try:
+    import config
+except ModuleNotFoundError:
+    # In the tests, we monkeypatch this module.
+    config = None
+
+# The GitHub name of the project we're working on,
+# for the files not matched to another project.
 PROJECT_NAME = 'server'
 FIXME_REGEX = re.compile(r'FIXME:(\d+):')
+FIXME_MARKER = b'FIXME:'
+
+# Threads scanning the files, in parallel mode.
+WORKERS = 16
 
+# Paths containing these are not migrated.
+SKIPPED_PATHS = (
+    '.git',
+    'node_modules',
+    'python2.7',
+    'nodeenv',
+    'release-notes',
+    )
 
-def should_skip_path(fpath):
+
+def should_skip_path(fpath, projects=(PROJECT_NAME,), skipped=SKIPPED_PATHS):
     """
     Returns true if a path should be skipped instead of migrated.
     """
     if fpath.endswith('.pyc'):
         return True
 
-    return any(substr in fpath for substr in [
-        '.git',
-        'node_modules',
-        'python2.7',
-        'nodeenv',
-        f'build-{PROJECT_NAME}',
-        'release-notes',
-        ])
+    return any(substr in fpath for substr in list(skipped) + [
+        f'build-{project}' for project in projects])
 
 
-def replace_match(match, ticket_mapping):
+def replace_match(match, ticket_mapping, report=None, project=PROJECT_NAME):
+    """
+    Replace a Trac ID with its GitHub number,
+    using a mapping like `TicketMappingStore.repoView`.
+
+    The IDs which are not replaced are added to the `report`,
+    or printed without a report.
+    """
     group = match.group(1)
     try:
         return f'FIXME:{ticket_mapping[group]}:'
     except KeyError:
         if group in ticket_mapping.values():
-            print(f'Ticket ID may have been migrated: {group}')
+            kind = Report.MIGRATED
         else:
-            print(f'Ticket ID not in this project: {group}')
+            kind = Report.UNKNOWN
+        if report is None:
+            print(f'Ticket ID {kind}: {group}')
+        else:
+            report.add(project, kind, group)
         return f'FIXME:{group}:'
 
 
-def migrate(ticket_mapping, text):
+def migrate(ticket_mapping, text, report=None, project=PROJECT_NAME):
     return FIXME_REGEX.sub(
-        lambda match: replace_match(match, ticket_mapping),
+        lambda match: replace_match(match, ticket_mapping, report, project),
         text
         )
 
 
+class Report:
+    """
+    The FIXME references which were not migrated,
+    counted for all the files.
+    """
+    MIGRATED = 'may have been migrated'
+    UNKNOWN = 'not in this project'
+    NOT_MIGRATED = 'not migrated'
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, project, kind, trac_id):
+        with self._lock:
+            self.counts[(project, kind, trac_id)] += 1
+
+    def lines(self):
+        """
+        Return a line for each project and kind,
+        with the IDs and the number of their references.
+        """
+        ids = {}
+        for (project, kind, trac_id), count in self.counts.items():
+            ids.setdefault((project, kind), []).append((int(trac_id), count))
+
+        return [
+            f'{project}: Ticket IDs {kind}: ' + ', '.join(
+                f'{trac_id} ({count}x)' for trac_id, count in sorted(found))
+            for (project, kind), found in sorted(ids.items())
+            ]
+
+
+class Projects:
+    """
+    The project of each file, and its mapping of Trac IDs.
+
+    A path is in the project of its longest prefix from `paths`,
+    or in the project named as its first directory under `root`,
+    or in the `default` project.
+    """
+
+    def __init__(self, store, root, paths=None, default=PROJECT_NAME):
+        self.store = store
+        self.root = root
+        self.default = default
+        self.paths = sorted(
+            (paths or {}).items(), key=lambda item: -len(item[0]))
+        self.names = {repo for _, repo in store.repos} | {default}
+        self.names.update(project for _, project in self.paths)
+        self._mappings = {}
+
+    def getProject(self, fpath):
+        relative = os.path.relpath(fpath, self.root).replace(os.sep, '/')
+        for prefix, project in self.paths:
+            if (relative + '/').startswith(prefix.rstrip('/') + '/'):
+                return project
+        first, _, rest = relative.partition('/')
+        if rest and first in self.names:
+            return first
+        return self.default
+
+    def getMapping(self, project):
+        """
+        Return the Trac ID -> GitHub number mapping of the project.
+        """
+        mapping = self._mappings.get(project)
+        if mapping is None:
+            mapping = self._mappings[project] = self.store.repoView(project)
+        return mapping
+
+
 def parse_tsv(project, tsv_text):
     """
     Parse content in TSV format with tickets created,
     and selects only the ones for the given project name.
     """
-    old_to_new = re.compile(
-        f'https://trac.chevah.com/ticket/(\\d+)\t'
-        f'https://github.com/chevah/{project}/issues/(\\d+)\n'
+    store = ticket_store.TicketMappingStore.fromLines(
+        tsv_text.splitlines(), config.TRAC_TICKET_PREFIX)
+    return store.repoView(project)
+
+
+def list_files(root, projects=(PROJECT_NAME,), skipped=SKIPPED_PATHS):
+    """
+    Return the paths of the files to migrate under `root`.
+
+    For git repos, the tracked and the not ignored files are listed by git,
+    instead of walking all the directories.
+    """
+    result = subprocess.run(
+        [
+            'git', 'ls-files', '-z',
+            '--cached', '--others', '--exclude-standard',
+            ],
+        cwd=root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
         )
+    if result.returncode == 0:
+        paths = [
+            os.path.join(root, name)
+            for name in result.stdout.decode('utf-8').split('\0') if name]
+    else:
+        paths = [
+            os.path.join(dirpath, fname)
+            for dirpath, dirs, fnames in os.walk(root)
+            for fname in fnames
+            ]
+    return [
+        fpath for fpath in paths
+        if not should_skip_path(fpath, projects, skipped)
+        ]
 
-    return {
-        match[0]: match[1]
-        for match in re.findall(old_to_new, tsv_text)
-        }
 
+def has_fixme(fpath):
+    """
+    Return `True` if the file contains a FIXME marker,
+    searching the bytes without reading the whole file.
+    """
+    with open(fpath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped.
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return content.find(FIXME_MARKER) != -1
 
-def main():
+
+def migrate_file(fpath, ticket_mapping, report=None, project=PROJECT_NAME):
     """
-    Perform FIXME in-place migration on a given directory.
+    Migrate the FIXMEs of a file in-place.
+
+    Only files with FIXME markers are decoded.
+    Return `True` if the file was changed.
+    """
+    try:
+        if not has_fixme(fpath):
+            return False
+        with open(fpath, 'rb') as f:
+            source_code = f.read().decode('utf-8')
+    except (OSError, ValueError):
+        # Likely a binary file, or a broken link. Skip it.
+        return False
+
+    new_source = migrate(ticket_mapping, source_code, report, project)
+    if source_code == new_source:
+        return False
+    with open(fpath, 'wb') as f:
+        f.write(new_source.encode('utf-8'))
+    return True
+
+
+def migrate_files(paths, projects, report=None, workers=WORKERS):
+    """
+    Migrate the files of the `projects` with a pool of threads.
+
+    Return the number of changed files.
+    """
+    def migrate_path(fpath):
+        project = projects.getProject(fpath)
+        return migrate_file(
+            fpath, projects.getMapping(project), report, project)
+
+    with ThreadPoolExecutor(workers) as pool:
+        return sum(pool.map(migrate_path, paths))
+
+
+def parse_arguments(args):
+    """
+    Return the root directory, the default project,
+    the dict of path prefix -> project, and the parallel mode.
     """
-    args = sys.argv[1:]
-    if len(args) != 1:
+    parallel = False
+    project = PROJECT_NAME
+    paths = {}
+    positional = []
+    for arg in args:
+        if arg == '--parallel':
+            parallel = True
+        elif arg.startswith('--project='):
+            project = arg.split('=', 1)[1]
+        elif arg.startswith('--map='):
+            prefix, _, mapped = arg.split('=', 1)[1].rpartition('=')
+            paths[prefix] = mapped
+        else:
+            positional.append(arg)
+
+    if len(positional) != 1:
         raise ValueError('There should be exactly one argument: '
                          'the path to the root directory to update.\n'
                          f'Provided: {args}')
+    return positional[0], project, paths, parallel
+
+
+def main():
+    """
+    Perform FIXME in-place migration on a given directory.
+
+    The files of all the projects are migrated in one run,
+    and the IDs which were not migrated are reported at the end.
+    A file is in the project named by its first directory,
+    or by the longest path prefix given as `--map=PREFIX=PROJECT`,
+    or in the `--project=NAME` default project.
+
+    With `--parallel`, only the files with FIXME markers are decoded,
+    and the files are scanned by a pool of threads.
+    """
+    root, project, paths, parallel = parse_arguments(sys.argv[1:])
+
+    store = ticket_store.load(
+        'tickets_created.tsv', config.TRAC_TICKET_PREFIX)
+    projects = Projects(store, root, paths, default=project)
+    report = Report()
+
+    if parallel:
+        fpaths = list_files(root, projects.names)
+        changed = migrate_files(fpaths, projects, report)
+        print(f'Changed {changed} of {len(fpaths)} files.')
+    else:
+        _migrate_walk(root, projects, report)
+
+    for line in report.lines():
+        print(line)
+
+
+def _migrate_walk(root, projects, report):
+    """
+    Migrate all the files under `root`, one at a time.
+    """
+    for dirpath, dirs, fnames in os.walk(root):
+        for fname in fnames:
+            fpath = os.path.join(dirpath, fname)
+
+            if should_skip_path(fpath, projects.names):
+                continue
 
-    with open('tickets_created.tsv') as tickets_f:
-        tsv_text = tickets_f.read()
-        mapping = parse_tsv(project=PROJECT_NAME, tsv_text=tsv_text)
-
-        for root, dirs, fnames in os.walk(args[0]):
-            for fname in fnames:
-                fpath = os.path.join(root, fname)
-
-                if should_skip_path(fpath):
-                    continue
-
-                try:
-                    with open(fpath) as f:
-                        source_code = f.read()
-                        new_source = migrate(mapping, source_code)
-                    if source_code != new_source:
-                        with open(fpath, 'w') as f:
-                            f.write(new_source)
-                except UnicodeDecodeError:
-                    # Likely a binary file. Skip it.
-                    continue
+            project = projects.getProject(fpath)
+            mapping = projects.getMapping(project)
+            try:
+                with open(fpath) as f:
+                    source_code = f.read()
+                    new_source = migrate(
+                        mapping, source_code, report, project)
+                if source_code != new_source:
+                    with open(fpath, 'w') as f:
+                        f.write(new_source)
+            except UnicodeDecodeError:
+                # Likely a binary file. Skip it.
+                continue
 
 
 if __name__ == '__main__':
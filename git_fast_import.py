@@ -0,0 +1,155 @@
+"""
+Write commits into a git repository with a single `git fast-import` process.
+
+Blobs and commits are streamed to the process as they are produced,
+so the working tree and the index of the repository are not touched.
+After the import, update the working tree with `git reset --hard`.
+
+Stream format:
+https://git-scm.com/docs/git-fast-import#_input_format
+"""
+import subprocess
+
+
+class FastImport:
+    """
+    A `git fast-import` process committing on a single branch.
+    """
+
+    def __init__(self, repo, branch=None):
+        """
+        Start the import into `branch` of the `repo` git repository.
+
+        By default, the current branch of the repository is used.
+        When the branch already has commits, the new ones follow them.
+        """
+        self.repo = repo
+        if branch is None:
+            branch = self._git('symbolic-ref', 'HEAD')
+        self.branch = branch
+        # The first new commit continues the existing history, if any.
+        self._parent = None
+        if self._git('rev-parse', '--verify', '--quiet', branch, check=False):
+            self._parent = branch + '^0'
+        self._marks = 0
+        self.commits = 0
+        self._process = subprocess.Popen(
+            ['git', 'fast-import', '--quiet', '--done'],
+            cwd=repo,
+            stdin=subprocess.PIPE,
+            )
+        self._stream = self._process.stdin
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _git(self, *args, check=True):
+        """
+        Return the output of a git command run in the repository.
+        """
+        result = subprocess.run(
+            ('git',) + args,
+            cwd=self.repo,
+            check=check,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            )
+        return result.stdout.strip()
+
+    def committer(self):
+        """
+        Return the committer used by `git commit` in the repository,
+        as `Name <email>`.
+        """
+        ident = self._git('var', 'GIT_COMMITTER_IDENT')
+        # Remove the timestamp and the timezone.
+        return ident.rsplit(' ', 2)[0]
+
+    def _write(self, *lines):
+        for line in lines:
+            self._stream.write(line.encode('utf-8') + b'\n')
+
+    def _data(self, content):
+        """
+        Write the `data` command for the str or bytes `content`.
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self._write(f'data {len(content)}')
+        self._stream.write(content + b'\n')
+
+    def blob(self, content):
+        """
+        Write the blob with `content` and return its int mark,
+        to be used in `commit` instead of the content.
+        """
+        self._marks += 1
+        self._write('blob', f'mark :{self._marks}')
+        self._data(content)
+        return self._marks
+
+    def commit(self, files, author, timestamp, message, committer=None):
+        """
+        Commit the `files` dict of path -> content or blob mark.
+
+        `author` and `committer` are `Name <email>`,
+        and `timestamp` is in seconds since the epoch, in UTC.
+        By default, the commit is done by the author.
+        """
+        if committer is None:
+            committer = author
+        date = f'{int(timestamp)} +0000'
+        self._write(
+            f'commit {self.branch}',
+            f'author {author} {date}',
+            f'committer {committer} {date}',
+            )
+        self._data(message)
+        if self._parent:
+            self._write(f'from {self._parent}')
+            self._parent = None
+
+        for path, content in files.items():
+            path = _quote_path(path)
+            if isinstance(content, int):
+                self._write(f'M 100644 :{content} {path}')
+            else:
+                self._write(f'M 100644 inline {path}')
+                self._data(content)
+        self._write('')
+        self.commits += 1
+
+    def close(self):
+        """
+        Finish the import, raising an error if git failed.
+        """
+        self._write('done')
+        self._stream.close()
+        returncode = self._process.wait()
+        if returncode:
+            raise subprocess.CalledProcessError(
+                returncode, 'git fast-import')
+
+    def abort(self):
+        """
+        Stop the import, without updating the branch.
+        """
+        # Without the `done` command, the import is rejected.
+        self._stream.close()
+        self._process.wait()
+
+
+def _quote_path(path):
+    """
+    Return the path quoted as a C-style string, if needed.
+    """
+    if not path.startswith('"') and '\n' not in path:
+        return path
+    path = path.replace('\\', '\\\\').replace('"', '\\"')
+    return '"' + path.replace('\n', '\\n') + '"'
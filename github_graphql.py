@@ -0,0 +1,64 @@
+"""
+Resolve the IDs of GitHub issues in batches, with the GraphQL API.
+
+A single query returns the node ID and the database (REST) ID
+of up to BATCH_SIZE issues of a repository,
+instead of one REST GET for each issue.
+
+API Docs:
+https://docs.github.com/en/graphql/reference/objects#repository
+"""
+import json
+
+# The number of issues resolved by a single query.
+BATCH_SIZE = 100
+
+
+def issues_query(owner, repo, numbers):
+    """
+    Return a query for the IDs of the given issue numbers,
+    with an `issue<number>` alias for each issue.
+    """
+    fields = '\n'.join(
+        f'    issue{number}: issue(number: {number}) {{ id databaseId }}'
+        for number in numbers
+        )
+    return (
+        f'query {{\n'
+        f'  repository(owner: {json.dumps(owner)}, name: {json.dumps(repo)}) '
+        f'{{\n{fields}\n  }}\n}}'
+        )
+
+
+def resolve_issue_ids(owner, repo, numbers, post):
+    """
+    Return a dict of issue number -> (node ID, database ID),
+    for the issues which exist.
+
+    `post` is called with the data of each GraphQL request,
+    and returns its response.
+    """
+    numbers = list(numbers)
+    ids = {}
+    for start in range(0, len(numbers), BATCH_SIZE):
+        batch = numbers[start:start + BATCH_SIZE]
+        response = post({'query': issues_query(owner, repo, batch)})
+        result = response.json()
+
+        # Issues not created yet are reported as NOT_FOUND errors.
+        errors = [
+            error for error in result.get('errors', [])
+            if error.get('type') != 'NOT_FOUND'
+            ]
+        if errors:
+            raise ValueError(f'GraphQL query failed: {errors}')
+
+        if result.get('data') is None:
+            raise ValueError(f'GraphQL query returned no data: {result}')
+
+        repository = result['data'].get('repository') or {}
+        for number in batch:
+            issue = repository.get(f'issue{number}')
+            if issue:
+                ids[number] = (issue['id'], issue['databaseId'])
+    return ids
@@ -0,0 +1,128 @@
+"""
+On-disk cache of GitHub GET responses, for conditional requests.
+
+Repeated GET requests are sent with `If-None-Match` / `If-Modified-Since`,
+and a `304 Not Modified` reply is answered from the cache.
+GitHub does not count `304` replies against the primary rate limit:
+https://docs.github.com/en/rest/overview/resources-in-the-rest-api#conditional-requests
+"""
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Directory with one JSON file for each cached URL.
+CACHE_DIR = 'http_cache'
+
+
+class ConditionalCache:
+    """
+    Remember the validators and the content of GET responses on disk,
+    and send the validators on the next GET for the same URL.
+    """
+    def __init__(self, path=CACHE_DIR):
+        self.path = path
+
+    def get(self, url, headers=None, auth=None, params=None):
+        """
+        Send a conditional GET request, if the URL was seen before.
+
+        Return a `requests.Response`, with the cached content
+        in case the server replied with `304 Not Modified`.
+        The headers, including the rate limit ones, are always fresh.
+        """
+        headers = dict(headers or {})
+        key = self.key(url, headers, params)
+        entry = self.load(key)
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = requests.get(
+            url=url, headers=headers, auth=auth, params=params)
+
+        if response.status_code == 304 and entry:
+            return self.fromEntry(entry, response)
+
+        if response.status_code == 200:
+            self.store(key, response)
+
+        return response
+
+    @staticmethod
+    def key(url, headers, params):
+        """
+        Return the file name of the cache entry for a request.
+
+        The `accept` header is part of the key,
+        as it changes the format of the response.
+        """
+        accept = CaseInsensitiveDict(headers).get('accept', '')
+        request_id = json.dumps(
+            [url, accept, sorted((params or {}).items())], default=str)
+        return hashlib.sha1(request_id.encode('utf-8')).hexdigest()
+
+    def load(self, key):
+        """
+        Return the cache entry with the given key, or None.
+        """
+        try:
+            with open(os.path.join(self.path, key + '.json')) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, key, response):
+        """
+        Remember a successful response, if it has validators.
+
+        The entry is written to a temporary file which is then renamed,
+        so that a crash never leaves a partial entry.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, key + '.json')
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({
+                'etag': etag,
+                'last_modified': last_modified,
+                'content': response.content.decode('utf-8'),
+                }, f)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def fromEntry(entry, not_modified):
+        """
+        Build a `200 OK` response out of the cached content
+        and the headers of the `304 Not Modified` response.
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict(not_modified.headers)
+        response._content = entry['content'].encode('utf-8')
+        return response
+
+
+# The cache shared by the migration scripts.
+default_cache = ConditionalCache()
+
+
+def get(url, headers=None, auth=None, params=None):
+    """
+    Send a conditional GET request through the default cache.
+    """
+    return default_cache.get(url, headers=headers, auth=auth, params=params)
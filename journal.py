@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Durable SQLite journal of the migration state.
+
+Every state transition of a ticket is recorded:
+
+* rendered - the GitHub data was generated, with its hash
+* posted - the import was started, with the URL of the import job
+* imported - GitHub created the issue, with its number
+* verified - the issue can be read back, with its GitHub ID
+* linked - the PR link comment was added
+* failed - the ticket was set aside in the dead letter file
+
+On resume, tickets which were posted but not yet imported
+are checked by their import job URL instead of being posted again.
+
+The `*_created.tsv` files can be imported into the journal,
+and exported from it:
+
+    python journal.py import
+    python journal.py export
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+JOURNAL_FILE = 'migration_journal.sqlite3'
+
+# The state files of the scripts, by kind of GitHub object.
+TSV_FILES = {
+    'tickets': 'tickets_created.tsv',
+    'milestones': 'milestones_created.tsv',
+    'projects': 'projects_created.tsv',
+    'comments': 'comments_created.tsv',
+    'links': 'links_created.tsv',
+    }
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ticket (
+    trac_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    repo TEXT,
+    expected_number INTEGER,
+    rendered_hash TEXT,
+    import_url TEXT,
+    github_number INTEGER,
+    github_url TEXT,
+    github_id INTEGER,
+    updated REAL NOT NULL
+    );
+CREATE TABLE IF NOT EXISTS transition (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    trac_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    detail TEXT,
+    time REAL NOT NULL
+    );
+CREATE INDEX IF NOT EXISTS transition_ticket ON transition (trac_id);
+CREATE TABLE IF NOT EXISTS record (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    line TEXT NOT NULL
+    );
+"""
+
+# The ticket columns which can be set by a transition.
+TICKET_COLUMNS = (
+    'repo',
+    'expected_number',
+    'rendered_hash',
+    'import_url',
+    'github_number',
+    'github_url',
+    'github_id',
+    )
+
+
+class Journal:
+    """
+    Record the migration state in a SQLite database in WAL mode,
+    so that each transition is durable without rewriting any file.
+    """
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def transition(self, trac_id, state, detail=None, **columns):
+        """
+        Move a ticket to a new state, updating the given ticket columns.
+        """
+        unknown = set(columns) - set(TICKET_COLUMNS)
+        if unknown:
+            raise ValueError(f'Unknown ticket columns: {unknown}')
+
+        now = time.time()
+        names = ['trac_id', 'state', 'updated', *columns]
+        values = [trac_id, state, now, *columns.values()]
+        updates = ', '.join(f'{name} = excluded.{name}' for name in names[1:])
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.execute(
+                f'INSERT INTO ticket ({", ".join(names)}) '
+                f'VALUES ({", ".join("?" * len(names))}) '
+                f'ON CONFLICT (trac_id) DO UPDATE SET {updates}',
+                values)
+            self.db.execute(
+                'INSERT INTO transition (trac_id, state, detail, time) '
+                'VALUES (?, ?, ?, ?)',
+                (trac_id, state, detail, now))
+
+    def getTicket(self, trac_id):
+        """
+        Return the journaled state of a ticket as a dict, or None.
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT * FROM ticket WHERE trac_id = ?', (trac_id,)
+                ).fetchone()
+        return dict(row) if row else None
+
+    def history(self, trac_id):
+        """
+        Return the list of (state, detail) transitions of a ticket.
+        """
+        with self.lock:
+            return [
+                (row['state'], row['detail'])
+                for row in self.db.execute(
+                    'SELECT state, detail FROM transition '
+                    'WHERE trac_id = ? ORDER BY id', (trac_id,))
+                ]
+
+    def pendingImports(self):
+        """
+        Return a dict of Trac ID -> import job URL,
+        for tickets posted to GitHub but not yet imported.
+        """
+        with self.lock:
+            return {
+                row['trac_id']: row['import_url']
+                for row in self.db.execute(
+                    "SELECT trac_id, import_url FROM ticket "
+                    "WHERE state = 'posted'")
+                }
+
+    def created(self):
+        """
+        Return a dict of Trac ID -> GitHub URL,
+        for the tickets already created on GitHub, in creation order.
+        """
+        with self.lock:
+            return {
+                row['trac_id']: row['github_url']
+                for row in self.db.execute(
+                    'SELECT ticket.trac_id, github_url FROM ticket '
+                    'JOIN transition ON ticket.trac_id = transition.trac_id '
+                    "AND transition.state = 'imported' "
+                    'WHERE github_url IS NOT NULL '
+                    'GROUP BY ticket.trac_id ORDER BY max(transition.id)')
+                }
+
+    def append(self, kind, fields):
+        """
+        Remember a line of one of the other TSV files.
+        """
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT INTO record (kind, line) VALUES (?, ?)',
+                (kind, '\t'.join(str(f) for f in fields)))
+
+    def records(self, kind):
+        """
+        Return the lines remembered for a kind of TSV file, as field lists.
+        """
+        with self.lock:
+            return [
+                row['line'].split('\t')
+                for row in self.db.execute(
+                    'SELECT line FROM record WHERE kind = ? ORDER BY id',
+                    (kind,))
+                ]
+
+    def importTSV(self, kind, path):
+        """
+        Load one of the `*_created.tsv` files into the journal.
+
+        The records of the other kinds are replaced by the lines of the file.
+        Created tickets are journaled as imported,
+        unless they already are, so the file can be imported again.
+        """
+        with open(path) as f:
+            lines = [line.rstrip('\n') for line in f if line.strip()]
+
+        if kind != 'tickets':
+            with self.lock, self.db:
+                self.db.execute('BEGIN')
+                self.db.execute('DELETE FROM record WHERE kind = ?', (kind,))
+                self.db.executemany(
+                    'INSERT INTO record (kind, line) VALUES (?, ?)',
+                    [(kind, line) for line in lines])
+            return len(lines)
+
+        count = 0
+        for line in lines:
+            trac_url, github_url = line.split('\t')
+            trac_id = trac_url.rsplit('/', 1)[-1]
+            if not trac_id.isdigit():
+                # A header line.
+                continue
+            journaled = self.getTicket(int(trac_id))
+            if journaled and journaled['github_url'] == github_url:
+                continue
+            repo = github_url.rsplit('/', 3)[1]
+            number = int(github_url.rsplit('/', 1)[1])
+            self.transition(
+                int(trac_id), 'imported', detail=f'imported from {path}',
+                repo=repo, github_number=number, github_url=github_url,
+                )
+            count += 1
+        return count
+
+    def exportTSV(self, kind, path, trac_ticket_prefix):
+        """
+        Write one of the `*_created.tsv` files from the journal.
+        """
+        if kind == 'tickets':
+            lines = [
+                [f'{trac_ticket_prefix}{trac_id}', github_url]
+                for trac_id, github_url in self.created().items()
+                ]
+        else:
+            lines = self.records(kind)
+
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            for fields in lines:
+                f.write('\t'.join(fields) + '\n')
+        os.replace(temporary, path)
+        return len(lines)
+
+
+def main():
+    """
+    Import or export all the TSV files.
+    """
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('import', 'export'):
+        print('Usage: journal.py import|export [JOURNAL-PATH]')
+        sys.exit(1)
+
+    journal = Journal(*sys.argv[2:])
+    for kind, path in TSV_FILES.items():
+        if sys.argv[1] == 'import':
+            if os.path.exists(path):
+                print(f'Imported {journal.importTSV(kind, path)} from {path}')
+        elif journal.records(kind) or (kind == 'tickets' and journal.created()):
+            import config
+            count = journal.exportTSV(kind, path, config.TRAC_TICKET_PREFIX)
+            print(f'Exported {count} to {path}')
+    journal.close()
+
+
+if __name__ == '__main__':
+    main()
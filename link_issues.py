@@ -6,13 +6,22 @@
 # This is done with the official API, not the bulk API,
 # because the bulk API triggers no backlinks.
 import datetime
+import os
 import pprint
 import re
 
 import requests
 import sqlite3
 import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import stage_timer
+import ticket_store
+from journal import JOURNAL_FILE, Journal
+from progress import Progress
 
 try:
     import config
@@ -22,29 +31,173 @@ except ModuleNotFoundError:
 # Set to False to perform actual GitHub issue creation.
 DRY_RUN = True
 
+# Set to True to post the comments from multiple workers,
+# paced by CONTENT_LIMITS instead of sleeping 10 seconds before each one.
+CONCURRENT = False
+WORKERS = 4
+
+# GitHub secondary rate limits for content creation, as (requests, seconds):
+# at most 80 per minute and 500 per hour, and at least 1 second apart.
+# https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api#about-secondary-rate-limits
+CONTENT_LIMITS = ((1, 1), (80, 60), (500, 3600))
+
+# Serialize appends to `links_created.tsv` between the workers.
+TSV_LOCK = threading.Lock()
+
+# The state journal of the ticket migration, opened by `main` if it exists.
+JOURNAL = None
+
+# The progress of the linking, started by `main`.
+PROGRESS = None
+
+# Wait for the rate limit reset when fewer calls are left.
+RATE_LIMIT_RESERVE = 10
+
+# The GitHub API root, which can point to a local stand-in like `fake_github`.
+GITHUB_API = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+
 
 def main():
     """
     Read the Trac DB and tickets on GitHub,
     and link from them to their PRs.
     """
-    tickets = list(select_tickets(read_trac_tickets()))
-    ticket_mapping = get_tickets()
+    global JOURNAL, PROGRESS
+    if os.path.exists(JOURNAL_FILE):
+        JOURNAL = Journal()
+
+    with stage_timer.stage('read tickets'):
+        tickets = list(select_tickets(read_trac_tickets()))
+        ticket_mapping = get_tickets()
 
     # Parse tickets into GitHub CommentRequest objects.
-    comments = list(CommentRequest.fromTracDataMultiple(
-        tickets, ticket_mapping=ticket_mapping
-        ))
+    with stage_timer.stage('parse tickets'):
+        comments = list(CommentRequest.fromTracDataMultiple(
+            tickets, ticket_mapping=ticket_mapping
+            ))
 
     print("Issues parsed. Starting to submit comments.")
 
-    for comment in comments:
-        print(f"Linking GH {comment.getGitHubLink()}")
-        comment.submit_link_to_pr()
+    PROGRESS = Progress(total=len(comments), reserve=RATE_LIMIT_RESERVE)
+    with stage_timer.stage('submit links'):
+        if CONCURRENT:
+            link_concurrently(comments)
+        else:
+            for comment in comments:
+                print(f"Linking GH {comment.getGitHubLink()}")
+                comment.submit_link_to_pr()
+                PROGRESS.done()
+    PROGRESS.finish()
 
     print("Issue creation complete. You may now manually open issues and PRs.")
 
 
+def link_concurrently(comments, pacer=None, workers=WORKERS):
+    """
+    Submit the comments from multiple workers, sharing one pacer.
+
+    Failed comments are not recorded in `links_created.tsv`,
+    so they are retried by the next run.
+    Returns the number of comments created.
+    """
+    if pacer is None:
+        pacer = Pacer()
+
+    start = time.monotonic()
+    linked = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(comment.submit_link_to_pr, pacer): comment
+            for comment in comments
+            }
+        for future in as_completed(futures):
+            comment = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                print(f"Failed to link GH {comment.getGitHubLink()}: {error}")
+                failed += 1
+            else:
+                print(f"Linked GH {comment.getGitHubLink()}")
+                linked += 1
+            if PROGRESS is not None:
+                PROGRESS.done()
+
+    elapsed = time.monotonic() - start
+    rate = linked * 60 / elapsed if elapsed else 0
+    print(
+        f"Linked {linked} issues in {elapsed:.0f}s "
+        f"({rate:.1f} comments per minute). {failed} failed.")
+    return linked
+
+
+class Pacer:
+    """
+    Space out the content creation requests of all the workers,
+    to stay within the GitHub secondary rate limits.
+
+    Besides the static `limits`, the responses are observed,
+    to wait for `Retry-After` and for the primary rate limit reset.
+    """
+    def __init__(self, limits=CONTENT_LIMITS, clock=None, sleep=None):
+        self.limits = limits
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        self.lock = threading.Lock()
+        # The times of the last requests, enough for the largest limit.
+        self.sent = deque(maxlen=max(count for count, _ in limits))
+        self.paused_until = 0
+
+    def delay(self, now):
+        """
+        Return the seconds to wait before the next request can be sent.
+        """
+        delay = self.paused_until - now
+        for count, period in self.limits:
+            # The request `count` places back must have left the period.
+            if len(self.sent) >= count:
+                delay = max(delay, self.sent[-count] + period - now)
+        return delay
+
+    def wait(self):
+        """
+        Block until a request can be sent, and count it as sent.
+        """
+        while True:
+            with self.lock:
+                now = self.clock()
+                delay = self.delay(now)
+                if delay <= 0:
+                    self.sent.append(now)
+                    return
+            self.sleep(delay)
+
+    def observe(self, response):
+        """
+        Pause all the workers as asked by the response headers.
+
+        Returns True when the request was refused by a rate limit,
+        and should be sent again.
+        """
+        headers = response.headers
+        remaining = int(
+            headers.get('X-RateLimit-Remaining', RATE_LIMIT_RESERVE))
+        pause = 0
+        if 'Retry-After' in headers:
+            pause = int(headers['Retry-After'])
+        elif remaining < RATE_LIMIT_RESERVE and 'X-RateLimit-Reset' in headers:
+            pause = 1 + int(headers['X-RateLimit-Reset']) - time.time()
+
+        if pause > 0:
+            print(f"Pausing all workers for {pause:.0f}s for rate limits.")
+            with self.lock:
+                self.paused_until = max(
+                    self.paused_until, self.clock() + pause)
+
+        return response.status_code in (403, 429) and pause > 0
+
+
 def select_tickets(tickets):
     """
     Easy-to-edit method to choose tickets to submit.
@@ -57,34 +210,31 @@ def select_tickets(tickets):
     tickets = [t for t in tickets if t['t_id'] in submitted_ids]
     tickets = [t for t in tickets if t['t_id'] == 2936]
 
-    # Only comment on tickets which have a branch (PR linked from Trac).
-    tickets = [t for t in tickets if t['branch']]
-
-    # Skip tickets where we have already linked the PR.
-    tickets = [
-        t for t in tickets
-        if t['t_id'] not in get_tickets('links_created.tsv')]
+    linked_ids = get_tickets('links_created.tsv')
+    return [t for t in tickets if needs_link(t, linked_ids)]
 
-    # Skip tickets created with the classic API which linked the PRs.
-    return [t for t in tickets if t['component'] != 'pr']
 
-    return tickets
+def needs_link(ticket, linked_ids):
+    """
+    Return True if a comment linking its PR is to be posted on the ticket.
+    """
+    return (
+        # Only comment on tickets which have a branch (PR linked from Trac).
+        bool(ticket['branch']) and
+        # Skip tickets where we have already linked the PR.
+        ticket['t_id'] not in linked_ids and
+        # Skip tickets created with the classic API which linked the PRs.
+        ticket['component'] != 'pr'
+        )
 
 
 def get_tickets(filename='tickets_created.tsv'):
     """
-    Reads the tickets_create.tsv, and returns a dictionary of
-    Trac ID -> GitHub URL of tickets that were sent to GitHub already.
+    Returns the TicketMappingStore of Trac ID -> GitHub URL
+    of the tickets in a TSV file like `tickets_created.tsv`.
+    The file is read only once per process.
     """
-    created_tickets = {}
-    with open(filename) as f:
-        for line in f:
-            if line.startswith(config.TRAC_TICKET_PREFIX):
-                trac_link, github_url = line.strip().split('\t')
-                trac_id = trac_link.split(config.TRAC_TICKET_PREFIX)[1]
-                trac_id = int(trac_id)
-                created_tickets[trac_id] = github_url
-    return created_tickets
+    return ticket_store.load(filename, config.TRAC_TICKET_PREFIX)
 
 
 def read_trac_tickets():
@@ -182,7 +332,7 @@ class CommentRequest:
         self.github_number = github_number
         self.github_pr_link = pr_link
 
-    def submit_link_to_pr(self):
+    def submit_link_to_pr(self, pacer=None):
         """
         Send a POST request to GitHub creating the comment.
 
@@ -190,14 +340,21 @@ class CommentRequest:
         https://docs.github.com/en/rest/reference/issues#create-an-issue-comment
         """
         response = protected_request(
-            url=self.commentsURL(), data={'body': self.commentText()}
+            url=self.commentsURL(), data={'body': self.commentText()},
+            pacer=pacer,
             )
 
         if response:
             # Remember the GitHub URL assigned to each ticket.
-            with open('links_created.tsv', 'a') as f:
-                comment_url = response.json()['html_url']
+            comment_url = response.json()['html_url']
+            with TSV_LOCK, open('links_created.tsv', 'a') as f:
                 f.write(f'{self.getTracURL(self.t_id)}\t{comment_url}\n')
+                ticket_store.remember(
+                    'links_created.tsv', self.t_id, comment_url)
+            if JOURNAL is not None:
+                JOURNAL.transition(self.t_id, 'linked', detail=comment_url)
+                JOURNAL.append(
+                    'links', [self.getTracURL(self.t_id), comment_url])
 
     def commentText(self):
         """
@@ -254,7 +411,7 @@ class CommentRequest:
         return issue
 
     def commentsURL(self):
-        return f'https://api.github.com/repos/' \
+        return f'{GITHUB_API}/repos/' \
                f'{config.OWNER}/{self.repo}/issues/{self.github_number}/comments'
 
 
@@ -276,13 +433,19 @@ def get_github_number(github_link) -> str:
     return github_link.rsplit('/', 1)[1]
 
 
+@stage_timer.timed('protected_request')
 def protected_request(
-        url, data, method=requests.post, expected_status_code=201):
+        url, data, method=requests.post, expected_status_code=201,
+        pacer=None):
     """
     Send a request if DRY_RUN is not truthy.
 
     In case of error, start the debugger.
     In case of nearing rate limit, sleep until it resets.
+
+    With a `Pacer`, wait for it instead of sleeping 10 seconds,
+    send the request again when refused by a rate limit,
+    and raise an error instead of starting the debugger.
     """
 
     if DRY_RUN:
@@ -290,36 +453,52 @@ def protected_request(
         pprint.pprint(data)
         return
 
-    # Obey secondary rate limit:
-    # https://docs.github.com/en/rest/guides/best-practices-for-integrators#dealing-with-secondary-rate-limits
-    time.sleep(10)
+    while True:
+        with stage_timer.stage('pacing'):
+            if pacer is None:
+                # Obey secondary rate limit:
+                # https://docs.github.com/en/rest/guides/best-practices-for-integrators#dealing-with-secondary-rate-limits
+                time.sleep(10)
+            else:
+                pacer.wait()
+
+        response = method(
+            url=url,
+            headers={'accept': 'application/vnd.github.v3+json'},
+            json=data,
+            auth=(config.OAUTH_USER, config.OAUTH_TOKEN)
+            )
 
-    response = method(
-        url=url,
-        headers={'accept': 'application/vnd.github.v3+json'},
-        json=data,
-        auth=(config.OAUTH_USER, config.OAUTH_TOKEN)
-        )
+        if PROGRESS is not None:
+            PROGRESS.observe(response)
+        if pacer is None or not pacer.observe(response):
+            break
 
     if response.status_code != expected_status_code:
+        if pacer is not None:
+            raise ValueError(
+                f'Request failed with {response.status_code}: '
+                f'{response.text}')
         print('Error: POST request failed!')
         print(response)
         pprint.pprint(response.json())
         import pdb
         pdb.set_trace()
 
-    wait_for_rate_reset(response)
+    if pacer is None:
+        wait_for_rate_reset(response)
 
     return response
 
 
+@stage_timer.timed('wait_for_rate_reset')
 def wait_for_rate_reset(response):
     """
     Wait for a rate limit reset in case it is near exhaustion.
     """
     remaining = int(response.headers['X-RateLimit-Remaining'])
     reset_time = int(response.headers['X-RateLimit-Reset'])
-    if remaining < 10:
+    if remaining < RATE_LIMIT_RESERVE:
         to_sleep = int(1 + reset_time - time.time())
         print(
             f"Waiting {to_sleep}s (until {reset_time}) for rate limit reset.")
@@ -327,4 +506,5 @@ def wait_for_rate_reset(response):
 
 
 if __name__ == '__main__':
+    stage_timer.start('link_issues')
     main()
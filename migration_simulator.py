@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Predict the GitHub API calls and the wall time of the migration scripts,
+before a real run, to check that they fit in the maintenance window.
+
+    python migration_simulator.py ../trac.db
+
+The plan (tickets by repository, comments, milestones, projects, PR links)
+is read from the Trac DB and the `*_created.tsv` files, like the scripts do,
+without contacting GitHub.
+The requests of each script are then replayed in simulated time against:
+
+* the primary rate limit of PRIMARY_LIMIT requests per hour
+* the secondary limits of 80 content creation requests per minute
+  and 500 per hour
+* a LATENCY for each request, and a log-normal duration of import jobs
+
+Edit the constants below to model other conditions.
+"""
+import math
+import os
+import random
+from collections import Counter, defaultdict, namedtuple
+from heapq import heappop, heappush
+
+import github_graphql
+import link_issues
+import ticket_migrate_golden_comet_preview as tm
+
+# Seconds for a request to get its response.
+LATENCY = 0.3
+# Median and log-normal sigma of the seconds until an import job is done.
+IMPORT_LATENCY_MEDIAN = 3
+IMPORT_LATENCY_SIGMA = 0.5
+# Requests per hour.
+PRIMARY_LIMIT = 5000
+# Content creation requests, as (requests, seconds), enforced by GitHub.
+GITHUB_CONTENT_LIMITS = ((80, 60), (500, 3600))
+# The values of `link_issues.WORKERS` to compare.
+LINK_WORKERS = (1, 2, 4, 8)
+
+# A request of a script. `content` is True for content creation requests.
+Request = namedtuple('Request', ['name', 'content'])
+
+# How a script spaces out its requests:
+# * sleep - seconds slept before each request
+# * locked - the sleep holds a lock shared by all workers
+# * paced - the script keeps within the content creation limits itself
+# * reserve - the remaining primary requests at which it waits for the reset
+Pacing = namedtuple('Pacing', ['sleep', 'locked', 'paced', 'reserve'])
+
+GOLDEN_COMET_PACING = Pacing(sleep=0.2, locked=True, paced=False, reserve=50)
+CLASSIC_PACING = Pacing(sleep=10, locked=False, paced=False, reserve=10)
+LINK_CONCURRENT_PACING = Pacing(sleep=0, locked=False, paced=True, reserve=10)
+
+GET_NUMBERS = Request('GET latest issue or pull', False)
+POST_MILESTONE = Request('POST milestone', True)
+POST_IMPORT = Request('POST import', True)
+GET_IMPORT = Request('GET import status', False)
+POST_GRAPHQL = Request('POST GraphQL issue IDs', False)
+POST_ISSUE = Request('POST issue', True)
+PATCH_CLOSE = Request('PATCH close issue', True)
+POST_PROJECT = Request('POST project', True)
+POST_COLUMN = Request('POST project column', True)
+PATCH_PROJECT = Request('PATCH close project', True)
+POST_CARD = Request('POST project card', True)
+POST_COMMENT = Request('POST comment', True)
+POST_LINK = Request('POST PR link comment', True)
+REFUSED = 'refused by secondary limits'
+
+
+def main():
+    """
+    Read the plan from the Trac DB, and print the predictions.
+    """
+    plan = Plan.fromTracDB()
+    print(
+        f'Plan: {len(plan.tickets)} tickets in {len(plan.byRepo())} '
+        f'repositories, {len(plan.new_milestones)} new milestones, '
+        f'{len(plan.new_projects)} new projects, '
+        f'{plan.comments} comments, {plan.links} PR links.')
+
+    predictions = predict(plan, import_latency=lognormal_latency())
+    for script, results in predictions.items():
+        print(f'\n{script}:')
+        best = min(results, key=lambda result: result[2])
+        for result in results:
+            setting, calls, seconds = result
+            marker = '  <- best' if result is best else ''
+            print(
+                f'  {setting}: {sum(calls.values())} requests, '
+                f'{format_duration(seconds)}{marker}')
+        setting, calls, seconds = best
+        for name, count in sorted(calls.items()):
+            print(f'    {count:8} {name}')
+
+
+class Plan:
+    """
+    What the scripts will send to GitHub.
+
+    `tickets` are dicts with the `t_id`, `component`, `repo`, `closed`,
+    `milestone`, `comments` (the number of Trac comments)
+    and `branch` of each ticket.
+    """
+    def __init__(
+            self, tickets, new_milestones=(), new_projects=(), linked_ids=()):
+        self.tickets = tickets
+        # Trac IDs of the tickets with their PR already linked.
+        self.linked_ids = linked_ids
+        # (repository, title) of the milestones not created yet.
+        self.new_milestones = set(new_milestones)
+        # Names of the classic projects not created yet.
+        self.new_projects = set(new_projects)
+
+    @classmethod
+    def fromTracDB(cls):
+        """
+        Read the tickets not created yet from the Trac DB.
+        """
+        comments = Counter(c['t_id'] for c in tm.read_trac_comments())
+        tickets = [
+            {
+                't_id': ticket['t_id'],
+                'component': ticket['component'],
+                'repo': tm.get_repo(ticket['component']),
+                'closed': ticket['status'] == 'closed',
+                'milestone': ticket['milestone'],
+                'comments': comments[ticket['t_id']],
+                'branch': ticket['branch'],
+                }
+            for ticket in tm.select_tickets(tm.read_trac_tickets())
+            ]
+
+        created_milestones = set()
+        if os.path.exists('milestones_created.tsv'):
+            with open('milestones_created.tsv') as f:
+                for line in f:
+                    title, _, *repo = line.rstrip('\n').split('\t')
+                    created_milestones.add(
+                        (repo[0] if repo else tm.config.FALLBACK_REPOSITORY,
+                         title))
+        created_projects = set()
+        if os.path.exists('projects_created.tsv'):
+            with open('projects_created.tsv') as f:
+                created_projects = {line.split('\t')[0] for line in f}
+
+        linked_ids = ()
+        if os.path.exists('links_created.tsv'):
+            linked_ids = link_issues.get_tickets('links_created.tsv')
+
+        milestones = {(t['repo'], t['milestone']) for t in tickets}
+        projects = {t['milestone'] for t in tickets}
+        return cls(
+            tickets,
+            new_milestones={
+                (repo, title) for repo, title in milestones
+                if title and (repo, title) not in created_milestones},
+            new_projects={
+                name for name in projects
+                if name and name not in created_projects},
+            linked_ids=linked_ids,
+            )
+
+    def byRepo(self):
+        """
+        Return a dict of repository -> tickets, in the plan order.
+        """
+        tickets_by_repo = defaultdict(list)
+        for ticket in self.tickets:
+            tickets_by_repo[ticket['repo']].append(ticket)
+        return tickets_by_repo
+
+    @property
+    def comments(self):
+        return sum(ticket['comments'] for ticket in self.tickets)
+
+    @property
+    def links(self):
+        """
+        The number of tickets on which `link_issues.py` will comment.
+        """
+        return sum(
+            1 for ticket in self.tickets
+            if link_issues.needs_link(ticket, self.linked_ids))
+
+
+class Simulation:
+    """
+    Replay the requests of a script in simulated time,
+    counting them, and modeling the GitHub limits.
+    """
+    def __init__(
+            self,
+            pacing,
+            latency=LATENCY,
+            primary_limit=PRIMARY_LIMIT,
+            content_limits=None,
+            ):
+        self.pacing = pacing
+        self.latency = latency
+        self.primary_limit = primary_limit
+        if content_limits is None:
+            content_limits = GITHUB_CONTENT_LIMITS
+            if pacing.paced:
+                content_limits = link_issues.CONTENT_LIMITS
+        self.content_limits = content_limits
+
+        self.calls = Counter()
+        self.lock_free = 0
+        self.window_start = 0
+        self.window_used = 0
+        self.content_times = []
+
+    def send(self, request, ready):
+        """
+        Return the time the response to a request is received,
+        for a worker ready to send it at `ready`.
+        """
+        if self.pacing.locked:
+            start = max(ready, self.lock_free) + self.pacing.sleep
+            self.lock_free = start
+        else:
+            start = ready + self.pacing.sleep
+
+        start = self.primarySlot(start)
+        if request.content:
+            allowed = self.contentSlot(start)
+            if allowed > start and not self.pacing.paced:
+                # GitHub refuses the request,
+                # and it is sent again after its `Retry-After`.
+                self.calls[REFUSED] += 1
+                self.primarySlot(start)
+            start = allowed
+            self.content_times.append(start)
+
+        self.calls[request.name] += 1
+        return start + self.latency
+
+    def primarySlot(self, start):
+        """
+        Use a request of the primary rate limit,
+        returning when it can be sent.
+        """
+        if start >= self.window_start + 3600:
+            self.window_start = start
+            self.window_used = 0
+        if self.window_used >= self.primary_limit - self.pacing.reserve:
+            # Wait for the rate limit reset.
+            start = self.window_start + 3600
+            self.window_start = start
+            self.window_used = 0
+        self.window_used += 1
+        return start
+
+    def contentSlot(self, start):
+        """
+        Return when a content creation request can be sent,
+        within the content limits.
+        """
+        while True:
+            delay = 0
+            for count, period in self.content_limits:
+                if len(self.content_times) >= count:
+                    delay = max(
+                        delay, self.content_times[-count] + period - start)
+            if delay <= 0:
+                return start
+            start += delay
+
+    def run(self, jobs, workers=1, start=0):
+        """
+        Run the jobs on a pool of workers, starting at `start`.
+
+        Each job is a generator of requests,
+        receiving the time each response is received.
+        Returns the time the last job is done.
+        """
+        jobs = iter(jobs)
+        pending = []
+        end = start
+        sequence = 0
+
+        def start_next(ready):
+            nonlocal sequence
+            for job in jobs:
+                try:
+                    request = next(job)
+                except StopIteration:
+                    continue
+                sequence += 1
+                heappush(pending, (ready, sequence, job, request))
+                return
+
+        for _ in range(workers):
+            start_next(start)
+
+        while pending:
+            ready, _, job, request = heappop(pending)
+            done = self.send(request, ready)
+            try:
+                request = job.send(done)
+            except StopIteration:
+                end = max(end, done)
+                start_next(done)
+            else:
+                sequence += 1
+                heappush(pending, (done, sequence, job, request))
+
+        return end
+
+
+def requests_job(requests):
+    """
+    A job sending a fixed list of requests.
+    """
+    for request in requests:
+        yield request
+
+
+def golden_comet_repo_job(tickets, import_latency):
+    """
+    Import the tickets of a repository, like `submit_issues`.
+    """
+    imported = 0
+    for ticket in tickets:
+        done_at = (yield POST_IMPORT) + import_latency()
+        # The import is checked at least once.
+        now = yield GET_IMPORT
+        while now < done_at:
+            now = yield GET_IMPORT
+
+        imported += 1
+        if imported % github_graphql.BATCH_SIZE == 0:
+            yield POST_GRAPHQL
+    if imported % github_graphql.BATCH_SIZE:
+        yield POST_GRAPHQL
+
+
+def simulate_golden_comet(plan, workers, import_latency, **kwargs):
+    """
+    Return the calls and seconds of `ticket_migrate_golden_comet_preview`,
+    with at most `workers` repositories submitted at once.
+    """
+    simulation = Simulation(GOLDEN_COMET_PACING, **kwargs)
+    tickets_by_repo = plan.byRepo()
+    setup = simulation.run([requests_job(
+        [GET_NUMBERS] * 2 * len(tickets_by_repo) +
+        [POST_MILESTONE] * len(plan.new_milestones)
+        )])
+    seconds = simulation.run(
+        [
+            golden_comet_repo_job(tickets, import_latency)
+            for tickets in tickets_by_repo.values()
+            ],
+        workers=workers,
+        start=setup,
+        )
+    return simulation.calls, seconds
+
+
+def classic_requests(plan):
+    """
+    The requests of `ticket_migrate`, in order.
+    """
+    yield from [GET_NUMBERS] * 2 * len(plan.byRepo())
+    new_projects = set(plan.new_projects)
+    for ticket in plan.tickets:
+        yield POST_ISSUE
+        if ticket['closed']:
+            yield PATCH_CLOSE
+        if ticket['milestone']:
+            if ticket['milestone'] in new_projects:
+                new_projects.remove(ticket['milestone'])
+                yield POST_PROJECT
+                yield from [POST_COLUMN] * 3
+                yield PATCH_PROJECT
+            yield POST_CARD
+        yield from [POST_COMMENT] * ticket['comments']
+
+
+def simulate_classic(plan, **kwargs):
+    """
+    Return the calls and seconds of `ticket_migrate`.
+    """
+    simulation = Simulation(CLASSIC_PACING, **kwargs)
+    seconds = simulation.run([requests_job(classic_requests(plan))])
+    return simulation.calls, seconds
+
+
+def simulate_links(plan, workers=None, **kwargs):
+    """
+    Return the calls and seconds of `link_issues`,
+    sequential if `workers` is None, otherwise concurrent.
+    """
+    if workers is None:
+        simulation = Simulation(CLASSIC_PACING, **kwargs)
+        jobs = [requests_job([POST_LINK] * plan.links)]
+        workers = 1
+    else:
+        simulation = Simulation(LINK_CONCURRENT_PACING, **kwargs)
+        jobs = [requests_job([POST_LINK]) for _ in range(plan.links)]
+    seconds = simulation.run(jobs, workers=workers)
+    return simulation.calls, seconds
+
+
+def predict(plan, import_latency, **kwargs):
+    """
+    Return a dict of script -> list of (setting, calls, seconds).
+    """
+    repos = max(1, len(plan.byRepo()))
+    return {
+        'ticket_migrate_golden_comet_preview.py': [
+            (f'REPOSITORY_WORKERS = {workers}', *simulate_golden_comet(
+                plan, workers, import_latency, **kwargs))
+            for workers in range(1, repos + 1)
+            ],
+        'ticket_migrate.py': [
+            ('sequential', *simulate_classic(plan, **kwargs)),
+            ],
+        'link_issues.py': [
+            ('sequential', *simulate_links(plan, **kwargs)),
+            ] + [
+            (f'CONCURRENT with {workers} WORKERS', *simulate_links(
+                plan, workers, **kwargs))
+            for workers in LINK_WORKERS
+            ],
+        }
+
+
+def lognormal_latency(
+        median=IMPORT_LATENCY_MEDIAN, sigma=IMPORT_LATENCY_SIGMA, seed=0):
+    """
+    Return a function generating import job durations.
+    """
+    generator = random.Random(seed)
+    return lambda: generator.lognormvariate(math.log(median), sigma)
+
+
+def format_duration(seconds):
+    """
+    Format seconds as hours and minutes.
+    """
+    minutes = math.ceil(seconds / 60)
+    return f'{minutes // 60}h {minutes % 60:02}m'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Report the progress of a submission loop.
+
+    progress = Progress(total=len(issues), reserve=50)
+    for issue in issues:
+        response = submit(issue)
+        progress.observe(response)
+        progress.done()
+    progress.finish()
+
+A line with the completed items, the throughput,
+the rate limit headroom and the ETA is printed
+at most every `interval` seconds, and when a rate limit pause starts.
+
+The throughput is measured over the last completed items,
+without the rate limit pauses.
+The ETA adds the pauses still to come:
+the calls for the remaining items are projected on the rate limit
+windows, pausing until the next reset each time
+the calls left in a window get down to `reserve`,
+as done by `wait_for_rate_reset`.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+# Seconds between progress lines.
+INTERVAL = 10
+
+# Completed items over which the throughput is measured.
+WINDOW = 50
+
+# The GitHub rate limit window, in seconds.
+RESET_PERIOD = 3600
+
+
+class Progress:
+    """
+    Track the completed items and the rate limit of a submission loop.
+    """
+
+    def __init__(
+            self, total, reserve=10, interval=INTERVAL, window=WINDOW,
+            clock=time.time, output=print):
+        self.total = total
+        self.reserve = reserve
+        self.interval = interval
+        self.clock = clock
+        self.output = output
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.requests = 0
+        # The rate limit from the headers of the last response.
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        # Pauses scheduled until a rate limit reset.
+        self.paused = 0
+        self.paused_until = 0
+        now = clock()
+        self.last_output = now
+        # The (time, completed, paused) samples of the last items.
+        self.samples = deque([(now, 0, 0)], maxlen=window + 1)
+
+    def _pausedAt(self, now):
+        """
+        Return the seconds paused so far, without the scheduled pause.
+        """
+        return self.paused - max(0, self.paused_until - now)
+
+    def observe(self, response):
+        """
+        Count a request, and keep the rate limit from its headers.
+
+        A pause is scheduled when the script will wait for the reset.
+        """
+        headers = response.headers
+        with self.lock:
+            self.requests += 1
+            now = self.clock()
+            until = None
+            if 'X-RateLimit-Remaining' in headers:
+                self.limit = int(headers.get('X-RateLimit-Limit', 0)) or None
+                self.remaining = int(headers['X-RateLimit-Remaining'])
+                self.reset = int(headers.get('X-RateLimit-Reset', 0)) or None
+                if self.remaining < self.reserve and self.reset:
+                    until = 1 + self.reset
+            if 'Retry-After' in headers:
+                until = now + int(headers['Retry-After'])
+            if until is None or until <= max(now, self.paused_until):
+                return
+            # Overlapping pauses are counted once.
+            self.paused += until - max(now, self.paused_until)
+            self.paused_until = until
+            self._output(now)
+
+    def done(self, count=1):
+        """
+        Count completed items, printing the progress if it's time.
+        """
+        with self.lock:
+            now = self.clock()
+            self.completed += count
+            self.samples.append((now, self.completed, self._pausedAt(now)))
+            if now - self.last_output >= self.interval:
+                self._output(now)
+
+    def finish(self):
+        """
+        Print the final progress.
+        """
+        with self.lock:
+            self._output(self.clock())
+
+    def rate(self):
+        """
+        Return the items completed per second over the last items,
+        without the pauses, or None if not known yet.
+        """
+        start, start_completed, start_paused = self.samples[0]
+        end, completed, paused = self.samples[-1]
+        working = (end - start) - (paused - start_paused)
+        if completed == start_completed or working <= 0:
+            return None
+        return (completed - start_completed) / working
+
+    def eta(self, now):
+        """
+        Return the seconds until all the items are completed,
+        or None if not known yet.
+        """
+        left = self.total - self.completed
+        if left <= 0:
+            return 0
+        rate = self.rate()
+        if rate is None:
+            return None
+
+        seconds = left / rate
+        pause = max(0, self.paused_until - now)
+        if self.requests and self.completed:
+            calls_per_item = self.requests / self.completed
+            seconds += self.projectSleep(
+                left * calls_per_item, rate * calls_per_item, now + pause)
+        return pause + seconds
+
+    def projectSleep(self, calls, call_rate, start):
+        """
+        Return the seconds paused for rate limit resets,
+        to send the `calls` at `call_rate` per second from `start`.
+        """
+        if self.limit is None or self.reset is None:
+            return 0
+        per_window = self.limit - self.reserve
+        if per_window <= 0:
+            return 0
+
+        if start < self.reset:
+            budget = max(0, self.remaining - self.reserve)
+            reset = self.reset
+        else:
+            # Already in a new window.
+            budget = per_window
+            reset = start + RESET_PERIOD
+
+        sleep = 0
+        clock = start
+        while calls > budget:
+            calls -= budget
+            clock += budget / call_rate
+            if clock < reset:
+                sleep += reset - clock
+                clock = reset
+            budget = per_window
+            reset = clock + RESET_PERIOD
+        return sleep
+
+    def line(self, now):
+        """
+        Return the progress as text.
+        """
+        parts = [f'{self.completed}/{self.total}']
+        if self.total:
+            parts[0] += f' ({self.completed * 100 / self.total:.0f}%)'
+
+        rate = self.rate()
+        if rate is not None:
+            parts.append(f'{rate * 60:.1f}/min')
+
+        if self.remaining is not None:
+            headroom = f'{self.remaining}'
+            if self.limit:
+                headroom += f'/{self.limit}'
+            headroom = f'rate limit {headroom} calls'
+            if self.reset:
+                headroom += f' until {format_time(self.reset)}'
+            parts.append(headroom)
+
+        if self.paused_until > now:
+            parts.append(
+                f'paused for {format_duration(self.paused_until - now)}')
+
+        eta = self.eta(now)
+        if eta is not None:
+            parts.append(
+                f'ETA {format_duration(eta)} at {format_time(now + eta)}')
+        return 'Progress: ' + ', '.join(parts)
+
+    def _output(self, now):
+        self.last_output = now
+        self.output(self.line(now))
+
+
+def format_duration(seconds):
+    """
+    Return the seconds as hours, minutes and seconds.
+    """
+    seconds = int(math.ceil(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f'{hours}h{minutes:02}m'
+    if minutes:
+        return f'{minutes}m{seconds:02}s'
+    return f'{seconds}s'
+
+
+def format_time(timestamp):
+    """
+    Return the local time of day of the Unix timestamp.
+    """
+    return time.strftime('%H:%M:%S', time.localtime(timestamp))
@@ -0,0 +1,223 @@
+"""
+Time the stages of the migration scripts.
+
+    stage_timer.start('ticket_migrate')
+
+    with stage_timer.stage('read tickets'):
+        tickets = list(read_trac_tickets())
+
+    @stage_timer.timed('parse_body')
+    def parse_body(description, ticket_mapping):
+        ...
+
+The time of a stage excludes the time of the stages nested in it,
+and is summed over all the threads.
+After `start`, a summary of the stages is printed at exit.
+
+With `MIGRATION_PROFILE=DIR` in the environment,
+each top-level stage is also profiled with cProfile,
+and dumped as `DIR/SCRIPT-STAGE.prof` at exit,
+for tools like snakeviz or flameprof.
+Only one stage is profiled at a time,
+so the stages of other threads are only timed.
+"""
+import atexit
+import cProfile
+import functools
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+# The directory for the profiles, if any.
+PROFILE_VARIABLE = 'MIGRATION_PROFILE'
+
+
+class StageTimer:
+    """
+    Accumulate the time and the calls of each stage.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.profile_dir = None
+        self.profiles = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiling = False
+
+    def _stack(self):
+        """
+        Return the stack of the stages running in the current thread.
+        """
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def stage(self, name):
+        """
+        Return a context manager timing the `name` stage.
+        """
+        return _Stage(self, name)
+
+    def iterate(self, name, iterable):
+        """
+        Yield from `iterable`, timing the production of each item
+        as the `name` stage.
+
+        This times a stage of a pipeline of generators.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _enter(self, name):
+        stack = self._stack()
+        profile = None
+        if not stack and self.profile_dir is not None:
+            profile = self._startProfile(name)
+        # The name, the start time, the time of the nested stages.
+        stack.append([name, self.clock(), 0, profile])
+
+    def _exit(self):
+        stack = self._stack()
+        name, started, nested, profile = stack.pop()
+        elapsed = self.clock() - started
+        if stack:
+            stack[-1][2] += elapsed
+        if profile is not None:
+            profile.disable()
+            self._profiling = False
+        with self._lock:
+            self.seconds[name] += elapsed - nested
+            self.calls[name] += 1
+
+    def _startProfile(self, name):
+        """
+        Enable the profile of the stage, unless another one is enabled.
+        """
+        with self._lock:
+            if self._profiling:
+                return None
+            profile = self.profiles.get(name)
+            if profile is None:
+                profile = self.profiles[name] = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is running, like `python -m cProfile`.
+                return None
+            self._profiling = True
+            return profile
+
+    def dumpProfiles(self, script):
+        """
+        Write the profile of each stage, returning their paths.
+        """
+        paths = []
+        for name, profile in sorted(self.profiles.items()):
+            slug = re.sub(r'[^a-zA-Z0-9_]+', '_', name).strip('_')
+            path = os.path.join(self.profile_dir, f'{script}-{slug}.prof')
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def lines(self):
+        """
+        Return the summary of the stages, the slowest first.
+        """
+        wall = self.clock() - self.started
+        result = [f'Total {wall:.1f}s. Time by stage, summed over threads:']
+        for name, seconds in self.seconds.most_common():
+            share = seconds * 100 / wall if wall else 0
+            result.append(
+                f'{seconds:10.2f}s {share:5.1f}% '
+                f'{self.calls[name]:8}x  {name}')
+        return result
+
+
+class _Stage:
+    """
+    A stage, as a context manager.
+    """
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer._enter(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer._exit()
+
+
+# The timer shared by all the modules of a script.
+TIMER = StageTimer()
+
+
+def stage(name):
+    """
+    Time a stage with the shared timer.
+    """
+    return TIMER.stage(name)
+
+
+def iterate(name, iterable):
+    """
+    Time the items of an iterable with the shared timer.
+    """
+    return TIMER.iterate(name, iterable)
+
+
+def timed(name):
+    """
+    Decorate a function to time its calls as the `name` stage.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with TIMER.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start(script, timer=None):
+    """
+    Start timing the script,
+    printing the summary and dumping the profiles at exit.
+    """
+    if timer is None:
+        timer = TIMER
+    timer.started = timer.clock()
+    timer.profile_dir = os.environ.get(PROFILE_VARIABLE) or None
+    if timer.profile_dir is not None:
+        os.makedirs(timer.profile_dir, exist_ok=True)
+    atexit.register(report, script, timer)
+    return timer
+
+
+def report(script, timer=None):
+    """
+    Print the summary of the stages, and dump the profiles.
+    """
+    if timer is None:
+        timer = TIMER
+    for line in timer.lines():
+        print(line)
+    if timer.profile_dir is not None:
+        for path in timer.dumpProfiles(script):
+            print('Profile written to', path)
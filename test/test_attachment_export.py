@@ -0,0 +1,113 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+
+import attachment_export
+
+ATTACHMENT_SCHEMA = """
+CREATE TABLE attachment (
+    type text, id text, filename text, size integer, time integer,
+    description text, author text, ipnr text
+    )
+"""
+
+
+def git(repo, *args):
+    """
+    Return the output of a git command.
+    """
+    return subprocess.run(
+        ('git',) + args,
+        cwd=repo,
+        check=True,
+        stdout=subprocess.PIPE,
+        ).stdout.decode('utf-8')
+
+
+class TestExportAttachments(unittest.TestCase):
+    """
+    The attachment files are committed at the paths
+    linked from the migrated tickets.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.env = os.path.join(self.path, 'trac')
+        self.repo = os.path.join(self.path, 'attachments')
+        os.mkdir(self.repo)
+        git(self.repo, 'init', '--quiet')
+        git(self.repo, 'config', 'user.name', 'Migrator')
+        git(self.repo, 'config', 'user.email', 'migrator@example.com')
+
+    def addAttachment(self, realm, parent_id, filename, content):
+        path = attachment_export.get_trac_path(
+            self.env, realm, parent_id, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def makeDB(self, attachments):
+        db_file = os.path.join(self.path, 'trac.db3')
+        db = sqlite3.connect(db_file)
+        db.execute(ATTACHMENT_SCHEMA)
+        db.executemany(
+            'INSERT INTO attachment VALUES (?, ?, ?, 0, ?, "", "adi", "")',
+            [item + (time,) for time, item in enumerate(attachments)])
+        db.commit()
+        db.close()
+        return db_file
+
+    def test_export(self):
+        """
+        Identical files are stored as a single blob,
+        and files already exported are skipped.
+        """
+        attachments = [
+            ('ticket', '5723', 'patch-for-5723.patch'),
+            ('ticket', '5724', 'copy.patch'),
+            ('wiki', 'Dev/Start', 'notes.txt'),
+            ]
+        self.addAttachment('ticket', '5723', 'patch-for-5723.patch', b'diff')
+        self.addAttachment('ticket', '5724', 'copy.patch', b'diff')
+        self.addAttachment('wiki', 'Dev/Start', 'notes.txt', b'\x00notes')
+
+        result = attachment_export.export_attachments(
+            attachments, self.env, self.repo, workers=2)
+
+        self.assertEqual((3, 1, []), result)
+        patch = (
+            'ticket/de1/de16c30ee166641da366bb04e3d0d53e0629adf6/'
+            'd1f782bc26dd1d35bbb3bfe4be40cf7c2e27a781.patch')
+        self.assertEqual('diff', git(self.repo, 'show', 'HEAD:' + patch))
+        self.assertEqual([], attachment_export.verify_attachments(
+            attachments, self.repo))
+
+        self.assertEqual((0, 0, []), attachment_export.export_attachments(
+            attachments, self.env, self.repo))
+        self.assertEqual(
+            '1\n', git(self.repo, 'rev-list', '--count', 'HEAD'))
+
+    def test_main_missing(self):
+        """
+        Attachments without a file are reported, and fail the verification.
+        """
+        db_file = self.makeDB([
+            ('ticket', '1', 'here.txt'),
+            ('ticket', '2', 'gone.txt'),
+            ])
+        self.addAttachment('ticket', '1', 'here.txt', b'here')
+
+        with self.assertRaises(SystemExit):
+            attachment_export.main([db_file, self.env, self.repo])
+
+        self.assertEqual(
+            [attachment_export.get_repo_path('ticket', '2', 'gone.txt')],
+            attachment_export.verify_attachments(
+                attachment_export.get_attachments(db_file), self.repo))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -67,3 +67,15 @@ class TestTracToFilename(unittest.TestCase):
             '/prefix/ticket/fc8/fc8d9e6e58db7ca861d6096d684bd0169ffd01cf/'
             'd1e7789f02d66b7ca7bd106e6fbc5ff950027d51'
             )
+
+    def test_get_path_wiki(self):
+        """
+        Attachments of wiki pages are in the `wiki` realm,
+        with the page name hashed as ID.
+        """
+        self.assertEqual(
+            get_attachment_path('/prefix', 'Dev/Start', 'notes.txt', 'wiki'),
+
+            '/prefix/wiki/' + trac_hash('Dev/Start')[:3] + '/' +
+            trac_hash('Dev/Start') + '/' + trac_hash('notes.txt') + '.txt'
+            )
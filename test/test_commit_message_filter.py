@@ -0,0 +1,140 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import commit_message_filter
+import config_test
+import ticket_store
+from commit_message_filter import MessageRewriter, filter_stream
+
+# Monkeypatch the SUT to use the test config.
+commit_message_filter.config = config_test
+
+TSV_TEXT = """
+https://trac.chevah.com/ticket/1234	https://github.com/chevah/server/issues/5459
+https://trac.chevah.com/ticket/10	https://github.com/chevah/sftpplus.com/issues/373
+"""
+
+
+def git(repo, *args, **kwargs):
+    """
+    Return the output of a git command.
+    """
+    return subprocess.run(
+        ('git',) + args,
+        cwd=repo,
+        check=True,
+        stdout=subprocess.PIPE,
+        **kwargs
+        ).stdout
+
+
+class TestMessageRewriter(unittest.TestCase):
+    """
+    The Trac references in commit messages point to GitHub issues.
+    """
+    def setUp(self):
+        self.store = ticket_store.TicketMappingStore.fromLines(
+            TSV_TEXT.splitlines(), config_test.TRAC_TICKET_PREFIX)
+        self.sut = MessageRewriter(
+            self.store, config_test.TRAC_TICKET_PREFIX, before=2000)
+
+    def test_rewrite(self):
+        self.assertEqual(
+            b'Fixes chevah/server#5459, refs: chevah/sftpplus.com#373.\n'
+            b'See chevah/server#5459 and '
+            b'https://github.com/chevah/server/issues/5459\n'
+            b'Merge pull request #10 from chevah/1234-fix\n',
+            self.sut.rewrite(
+                b'Fixes #1234, refs: #10.\n'
+                b'See trac:1234 and https://trac.chevah.com/ticket/1234\n'
+                b'Merge pull request #10 from chevah/1234-fix\n',
+                timestamp=1000),
+            )
+        self.assertEqual(1, self.sut.changed)
+
+    def test_not_migrated(self):
+        """
+        References to tickets not migrated are kept, and counted.
+        """
+        message = b'Fixes #99, ticket:99 and \xff.'
+
+        self.assertEqual(message, self.sut.rewrite(message, 1000))
+
+        self.assertEqual({99: 2}, self.sut.unknown)
+
+    def test_before(self):
+        """
+        Commits done after the migration are not changed.
+        """
+        message = b'Fixes #1234.'
+
+        self.assertEqual(message, self.sut.rewrite(message, 2000))
+
+
+class TestFilterStream(unittest.TestCase):
+    """
+    The filter rewrites a fast-export stream for fast-import.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.source = os.path.join(self.path, 'source')
+        self.target = os.path.join(self.path, 'target')
+        for repo in [self.source, self.target]:
+            os.mkdir(repo)
+            git(repo, 'init', '--quiet')
+            git(repo, 'config', 'user.name', 'Dev')
+            git(repo, 'config', 'user.email', 'dev@example.com')
+
+    def commit(self, name, content, message, date):
+        with open(os.path.join(self.source, name), 'wb') as f:
+            f.write(content)
+        git(self.source, 'add', name)
+        env = dict(
+            os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+        git(self.source, 'commit', '--quiet', '-m', message, env=env)
+
+    def test_history(self):
+        """
+        Only the messages are changed, and blobs are copied as they are.
+        """
+        store = ticket_store.TicketMappingStore.fromLines(
+            TSV_TEXT.splitlines(), config_test.TRAC_TICKET_PREFIX)
+        rewriter = MessageRewriter(
+            store, config_test.TRAC_TICKET_PREFIX, before=1500000000)
+        binary = bytes(range(256)) * 3 + b'\ndata 5\nFixes #1234'
+        self.commit('a.bin', binary, 'Fixes #1234.', '1400000000 +0000')
+        self.commit('b.txt', b'#10', 'Refs #10.', '1600000000 +0000')
+        export = git(
+            self.source, 'fast-export', '--all', '--reencode=yes')
+        output = io.BytesIO()
+
+        filter_stream(io.BytesIO(export), output, rewriter)
+        git(self.target, 'fast-import', '--quiet', input=output.getvalue())
+
+        self.assertEqual(
+            b'Refs #10.\nFixes chevah/server#5459.\n',
+            git(self.target, 'log', '--format=%s', 'master'))
+        self.assertEqual(
+            binary, git(self.target, 'show', 'master:a.bin'))
+        self.assertEqual(
+            git(self.source, 'rev-parse', 'HEAD^{tree}'),
+            git(self.target, 'rev-parse', 'master^{tree}'))
+        self.assertEqual((2, 1), (rewriter.commits, rewriter.changed))
+
+    def test_truncated(self):
+        rewriter = MessageRewriter(
+            ticket_store.TicketMappingStore(), 'https://trac/ticket/')
+
+        with self.assertRaises(ValueError):
+            filter_stream(
+                io.BytesIO(b'blob\nmark :1\ndata 10\nshort'),
+                io.BytesIO(), rewriter)
+
+
+if __name__ == '__main__':
+    unittest.main()
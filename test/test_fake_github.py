@@ -0,0 +1,668 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import requests
+
+import config_test
+import fake_github
+import github_graphql
+import http_cache
+from journal import Journal
+import link_issues as li
+from test.test_link_issues import FakeClock
+import ticket_migrate as classic
+import ticket_migrate_golden_comet_preview as tm
+
+# Monkeypatch the SUT to use the test config.
+classic.config = config_test
+li.config = config_test
+tm.config = config_test
+
+
+class FakeGitHubTestCase(unittest.TestCase):
+    """
+    Run the scripts against a local fake GitHub,
+    from a temporary directory for the state files.
+    """
+    def setUp(self):
+        self.github = self.makeGitHub()
+        self.server = fake_github.FakeGitHubServer(self.github).start()
+        self.addCleanup(self.server.stop)
+
+        for module in [classic, li, tm]:
+            patcher = patch.multiple(
+                module, GITHUB_API=self.server.url, DRY_RUN=False)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        cwd = os.getcwd()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        os.chdir(self.path)
+        self.addCleanup(os.chdir, cwd)
+        for name in [
+                'tickets_created.tsv',
+                'milestones_created.tsv',
+                'projects_created.tsv',
+                ]:
+            open(name, 'w').close()
+
+        # The scripts sleep to respect the GitHub secondary rate limits.
+        sleep_patcher = patch('time.sleep')
+        sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def makeGitHub(self):
+        return fake_github.FakeGitHub()
+
+    def readFile(self, name):
+        with open(name) as f:
+            return f.read()
+
+
+class TestGoldenCometSubmit(FakeGitHubTestCase):
+    """
+    `GitHubRequest.submit` imports issues and waits for them.
+    """
+    def makeGitHub(self):
+        return fake_github.FakeGitHub(import_duration=0.05)
+
+    @staticmethod
+    def makeRequest(trac_id):
+        return tm.GitHubRequest(
+            owner='chevah',
+            repo='client',
+            trac_id=trac_id,
+            title=f'Ticket {trac_id}',
+            body='body',
+            closed=True,
+            resolution='fixed',
+            milestone=None,
+            labels=['fixed'],
+            assignees=[],
+            created_at='2010-11-04T15:04:51Z',
+            updated_at='2010-11-05T15:04:51Z',
+            )
+
+    def test_submit(self):
+        """
+        The issue is imported, polled until created,
+        and recorded in `tickets_created.tsv`.
+        """
+        self.github.addPull('client')
+        request = self.makeRequest(2)
+
+        request.submit(2, all_comments={}, ticket_mapping={})
+
+        self.assertEqual(2, request.github_number)
+        self.assertEqual('closed', self.github.issues['client'][2]['state'])
+        self.assertEqual(
+            'https://trac.chevah.com/ticket/2\t'
+            'https://github.com/chevah/client/issues/2\n',
+            self.readFile('tickets_created.tsv'))
+        self.assertEqual(1, self.github.calls['startImport'])
+        # The IDs are resolved later, in batches.
+        self.assertIsNone(request.github_id)
+        self.assertEqual(0, self.github.calls['getIssue'])
+
+    def test_submit_issues_verify(self):
+        """
+        The IDs of the imported issues are resolved in batches,
+        with one GraphQL query each.
+        """
+        patcher = patch.object(github_graphql, 'BATCH_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        issues = [self.makeRequest(number) for number in range(1, 4)]
+
+        tm.submit_issues(
+            [(issue, issue.t_id) for issue in issues],
+            all_comments={},
+            ticket_mapping={},
+            )
+
+        self.assertEqual(
+            [self.github.issues['client'][n]['id'] for n in range(1, 4)],
+            [issue.github_id for issue in issues])
+        self.assertEqual(
+            f'I_{issues[0].github_id}', issues[0].github_node_id)
+        self.assertEqual(2, self.github.calls['graphql'])
+        self.assertEqual(0, self.github.calls['getIssue'])
+
+    def test_verify_issues_missing(self):
+        """
+        Issues which can not be read back are returned, to be checked later.
+        """
+        self.github.addIssue('client', {'title': 'Ticket 1'})
+        found = self.makeRequest(1)
+        found.github_number = 1
+        missing = self.makeRequest(2)
+        missing.github_number = 2
+
+        self.assertEqual([missing], tm.verify_issues([found, missing]))
+        self.assertEqual(
+            self.github.issues['client'][1]['id'], found.github_id)
+        with self.assertRaises(tm.MigrationStopped):
+            tm.wait_for_issues([missing])
+
+    def test_submit_fillers(self):
+        """
+        Placeholder issues planned as fillers are imported closed,
+        in their place, and are not recorded as migrated tickets.
+        """
+        issues_by_repo = {'client': [(self.makeRequest(2), 2)]}
+        tm.add_fillers(issues_by_repo, {'client': [1]})
+
+        tm.submit_issues(
+            issues_by_repo['client'], all_comments={}, ticket_mapping={})
+
+        filler = self.github.issues['client'][1]
+        self.assertEqual('Placeholder', filler['title'])
+        self.assertEqual('closed', filler['state'])
+        self.assertEqual('Ticket 2', self.github.issues['client'][2]['title'])
+        self.assertEqual(
+            'https://trac.chevah.com/ticket/2\t'
+            'https://github.com/chevah/client/issues/2\n',
+            self.readFile('tickets_created.tsv'))
+
+    def test_submit_journal_resume(self):
+        """
+        With a journal, a ticket posted before a crash is resumed
+        by checking its import job, without importing it again.
+        """
+        journal = Journal(os.path.join(self.path, 'journal.sqlite3'))
+        self.addCleanup(journal.close)
+        patcher = patch.object(tm, 'JOURNAL', journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        crashed = self.makeRequest(1)
+        crashed._checkImport = lambda: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            crashed.submit(1, all_comments={}, ticket_mapping={})
+        self.assertEqual('posted', journal.getTicket(1)['state'])
+
+        tm.submit_issues(
+            [(self.makeRequest(1), 1)], all_comments={}, ticket_mapping={})
+
+        self.assertEqual(1, self.github.calls['startImport'])
+        self.assertEqual(
+            ['rendered', 'posted', 'imported', 'verified'],
+            [state for state, _ in journal.history(1)])
+
+    def test_resume_before_planning(self):
+        """
+        An import posted before a crash is resolved before planning,
+        so its ticket keeps its number and the others are planned after it.
+        """
+        journal = Journal(os.path.join(self.path, 'journal.sqlite3'))
+        self.addCleanup(journal.close)
+        patcher = patch.object(tm, 'JOURNAL', journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        crashed = self.makeRequest(1)
+        crashed._checkImport = lambda: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            crashed.submit(1, all_comments={}, ticket_mapping={})
+        # The import finishes on GitHub during the crash.
+        for job in self.github.imports.values():
+            job['ready_at'] = 0
+
+        tm.resume_pending_imports()
+        tickets = tm.select_tickets([
+            {'t_id': 1, 'component': 'client'},
+            {'t_id': 2, 'component': 'client'},
+            ])
+        ordered, numbers = tm.NumberPredictor().orderTickets(
+            tickets, already_created=tm.get_tickets().values())
+
+        self.assertEqual([2], [ticket['t_id'] for ticket in ordered])
+        self.assertEqual([2], numbers)
+        self.assertEqual(
+            'https://trac.chevah.com/ticket/1\t'
+            'https://github.com/chevah/client/issues/1\n',
+            self.readFile('tickets_created.tsv'))
+        self.assertEqual('imported', journal.getTicket(1)['state'])
+        self.assertEqual({}, journal.pendingImports())
+
+    def test_resume_failed_import(self):
+        """
+        A ticket whose import failed before resuming is planned again.
+        """
+        journal = Journal(os.path.join(self.path, 'journal.sqlite3'))
+        self.addCleanup(journal.close)
+        patcher = patch.object(tm, 'JOURNAL', journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.github.fail_import = lambda data: [{'message': 'Invalid.'}]
+
+        crashed = self.makeRequest(1)
+        crashed._checkImport = lambda: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            crashed.submit(1, all_comments={}, ticket_mapping={})
+
+        tm.resume_pending_imports()
+
+        self.assertEqual('failed', journal.getTicket(1)['state'])
+        self.assertEqual('', self.readFile('tickets_created.tsv'))
+        self.assertEqual(
+            [{'t_id': 1}], tm.select_tickets([{'t_id': 1}]))
+
+    def test_submit_mismatch(self):
+        """
+        An issue not created with the expected number stops the migration.
+        """
+        with self.assertRaises(ValueError):
+            self.makeRequest(2).submit(2, all_comments={}, ticket_mapping={})
+
+    def test_requestNextNumber(self):
+        """
+        The next number takes into account both issues and pulls.
+        """
+        self.github.addPull('client')
+        self.github.addPull('client')
+
+        self.assertEqual(
+            3, tm.NumberPredictor().requestNextNumber('client', []))
+
+    def test_getOrCreateMilestone(self):
+        """
+        The milestone is created in the repository, and remembered.
+        """
+        patcher = patch.multiple(
+            tm.GitHubRequest,
+            milestones={},
+            milestoneDescriptions={'2.0': 'Second release.'},
+            )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        number = tm.GitHubRequest.getOrCreateMilestone(
+            'client', '2.0', ticket_mapping={})
+        tm.GitHubRequest.getOrCreateMilestone(
+            'client', '2.0', ticket_mapping={})
+
+        self.assertEqual(1, number)
+        self.assertEqual(
+            'closed', self.github.milestones['client']['2.0']['state'])
+        self.assertEqual(1, self.github.calls['createMilestone'])
+        self.assertEqual('2.0\t1\tclient\n', self.readFile(
+            'milestones_created.tsv'))
+
+
+class TestUnattended(FakeGitHubTestCase):
+    """
+    In unattended mode, failed tickets are retried or set aside,
+    without stopping in the debugger.
+    """
+    def makeGitHub(self):
+        def fail_import(data):
+            if data['issue']['title'] == 'Ticket 2':
+                return [{'code': 'custom', 'message': 'Too many labels.'}]
+
+        return fake_github.FakeGitHub(fail_import=fail_import)
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(tm, 'UNATTENDED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dead_letter(self):
+        """
+        A ticket failing to import is recorded in the dead letter file,
+        and a placeholder keeps its number, so the next tickets match.
+        """
+        tm.submit_issues(
+            [
+                (TestGoldenCometSubmit.makeRequest(1), 1),
+                (TestGoldenCometSubmit.makeRequest(2), 2),
+                (TestGoldenCometSubmit.makeRequest(3), 3),
+                ],
+            all_comments={},
+            ticket_mapping={},
+            )
+
+        issues = self.github.issues['client']
+        self.assertEqual('Ticket 1', issues[1]['title'])
+        self.assertEqual('Placeholder for Trac ticket 2', issues[2]['title'])
+        self.assertEqual('Ticket 3', issues[3]['title'])
+
+        failed, = [
+            json.loads(line)
+            for line in self.readFile('tickets_failed.jsonl').splitlines()
+            ]
+        self.assertEqual('https://trac.chevah.com/ticket/2', failed['trac_url'])
+        self.assertEqual(2, failed['expected_number'])
+        self.assertIn('Too many labels.', failed['response'])
+
+    def test_dead_letter_journal(self):
+        """
+        A failed ticket stays failed in the journal,
+        with the number of its placeholder.
+        """
+        journal = Journal(os.path.join(self.path, 'journal.sqlite3'))
+        self.addCleanup(journal.close)
+        patcher = patch.object(tm, 'JOURNAL', journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        tm.submit_issues(
+            [
+                (TestGoldenCometSubmit.makeRequest(1), 1),
+                (TestGoldenCometSubmit.makeRequest(2), 2),
+                ],
+            all_comments={},
+            ticket_mapping={},
+            )
+
+        ticket = journal.getTicket(2)
+        self.assertEqual('failed', ticket['state'])
+        self.assertIsNone(ticket['github_number'])
+        history = journal.history(2)
+        self.assertEqual(
+            ['rendered', 'posted', 'failed', 'failed'],
+            [state for state, _ in history])
+        self.assertEqual('Placeholder created as client #2.', history[-1][1])
+        self.assertEqual('verified', journal.getTicket(1)['state'])
+
+    def test_filler_failed(self):
+        """
+        A filler failing to import is sent again,
+        and recorded without a Trac URL.
+        """
+        failures = [[{'code': 'custom', 'message': 'Busy.'}]]
+
+        def fail_import(data):
+            if data['issue']['title'] == 'Placeholder' and failures:
+                return failures.pop()
+
+        self.github.fail_import = fail_import
+        issues_by_repo = {
+            'client': [(TestGoldenCometSubmit.makeRequest(2), 2)]}
+        tm.add_fillers(issues_by_repo, {'client': [1]})
+        all_comments = {}
+
+        tm.submit_issues(
+            issues_by_repo['client'],
+            all_comments=all_comments,
+            ticket_mapping={},
+            )
+
+        issues = self.github.issues['client']
+        self.assertEqual('Placeholder', issues[1]['title'])
+        self.assertEqual('Ticket 2', issues[2]['title'])
+        self.assertEqual({}, all_comments)
+        failed, = [
+            json.loads(line)
+            for line in self.readFile('tickets_failed.jsonl').splitlines()
+            ]
+        self.assertIsNone(failed['trac_url'])
+        self.assertTrue(failed['filler'])
+        self.assertEqual(1, failed['expected_number'])
+
+    def test_mismatch_stops(self):
+        """
+        When the numbers no longer match, the submission stops.
+        """
+        self.github.addPull('client')
+
+        with self.assertRaises(tm.MigrationStopped):
+            tm.submit_issues(
+                [(TestGoldenCometSubmit.makeRequest(1), 1)],
+                all_comments={},
+                ticket_mapping={},
+                )
+
+    def test_retry(self):
+        """
+        Temporary errors are retried,
+        checking the started import instead of importing again.
+        """
+        request = TestGoldenCometSubmit.makeRequest(1)
+        original_check = request._checkImport
+        failures = [requests.get(f'{self.server.url}/unknown')]
+
+        def check_import():
+            if failures:
+                response = failures.pop()
+                response.status_code = 502
+                raise tm.SubmitError.fromResponse(response)
+            return original_check()
+
+        request._checkImport = check_import
+
+        tm.submit_with_retries(request, 1, all_comments={}, ticket_mapping={})
+
+        self.assertEqual(1, request.github_number)
+        self.assertEqual(1, self.github.calls['startImport'])
+        self.assertEqual(1, self.github.calls['checkImport'])
+
+    def failGraphQL(self, failures):
+        """
+        Fail the next GraphQL queries with the (status, body) failures.
+        """
+        original = self.github.graphql
+
+        def graphql(query, data):
+            if failures:
+                return failures.pop(0)
+            return original(query=query, data=data)
+
+        patcher = patch.object(self.github, 'graphql', graphql)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_verify_retry(self):
+        """
+        Failed GraphQL queries are retried.
+        """
+        self.github.addIssue('client', {'title': 'Ticket 1'})
+        request = TestGoldenCometSubmit.makeRequest(1)
+        request.github_number = 1
+        self.failGraphQL([
+            (502, {'message': 'Server Error'}),
+            (200, {'errors': [{'type': 'INTERNAL'}]}),
+            (200, {}),
+            ])
+
+        self.assertEqual([], tm.verify_issues([request]))
+        self.assertEqual(
+            self.github.issues['client'][1]['id'], request.github_id)
+        self.assertEqual(4, self.github.calls['graphql'])
+
+    def test_verify_stops(self):
+        """
+        The migration stops when the issues can not be verified.
+        """
+        request = TestGoldenCometSubmit.makeRequest(1)
+        request.github_number = 1
+        self.failGraphQL([(401, {'message': 'Bad credentials'})])
+
+        with self.assertRaises(tm.MigrationStopped):
+            tm.verify_issues([request])
+        self.assertEqual(1, self.github.calls['graphql'])
+
+
+class TestSubmitError(unittest.TestCase):
+    """
+    Failed responses are classified as temporary or permanent.
+    """
+    @staticmethod
+    def makeResponse(status_code, text='{}', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = text.encode('utf-8')
+        response.headers.update(headers or {})
+        response.request = requests.Request('POST', 'https://a.b/c').prepare()
+        response.url = 'https://a.b/c'
+        return response
+
+    def test_secondary_rate_limit(self):
+        error = tm.SubmitError.fromResponse(self.makeResponse(
+            403, headers={'Retry-After': '60'}))
+
+        self.assertTrue(error.retry)
+        self.assertEqual(60, error.retry_after)
+
+    def test_server_error(self):
+        error = tm.SubmitError.fromResponse(self.makeResponse(502))
+
+        self.assertTrue(error.retry)
+        self.assertIsNone(error.retry_after)
+
+    def test_validation_error(self):
+        error = tm.SubmitError.fromResponse(self.makeResponse(
+            422, '{"message": "Validation Failed"}'))
+
+        self.assertFalse(error.retry)
+
+    def test_forbidden(self):
+        """
+        A 403 not caused by rate limits is permanent.
+        """
+        error = tm.SubmitError.fromResponse(self.makeResponse(
+            403, '{"message": "Resource not accessible by integration"}'))
+
+        self.assertFalse(error.retry)
+
+
+class TestClassicSubmit(FakeGitHubTestCase):
+    """
+    The classic API script creates issues, closes them,
+    and adds them to projects.
+    """
+    def test_submit_to_project(self):
+        request = classic.GitHubRequest(
+            owner='chevah',
+            repo='server',
+            trac_id=1,
+            title='title',
+            body='body',
+            closed=True,
+            resolution='fixed',
+            milestone='2.0',
+            labels=[],
+            assignees=[],
+            )
+
+        request.submit(1)
+        request.closeIfNeeded()
+        request.submitToProject()
+
+        self.assertEqual('closed', self.github.issues['server'][1]['state'])
+        project, = self.github.projects.values()
+        self.assertEqual('closed', project['state'])
+        card, = self.github.cards.values()
+        done_column = self.github.columns[card['column_id']]
+        self.assertEqual('Done', done_column['name'])
+        self.assertEqual(request.github_id, card['content_id'])
+
+
+class TestLinkIssues(FakeGitHubTestCase):
+    """
+    `CommentRequest.submit_link_to_pr` comments on the issue.
+    """
+    def test_submit_link_to_pr(self):
+        self.github.addIssue('server', {'title': 'issue'})
+        comment = li.CommentRequest(
+            trac_id=5,
+            repo='server',
+            github_number=1,
+            pr_link='https://github.com/chevah/server/pull/9',
+            )
+
+        comment.submit_link_to_pr()
+
+        posted, = self.github.comments['server'][1]
+        self.assertEqual(
+            'PR for trac-5 is at https://github.com/chevah/server/pull/9.',
+            posted['body'])
+        self.assertEqual(
+            f'https://trac.chevah.com/ticket/5\t{posted["html_url"]}\n',
+            self.readFile('links_created.tsv'))
+
+    def test_link_concurrently(self):
+        """
+        Comments are posted by multiple workers,
+        spaced out by the shared pacer, and all recorded.
+        """
+        clock = FakeClock()
+        comments = []
+        for number in range(1, 6):
+            self.github.addIssue('server', {'title': f'issue {number}'})
+            comments.append(li.CommentRequest(
+                trac_id=number,
+                repo='server',
+                github_number=number,
+                pr_link=f'https://github.com/chevah/server/pull/{number}',
+                ))
+
+        linked = li.link_concurrently(
+            comments, pacer=li.Pacer(clock=clock, sleep=clock.sleep))
+
+        self.assertEqual(5, linked)
+        self.assertEqual(5, self.github.calls['createComment'])
+        self.assertEqual(
+            list(range(1, 6)),
+            sorted(
+                int(line.split('\t')[0].rsplit('/', 1)[1])
+                for line in self.readFile('links_created.tsv').splitlines()
+                ))
+        self.assertGreaterEqual(clock.now, 4)
+
+
+class TestRateLimits(FakeGitHubTestCase):
+    """
+    The fake GitHub emits rate limit headers and errors.
+    """
+    def makeGitHub(self):
+        return fake_github.FakeGitHub(rate_limit=100, secondary_limit=2)
+
+    def test_primary_headers(self):
+        """
+        Each request uses one unit of the primary rate limit.
+        """
+        url = f'{self.server.url}/repos/chevah/server/issues'
+        requests.get(url)
+        response = requests.get(url)
+
+        self.assertEqual('100', response.headers['X-RateLimit-Limit'])
+        self.assertEqual('98', response.headers['X-RateLimit-Remaining'])
+        self.assertIn('X-RateLimit-Reset', response.headers)
+
+    def test_secondary_limit(self):
+        """
+        Content creation over the secondary limit is refused.
+        """
+        url = f'{self.server.url}/repos/chevah/server/issues'
+        statuses = [
+            requests.post(url, json={'title': 't'}).status_code
+            for _ in range(3)
+            ]
+        response = requests.post(url, json={'title': 't'})
+
+        self.assertEqual([201, 201, 403], statuses)
+        self.assertIn('secondary rate limit', response.json()['message'])
+        self.assertIn('Retry-After', response.headers)
+
+    def test_conditional_request(self):
+        """
+        Unchanged resources are served from the HTTP cache,
+        without using the primary rate limit.
+        """
+        url = f'{self.server.url}/repos/chevah/server/issues'
+        http_cache.get(url)
+        response = http_cache.get(url)
+
+        self.assertEqual([], response.json())
+        self.assertEqual('99', response.headers['X-RateLimit-Remaining'])
+
+
+if __name__ == '__main__':
+    unittest.main()
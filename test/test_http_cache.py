@@ -0,0 +1,120 @@
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+import http_cache
+
+
+def make_response(status_code, content=b'', headers=None):
+    """
+    Create a `requests.Response` as received from the server.
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
+
+
+class TestConditionalCache(unittest.TestCase):
+    """
+    GET responses with validators are cached on disk,
+    and sent as conditional requests on the next GET.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.sut = http_cache.ConditionalCache(self.path)
+
+        self.sent_headers = []
+        self.responses = []
+        original_get = http_cache.requests.get
+        self.addCleanup(setattr, http_cache.requests, 'get', original_get)
+        http_cache.requests.get = self.fakeGet
+
+    def fakeGet(self, url, headers, auth, params):
+        """
+        Remember the request headers, and return the next response.
+        """
+        self.sent_headers.append(headers)
+        return self.responses.pop(0)
+
+    def test_first_request_unconditional(self):
+        """
+        A URL never seen before is requested without validators.
+        """
+        self.responses.append(make_response(200, b'[]', {'ETag': '"a"'}))
+
+        response = self.sut.get('https://api.example.com/issues')
+
+        self.assertEqual([], response.json())
+        self.assertNotIn('If-None-Match', self.sent_headers[0])
+
+    def test_not_modified(self):
+        """
+        The second request sends the ETag,
+        and a `304` reply returns the cached content with the new headers.
+        """
+        self.responses.append(make_response(
+            200, b'[{"number": 3}]',
+            {'ETag': '"a"', 'X-RateLimit-Remaining': '10'},
+            ))
+        self.responses.append(make_response(
+            304, headers={'X-RateLimit-Remaining': '9'}))
+
+        self.sut.get('https://api.example.com/issues', params={'page': 1})
+        response = self.sut.get(
+            'https://api.example.com/issues', params={'page': 1})
+
+        self.assertEqual('"a"', self.sent_headers[1]['If-None-Match'])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'number': 3}], response.json())
+        self.assertEqual('9', response.headers['X-RateLimit-Remaining'])
+
+    def test_modified(self):
+        """
+        A new `200` reply replaces the cached content.
+        """
+        self.responses.append(make_response(200, b'1', {'ETag': '"a"'}))
+        self.responses.append(make_response(200, b'2', {'ETag': '"b"'}))
+        self.responses.append(make_response(304))
+
+        self.sut.get('https://api.example.com/issues')
+        self.sut.get('https://api.example.com/issues')
+        response = self.sut.get('https://api.example.com/issues')
+
+        self.assertEqual('"b"', self.sent_headers[2]['If-None-Match'])
+        self.assertEqual(2, response.json())
+
+    def test_different_params(self):
+        """
+        The query parameters are part of the cache key.
+        """
+        self.responses.append(make_response(200, b'1', {'ETag': '"a"'}))
+        self.responses.append(make_response(200, b'2', {'ETag': '"b"'}))
+
+        self.sut.get('https://api.example.com/issues', params={'page': 1})
+        self.sut.get('https://api.example.com/issues', params={'page': 2})
+
+        self.assertNotIn('If-None-Match', self.sent_headers[1])
+
+    def test_no_validators(self):
+        """
+        Responses without `ETag` or `Last-Modified` are not cached,
+        nor are errors.
+        """
+        self.responses.append(make_response(200, b'1'))
+        self.responses.append(make_response(404, b'{}', {'ETag': '"a"'}))
+        self.responses.append(make_response(200, b'1'))
+
+        self.sut.get('https://api.example.com/issues')
+        self.sut.get('https://api.example.com/issues')
+        self.sut.get('https://api.example.com/issues')
+
+        self.assertNotIn('If-None-Match', self.sent_headers[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    """
+    The journal records the state transitions of each ticket.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.sut = Journal(os.path.join(self.path, 'journal.sqlite3'))
+        self.addCleanup(self.sut.close)
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_wal_mode(self):
+        """
+        The journal is in write-ahead-log mode.
+        """
+        mode, = self.sut.db.execute('PRAGMA journal_mode').fetchone()
+        self.assertEqual('wal', mode)
+
+    def test_transitions(self):
+        """
+        Each transition updates the ticket, and is kept in its history.
+        """
+        self.sut.transition(
+            5, 'rendered', repo='server', expected_number=5,
+            rendered_hash='abc')
+        self.sut.transition(5, 'posted', import_url='https://api/import/1')
+        self.sut.transition(
+            5, 'imported', github_number=5,
+            github_url='https://github.com/chevah/server/issues/5')
+
+        ticket = self.sut.getTicket(5)
+        self.assertEqual('imported', ticket['state'])
+        self.assertEqual('abc', ticket['rendered_hash'])
+        self.assertEqual('https://api/import/1', ticket['import_url'])
+        self.assertEqual(5, ticket['github_number'])
+        self.assertEqual(
+            ['rendered', 'posted', 'imported'],
+            [state for state, _ in self.sut.history(5)])
+        self.assertIsNone(self.sut.getTicket(6))
+
+    def test_unknown_column(self):
+        with self.assertRaises(ValueError):
+            self.sut.transition(5, 'posted', url='https://api/import/1')
+
+    def test_pendingImports(self):
+        """
+        Only tickets posted but not imported are pending.
+        """
+        self.sut.transition(1, 'posted', import_url='https://api/import/1')
+        self.sut.transition(2, 'posted', import_url='https://api/import/2')
+        self.sut.transition(2, 'imported', github_number=2)
+        self.sut.transition(3, 'rendered', rendered_hash='abc')
+
+        self.assertEqual(
+            {1: 'https://api/import/1'}, self.sut.pendingImports())
+
+    def test_tickets_tsv_round_trip(self):
+        """
+        Created tickets are imported from the TSV,
+        and exported in the same order.
+        """
+        content = (
+            'https://trac.chevah.com/ticket/7\t'
+            'https://github.com/chevah/server/issues/7\n'
+            'https://trac.chevah.com/ticket/3\t'
+            'https://github.com/chevah/client/issues/9\n'
+            )
+        path = self.write('tickets_created.tsv', content)
+
+        self.assertEqual(2, self.sut.importTSV('tickets', path))
+        self.assertEqual('client', self.sut.getTicket(3)['repo'])
+        self.assertEqual(9, self.sut.getTicket(3)['github_number'])
+
+        os.remove(path)
+        self.sut.exportTSV('tickets', path, 'https://trac.chevah.com/ticket/')
+        self.assertEqual(content, self.read(path))
+
+    def test_tickets_tsv_header(self):
+        """
+        Header lines, as in `tickets_expected.tsv`, are skipped.
+        """
+        path = self.write(
+            'tickets_expected.tsv',
+            'Trac link\tExpected GitHub link\n'
+            'https://trac.chevah.com/ticket/7\t'
+            'https://github.com/chevah/server/issues/7\n'
+            )
+
+        self.assertEqual(1, self.sut.importTSV('tickets', path))
+
+    def test_records_tsv_round_trip(self):
+        """
+        The lines of the other TSV files are kept as they are.
+        """
+        content = '1.0\t1\n2.0\t2\tclient\n'
+        path = self.write('milestones_created.tsv', content)
+
+        self.sut.importTSV('milestones', path)
+        self.sut.append('milestones', ['3.0', 3, 'server'])
+        self.sut.exportTSV('milestones', path, '')
+
+        self.assertEqual(content + '3.0\t3\tserver\n', self.read(path))
+        self.assertEqual([], self.sut.records('projects'))
+
+    def test_import_twice(self):
+        """
+        Importing the same files again does not duplicate the records,
+        or the ticket transitions.
+        """
+        milestones = self.write('milestones_created.tsv', '1.0\t1\n')
+        tickets = self.write(
+            'tickets_created.tsv',
+            'https://trac.chevah.com/ticket/7\t'
+            'https://github.com/chevah/server/issues/7\n'
+            )
+
+        for _ in range(2):
+            self.assertEqual(1, self.sut.importTSV('milestones', milestones))
+            self.sut.importTSV('tickets', tickets)
+
+        self.assertEqual([['1.0', '1']], self.sut.records('milestones'))
+        self.assertEqual(
+            ['imported'], [state for state, _ in self.sut.history(7)])
+
+
+if __name__ == '__main__':
+    unittest.main()
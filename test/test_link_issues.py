@@ -1,5 +1,8 @@
+import time
 import unittest
 
+import requests
+
 import config_test
 import link_issues as li
 
@@ -62,5 +65,83 @@ class TestCommentRequest(unittest.TestCase):
             )
 
 
+class FakeClock:
+    """
+    A monotonic clock advanced only by its `sleep`.
+    """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestPacer(unittest.TestCase):
+    """
+    `Pacer` spaces out the requests within the content creation limits.
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sut = li.Pacer(
+            limits=((1, 1), (3, 60)), clock=self.clock, sleep=self.clock.sleep)
+
+    @staticmethod
+    def makeResponse(status_code, headers):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        return response
+
+    def test_limits(self):
+        """
+        Requests are at least 1 second apart,
+        and at most 3 are sent in a minute.
+        """
+        times = []
+        for _ in range(5):
+            self.sut.wait()
+            times.append(self.clock.now)
+
+        self.assertEqual([0, 1, 2, 60, 61], times)
+
+    def test_retry_after(self):
+        """
+        A request refused with `Retry-After` pauses the next requests,
+        and should be sent again.
+        """
+        self.sut.wait()
+        retry = self.sut.observe(self.makeResponse(403, {'Retry-After': '30'}))
+        self.sut.wait()
+
+        self.assertTrue(retry)
+        self.assertEqual(30, self.clock.now)
+
+    def test_rate_limit_reset(self):
+        """
+        Nearing the primary rate limit pauses until its reset,
+        without sending the successful request again.
+        """
+        reset = int(time.time()) + 100
+        retry = self.sut.observe(self.makeResponse(201, {
+            'X-RateLimit-Remaining': '5',
+            'X-RateLimit-Reset': str(reset),
+            }))
+        self.sut.wait()
+
+        self.assertFalse(retry)
+        self.assertGreater(self.clock.now, 90)
+
+    def test_failure(self):
+        """
+        Other errors are not sent again.
+        """
+        self.assertFalse(self.sut.observe(self.makeResponse(422, {})))
+        self.sut.wait()
+        self.assertEqual(0, self.clock.now)
+
+
 if __name__ == '__main__':
     unittest.main()
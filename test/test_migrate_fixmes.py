@@ -1,6 +1,24 @@
+import os
+import shutil
+import subprocess
+import tempfile
 import unittest
+
+import config_test
+import fixme_migrator
+import ticket_store
 from fixme_migrator import migrate, parse_tsv
 
+# Monkeypatch the SUT to use the test config.
+fixme_migrator.config = config_test
+
+TSV_TEXT = """
+https://trac.chevah.com/ticket/2166	https://github.com/chevah/server/issues/2166
+https://trac.chevah.com/ticket/10	https://github.com/chevah/sftpplus.com/issues/373
+https://trac.chevah.com/ticket/1891	https://github.com/chevah/server/issues/5459
+https://trac.chevah.com/ticket/5052	https://github.com/chevah/sftpplus.com/issues/387
+"""
+
 
 class TestMigration(unittest.TestCase):
     def test_migrate(self):
@@ -86,5 +104,155 @@ https://trac.chevah.com/ticket/5052	https://github.com/chevah/sftpplus.com/issue
             )
 
 
+class TestMultipleProjects(unittest.TestCase):
+    """
+    The files of all the projects are migrated in one run.
+    """
+    def setUp(self):
+        self.store = ticket_store.TicketMappingStore.fromLines(
+            TSV_TEXT.splitlines(), config_test.TRAC_TICKET_PREFIX)
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_get_project(self):
+        """
+        The project is chosen by the longest mapped prefix,
+        or by the first directory, or is the default one.
+        """
+        sut = fixme_migrator.Projects(
+            self.store, '/src',
+            paths={'site': 'sftpplus.com', 'site/server': 'server'})
+
+        self.assertEqual('server', sut.getProject('/src/server/setup.py'))
+        self.assertEqual(
+            'sftpplus.com', sut.getProject('/src/sftpplus.com/index.rst'))
+        self.assertEqual('sftpplus.com', sut.getProject('/src/site/a.py'))
+        self.assertEqual('server', sut.getProject('/src/site/server/a.py'))
+        self.assertEqual('server', sut.getProject('/src/siteother/a.py'))
+        self.assertEqual('server', sut.getProject('/src/README.rst'))
+
+    def test_migrate_files(self):
+        """
+        Each file uses the mapping of its project,
+        and the IDs not migrated are aggregated in the report.
+        """
+        os.mkdir(os.path.join(self.path, 'server'))
+        os.mkdir(os.path.join(self.path, 'sftpplus.com'))
+        server = os.path.join(self.path, 'server', 'a.py')
+        site = os.path.join(self.path, 'sftpplus.com', 'b.py')
+        for path in [server, site]:
+            with open(path, 'w') as f:
+                f.write('# FIXME:1891:\n# FIXME:10:\n# FIXME:10:\n')
+        projects = fixme_migrator.Projects(self.store, self.path)
+        report = fixme_migrator.Report()
+
+        changed = fixme_migrator.migrate_files(
+            [server, site], projects, report, workers=2)
+
+        self.assertEqual(2, changed)
+        with open(server) as f:
+            self.assertEqual(
+                '# FIXME:5459:\n# FIXME:10:\n# FIXME:10:\n', f.read())
+        with open(site) as f:
+            self.assertEqual(
+                '# FIXME:1891:\n# FIXME:373:\n# FIXME:373:\n', f.read())
+        self.assertEqual([
+            'server: Ticket IDs not in this project: 10 (2x)',
+            'sftpplus.com: Ticket IDs not in this project: 1891 (1x)',
+            ], report.lines())
+
+    def test_report_migrated(self):
+        """
+        IDs which are GitHub numbers of the project may have been migrated.
+        """
+        report = fixme_migrator.Report()
+
+        migrate({'1891': '5459'}, 'FIXME:5459: FIXME:7:', report, 'server')
+
+        self.assertEqual([
+            'server: Ticket IDs may have been migrated: 5459 (1x)',
+            'server: Ticket IDs not in this project: 7 (1x)',
+            ], report.lines())
+
+    def test_parse_arguments(self):
+        self.assertEqual(
+            ('src', 'client', {'web/site': 'sftpplus.com'}, True),
+            fixme_migrator.parse_arguments([
+                '--parallel', '--project=client',
+                '--map=web/site=sftpplus.com', 'src']))
+        self.assertEqual(
+            ('src', 'server', {}, False),
+            fixme_migrator.parse_arguments(['src']))
+
+
+class TestParallelScan(unittest.TestCase):
+    """
+    Files are prefiltered for FIXME markers, and migrated by threads.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_migrate_files(self):
+        """
+        Only files with FIXMEs are decoded and written,
+        keeping their line endings.
+        """
+        fixme = self.write('fixme.py', b'# FIXME:12:\r\npass\r\n')
+        other = self.write('other.py', b'pass\n')
+        binary = self.write('data.bin', b'\xff FIXME:12:')
+        empty = self.write('empty.py', b'')
+        os.utime(other, (0, 0))
+
+        store = ticket_store.TicketMappingStore()
+        store.add(12, 'server', 34, owner='chevah')
+        projects = fixme_migrator.Projects(store, self.path)
+
+        changed = fixme_migrator.migrate_files(
+            [fixme, other, binary, empty], projects, workers=2)
+
+        self.assertEqual(1, changed)
+        self.assertEqual(b'# FIXME:34:\r\npass\r\n', self.read(fixme))
+        self.assertEqual(0, os.stat(other).st_mtime)
+        self.assertEqual(b'\xff FIXME:12:', self.read(binary))
+
+    def test_list_files_git(self):
+        """
+        In a git repo, ignored files are not listed,
+        nor the files which are skipped.
+        """
+        subprocess.run(['git', 'init', '--quiet', self.path], check=True)
+        self.write('.gitignore', b'ignored.py\n')
+        self.write('ignored.py', b'# FIXME:12:')
+        self.write('new.py', b'# FIXME:12:')
+        self.write('code.pyc', b'')
+
+        self.assertEqual(
+            [os.path.join(self.path, 'new.py')],
+            fixme_migrator.list_files(self.path))
+
+    def test_list_files_walk(self):
+        """
+        Outside of a git repo, all the files not skipped are listed.
+        """
+        os.mkdir(os.path.join(self.path, 'node_modules'))
+        self.write(os.path.join('node_modules', 'lib.js'), b'')
+        self.write('code.py', b'')
+
+        self.assertEqual(
+            [os.path.join(self.path, 'code.py')],
+            fixme_migrator.list_files(self.path))
+
+
 if __name__ == '__main__':
     unittest.main()
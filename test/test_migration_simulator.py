@@ -0,0 +1,169 @@
+import unittest
+
+import config_test
+import migration_simulator as ms
+import ticket_migrate_golden_comet_preview as tm
+
+# Monkeypatch the SUT to use the test config.
+tm.config = config_test
+
+
+def make_plan(repos=('client',), count=10, **kwargs):
+    """
+    Create a plan with `count` tickets in each repository.
+    """
+    ticket = {
+        't_id': 1,
+        'component': 'client',
+        'closed': True,
+        'milestone': None,
+        'comments': 0,
+        'branch': '',
+        }
+    ticket.update(kwargs)
+    return ms.Plan([
+        dict(ticket, repo=repo) for repo in repos for _ in range(count)])
+
+
+class TestSimulation(unittest.TestCase):
+    """
+    The requests are replayed against the GitHub limits.
+    """
+    def test_locked_sleep(self):
+        """
+        The sleep under a shared lock serializes the workers.
+        """
+        sut = ms.Simulation(ms.GOLDEN_COMET_PACING, latency=0)
+        jobs = [ms.requests_job([ms.GET_IMPORT] * 5) for _ in range(2)]
+
+        self.assertAlmostEqual(2, sut.run(jobs, workers=2))
+        self.assertEqual(10, sut.calls['GET import status'])
+
+    def test_primary_limit(self):
+        """
+        Near the primary limit, the requests wait for the hourly reset.
+        """
+        sut = ms.Simulation(
+            ms.CLASSIC_PACING._replace(sleep=0), latency=0, primary_limit=15)
+
+        seconds = sut.run([ms.requests_job([ms.GET_NUMBERS] * 6)])
+
+        self.assertEqual(3600, seconds)
+
+    def test_secondary_refused(self):
+        """
+        Content creation over the secondary limits is refused by GitHub,
+        and sent again later.
+        """
+        sut = ms.Simulation(
+            ms.GOLDEN_COMET_PACING, latency=0, content_limits=((2, 60),))
+
+        seconds = sut.run([ms.requests_job([ms.POST_IMPORT] * 3)])
+
+        self.assertAlmostEqual(60.2, seconds)
+        self.assertEqual(3, sut.calls['POST import'])
+        self.assertEqual(1, sut.calls[ms.REFUSED])
+
+
+class TestPredictions(unittest.TestCase):
+    """
+    The calls of each script are counted, and their time predicted.
+    """
+    def test_golden_comet_calls(self):
+        """
+        Each ticket is imported and polled until its import is done,
+        and the IDs are resolved once per batch.
+        """
+        plan = make_plan(count=150)
+        plan.new_milestones = {('client', '1.0')}
+
+        calls, seconds = ms.simulate_golden_comet(
+            plan, workers=1, import_latency=lambda: 0.5, latency=0.1)
+
+        self.assertEqual(2, calls['GET latest issue or pull'])
+        self.assertEqual(1, calls['POST milestone'])
+        self.assertEqual(150, calls['POST import'])
+        self.assertEqual(300, calls['GET import status'])
+        self.assertEqual(2, calls['POST GraphQL issue IDs'])
+        # Over 80 imports per minute.
+        self.assertGreater(seconds, 60)
+
+    def test_golden_comet_workers(self):
+        """
+        Repositories submitted at once share the secondary limits.
+        """
+        plan = make_plan(repos=('client', 'commons'), count=20)
+
+        _, one = ms.simulate_golden_comet(
+            plan, workers=1, import_latency=lambda: 5)
+        _, two = ms.simulate_golden_comet(
+            plan, workers=2, import_latency=lambda: 5)
+
+        self.assertLess(two, one)
+
+    def test_classic_calls(self):
+        plan = make_plan(count=2, milestone='1.0', comments=3)
+        plan.new_projects = {'1.0'}
+
+        calls, seconds = ms.simulate_classic(plan)
+
+        self.assertEqual(2, calls['POST issue'])
+        self.assertEqual(2, calls['PATCH close issue'])
+        self.assertEqual(1, calls['POST project'])
+        self.assertEqual(3, calls['POST project column'])
+        self.assertEqual(2, calls['POST project card'])
+        self.assertEqual(6, calls['POST comment'])
+        # 10 seconds before each of the 17 content requests.
+        self.assertGreater(seconds, 170)
+
+    def test_links_concurrent(self):
+        """
+        The paced concurrent mode is bound by the content limits,
+        instead of the 10 seconds sleep.
+        """
+        plan = make_plan(
+            count=100, branch='https://github.com/chevah/client/pull/1')
+
+        _, sequential = ms.simulate_links(plan)
+        calls, concurrent = ms.simulate_links(plan, workers=4)
+
+        self.assertEqual(100, calls['POST PR link comment'])
+        self.assertEqual(0, calls[ms.REFUSED])
+        self.assertGreater(sequential, 1000)
+        self.assertLess(concurrent, 200)
+
+    def test_links(self):
+        """
+        The PR links are counted like `link_issues.py` selects the tickets,
+        for any branch.
+        """
+        tickets = [
+            {'t_id': 1, 'component': 'client', 'branch': 'fix-1-login'},
+            {'t_id': 2, 'component': 'pr', 'branch': 'fix-2-logout'},
+            {'t_id': 3, 'component': 'client', 'branch': ''},
+            {'t_id': 4, 'component': 'client', 'branch': 'fix-4-crash'},
+            ]
+
+        plan = ms.Plan(tickets, linked_ids={4})
+
+        self.assertEqual(1, plan.links)
+
+    def test_predict(self):
+        plan = make_plan(repos=('client', 'commons'))
+
+        predictions = ms.predict(plan, import_latency=lambda: 1)
+
+        self.assertEqual(
+            ['REPOSITORY_WORKERS = 1', 'REPOSITORY_WORKERS = 2'],
+            [setting for setting, _, _ in predictions[
+                'ticket_migrate_golden_comet_preview.py']])
+        self.assertEqual(
+            1 + len(ms.LINK_WORKERS), len(predictions['link_issues.py']))
+
+    def test_format_duration(self):
+        self.assertEqual('0h 01m', ms.format_duration(1))
+        self.assertEqual('2h 05m', ms.format_duration(7500))
+
+
+if __name__ == '__main__':
+    unittest.main()
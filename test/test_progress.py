@@ -0,0 +1,125 @@
+import unittest
+
+from progress import Progress, format_duration
+
+
+class FakeClock:
+    """
+    A clock advanced by the tests.
+    """
+    def __init__(self, now=1000000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, **headers):
+        self.headers = {
+            key.replace('_', '-'): str(value)
+            for key, value in headers.items()
+            }
+
+
+class TestProgress(unittest.TestCase):
+    """
+    The progress is printed with the throughput, the rate limit and an ETA.
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.lines = []
+        self.sut = Progress(
+            total=100, reserve=10, interval=60, window=5,
+            clock=self.clock, output=self.lines.append)
+
+    def test_throttled(self):
+        """
+        A line is printed at most once per interval.
+        """
+        for _ in range(20):
+            self.clock.now += 10
+            self.sut.done()
+
+        self.assertEqual(3, len(self.lines))
+        self.assertTrue(self.lines[0].startswith(
+            'Progress: 6/100 (6%), 6.0/min, ETA 15m40s at '))
+
+        self.sut.finish()
+        self.assertEqual(4, len(self.lines))
+
+    def test_rolling_rate(self):
+        """
+        The throughput is measured over the last items.
+        """
+        self.clock.now += 100
+        self.sut.done()
+        for _ in range(5):
+            self.clock.now += 2
+            self.sut.done()
+
+        self.assertEqual(0.5, self.sut.rate())
+
+    def test_pause(self):
+        """
+        Pausing for a rate limit reset prints a line right away,
+        and the pause is not counted in the throughput.
+        """
+        reset = self.clock.now + 100
+        self.clock.now += 1
+        self.sut.done()
+        self.sut.observe(FakeResponse(
+            X_RateLimit_Limit=5000,
+            X_RateLimit_Remaining=5,
+            X_RateLimit_Reset=reset,
+            ))
+        self.assertEqual(1, len(self.lines))
+        self.assertIn('rate limit 5/5000 calls until', self.lines[0])
+        self.assertIn('paused for 1m40s', self.lines[0])
+        # 99 items left at 1 per second, after the pause.
+        self.assertEqual(100 + 99, self.sut.eta(self.clock.now))
+
+        self.clock.now = reset + 2
+        self.sut.done()
+        self.assertEqual(1, self.sut.rate())
+
+    def test_projected_resets(self):
+        """
+        The ETA includes the pauses until the rate limit resets,
+        when the calls left are not enough for the remaining items.
+        """
+        self.sut.observe(FakeResponse(
+            X_RateLimit_Limit=110,
+            X_RateLimit_Remaining=60,
+            X_RateLimit_Reset=self.clock.now + 3600,
+            ))
+        self.sut.observe(FakeResponse())
+        self.clock.now += 10
+        self.sut.done()
+
+        # 99 items at 2 calls each: 50 calls before the first reset,
+        # 100 calls in the next window, then 48 in the last one.
+        self.assertEqual(
+            990 + (3590 - 250) + (3600 - 500),
+            self.sut.eta(self.clock.now))
+
+    def test_retry_after(self):
+        """
+        A `Retry-After` pauses even without rate limit headers.
+        """
+        self.sut.observe(FakeResponse(Retry_After=30))
+
+        self.assertEqual(self.clock.now + 30, self.sut.paused_until)
+        self.assertEqual(1, len(self.lines))
+
+
+class TestFormatDuration(unittest.TestCase):
+    def test_format(self):
+        self.assertEqual('0s', format_duration(0))
+        self.assertEqual('5s', format_duration(4.2))
+        self.assertEqual('2m05s', format_duration(125))
+        self.assertEqual('1h01m', format_duration(3665))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from stage_timer import StageTimer
+
+
+class FakeClock:
+    """
+    A clock advanced by the tests.
+    """
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStageTimer(unittest.TestCase):
+    """
+    The time of each stage is accumulated, without its nested stages.
+    """
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sut = StageTimer(clock=self.clock)
+
+    def test_nested(self):
+        """
+        The time of a nested stage is not counted for the outer stage.
+        """
+        with self.sut.stage('outer'):
+            self.clock.now += 1
+            for _ in range(2):
+                with self.sut.stage('inner'):
+                    self.clock.now += 3
+            self.clock.now += 2
+
+        self.assertEqual({'outer': 3, 'inner': 6}, self.sut.seconds)
+        self.assertEqual({'outer': 1, 'inner': 2}, self.sut.calls)
+
+    def test_exception(self):
+        """
+        A stage ending with an error is still counted.
+        """
+        with self.assertRaises(ValueError):
+            with self.sut.stage('fail'):
+                self.clock.now += 1
+                raise ValueError()
+
+        self.assertEqual({'fail': 1}, self.sut.seconds)
+
+    def test_iterate(self):
+        """
+        Producing the items is timed, but not their use.
+        """
+        def produce():
+            for item in 'ab':
+                self.clock.now += 1
+                yield item
+
+        with self.sut.stage('use'):
+            for _ in self.sut.iterate('produce', produce()):
+                self.clock.now += 5
+
+        self.assertEqual({'use': 10, 'produce': 2}, self.sut.seconds)
+        self.assertEqual({'use': 1, 'produce': 3}, self.sut.calls)
+
+    def test_lines(self):
+        """
+        The summary has the slowest stages first.
+        """
+        with self.sut.stage('fast'):
+            self.clock.now += 1
+        with self.sut.stage('slow'):
+            self.clock.now += 3
+
+        self.assertEqual([
+            'Total 4.0s. Time by stage, summed over threads:',
+            '      3.00s  75.0%        1x  slow',
+            '      1.00s  25.0%        1x  fast',
+            ], self.sut.lines())
+
+    def test_profiles(self):
+        """
+        With a profile directory, the top-level stages are profiled.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.sut.profile_dir = path
+
+        with self.sut.stage('read tickets'):
+            with self.sut.stage('parse_body'):
+                sorted(range(10))
+
+        self.assertEqual(['read tickets'], list(self.sut.profiles))
+        paths = self.sut.dumpProfiles('script')
+        self.assertEqual(
+            [os.path.join(path, 'script-read_tickets.prof')], paths)
+        stats = pstats.Stats(paths[0])
+        self.assertIn(
+            'sorted', ' '.join(name for _, _, name in stats.stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
+import random
 import unittest
+from collections import deque
 
 import config_test
 import ticket_migrate_golden_comet_preview as tm
@@ -882,6 +884,41 @@ class TestGitHubRequest(unittest.TestCase):
             request.data['body'].split('type__', 1)[0])
         self.assertNotIn('forbidden', request.data['body'])
 
+    def test_fromTracData_repository_mapping(self):
+        """
+        The repository is chosen from the Trac component,
+        using the fallback repository for unmapped components.
+        """
+        self.assertEqual('client', tm.get_repo('client'))
+        self.assertEqual('trac-migration-staging', tm.get_repo('ftp'))
+        self.assertEqual('trac-migration-staging', tm.get_repo(None))
+
+    def test_submit_issues_in_order(self):
+        """
+        The issues of a repository are submitted in the given order,
+        each with its expected number.
+        """
+        submitted = []
+
+        class FakeIssue:
+            repo = 'client'
+            # Not imported, as in a dry run.
+            github_number = None
+
+            def __init__(self, t_id):
+                self.t_id = t_id
+
+            def submit(self, expected_number, all_comments, ticket_mapping):
+                submitted.append((self.t_id, expected_number))
+
+        tm.submit_issues(
+            [(FakeIssue(3), 1), (FakeIssue(1), 2), (FakeIssue(2), 3)],
+            all_comments={},
+            ticket_mapping={},
+            )
+
+        self.assertEqual([(3, 1), (1, 2), (2, 3)], submitted)
+
 
 class TestNumberPredictor(unittest.TestCase):
     """
@@ -1033,6 +1070,151 @@ class TestNumberPredictor(unittest.TestCase):
             self.sut.orderTickets(tickets, [])
             )
 
+    @staticmethod
+    def legacyOrderRepoTickets(tickets, start):
+        """
+        The previous O(n^2) ordering, to check the output is the same.
+        """
+        tickets_by_id = {t['t_id']: t for t in tickets}
+        ordered_tickets = []
+        not_matching = deque()
+        for t_id in list(tickets_by_id.keys()):
+            if t_id < start:
+                not_matching.append(tickets_by_id[t_id])
+        for github_number in range(start, start + len(tickets_by_id)):
+            ticket = tickets_by_id.pop(github_number, None)
+            if ticket:
+                ordered_tickets.append(ticket)
+                continue
+            try:
+                ordered_tickets.append(not_matching.popleft())
+            except IndexError:
+                t_id = max(tickets_by_id.keys())
+                ordered_tickets.append(tickets_by_id.pop(t_id))
+        ordered_tickets.extend(not_matching)
+        return ordered_tickets
+
+    def test_planRepoTickets_same_as_legacy(self):
+        """
+        The order is the same as the one of the previous implementation,
+        for gap-heavy IDs around the next GitHub number.
+        """
+        for seed in range(20):
+            generator = random.Random(seed)
+            ids = generator.sample(range(1, 300), generator.randint(0, 150))
+            tickets = self.generateTickets(ids)
+            start = generator.randint(1, 200)
+
+            self.assertEqual(
+                self.legacyOrderRepoTickets(tickets, start),
+                self.sut.planRepoTickets(tickets, start)[0],
+                )
+
+    def test_planRepoTickets_fillers(self):
+        """
+        Placeholder issues are planned as fillers,
+        so that the newest tickets also get their Trac ID.
+        """
+        tickets = self.generateTickets([5, 6, 7])
+
+        self.assertEqual(
+            (self.generateTickets([7, 5, 6]), [4, 5, 6], []),
+            self.sut.planRepoTickets(tickets, 4),
+            )
+        self.assertEqual(
+            (tickets, [5, 6, 7], [4]),
+            self.sut.planRepoTickets(tickets, 4, max_fillers=5),
+            )
+
+    def test_planRepoTickets_fillers_limit(self):
+        """
+        Only the fillers needed to reach the largest matching ID
+        within the limit are planned.
+        """
+        tickets = self.generateTickets([5, 20])
+
+        self.assertEqual(
+            (self.generateTickets([20, 5]), [4, 5], []),
+            self.sut.planRepoTickets(tickets, 4, max_fillers=10),
+            )
+        self.assertEqual(
+            (tickets, [5, 20], [4] + list(range(6, 20))),
+            self.sut.planRepoTickets(tickets, 4, max_fillers=20),
+            )
+
+    def test_planRepoTickets_maximum(self):
+        """
+        All the tickets with IDs in the range of the created numbers match.
+        """
+        for seed in range(20):
+            generator = random.Random(seed)
+            ids = generator.sample(range(1, 300), generator.randint(1, 150))
+            start = generator.randint(1, 200)
+            max_fillers = generator.randint(0, 50)
+
+            ordered, numbers, fillers = self.sut.planRepoTickets(
+                self.generateTickets(ids), start, max_fillers)
+
+            end = start + len(ids) + len(fillers)
+            matches = sum(
+                1 for t, n in zip(ordered, numbers) if t['t_id'] == n)
+            self.assertEqual(
+                len([t_id for t_id in ids if start <= t_id < end]), matches)
+            self.assertLessEqual(len(fillers), max_fillers)
+            self.assertEqual(
+                list(range(start, end)), sorted(numbers + fillers))
+
+    def test_orderTickets_fillers(self):
+        """
+        The numbers of the fillers are remembered for each repository,
+        and skipped in the expected numbers.
+        """
+        self.sut.next_numbers['trac-migration-staging'] = 4
+        tickets = self.generateTickets([5, 6, 7])
+
+        self.assertEqual(
+            (tickets, [5, 6, 7]),
+            self.sut.orderTickets(tickets, [], max_fillers=1),
+            )
+        self.assertEqual([4], self.sut.fillers['trac-migration-staging'])
+
+    def test_group_tickets_by_repo(self):
+        tickets = [
+            {'t_id': 1, 'component': 'client'},
+            {'t_id': 2, 'component': 'unmapped'},
+            {'t_id': 3, 'component': 'client'},
+            ]
+
+        self.assertEqual(
+            {
+                'client': [tickets[0], tickets[2]],
+                'trac-migration-staging': [tickets[1]],
+                },
+            tm.group_tickets_by_repo(tickets),
+            )
+
+    def test_orderTickets_multiple_repositories(self):
+        """
+        Each repository has its own GitHub numbers,
+        so the tickets are ordered separately for each repository.
+        """
+        self.sut.next_numbers['client'] = 2
+        self.sut.next_numbers['trac-migration-staging'] = 1
+        tickets = [
+            {'t_id': 1, 'component': 'trac-migration-staging'},
+            {'t_id': 2, 'component': 'client'},
+            {'t_id': 3, 'component': 'client'},
+            {'t_id': 4, 'component': 'unmapped'},
+            ]
+
+        self.assertEqual(
+            (
+                [tickets[1], tickets[2], tickets[0], tickets[3]],
+                [2, 3, 1, 2],
+                ),
+            self.sut.orderTickets(tickets, [])
+            )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import ticket_store
+from ticket_store import TicketMappingStore
+
+TRAC_TICKET_PREFIX = 'https://trac.chevah.com/ticket/'
+
+
+class TestTicketMappingStore(unittest.TestCase):
+    """
+    The store maps Trac IDs to GitHub issues, in both directions.
+    """
+    def setUp(self):
+        self.sut = TicketMappingStore.fromLines([
+            'Trac link\tExpected GitHub link\n',
+            'https://trac.chevah.com/ticket/7\t'
+            'https://github.com/chevah/server/issues/7\n',
+            'https://trac.chevah.com/ticket/3\t'
+            'https://github.com/chevah/client/issues/9\n',
+            ], TRAC_TICKET_PREFIX)
+
+    def test_mapping(self):
+        """
+        It works as a dict of Trac ID -> GitHub URL.
+        """
+        self.assertEqual(
+            {
+                3: 'https://github.com/chevah/client/issues/9',
+                7: 'https://github.com/chevah/server/issues/7',
+                },
+            dict(self.sut))
+        self.assertEqual(2, len(self.sut))
+        self.assertIn(7, self.sut)
+        self.assertNotIn(5, self.sut)
+        self.assertNotIn(70, self.sut)
+        self.assertNotIn('7', self.sut)
+
+    def test_lookup(self):
+        self.assertEqual(('client', 9), self.sut.lookup(3))
+        self.assertIsNone(self.sut.lookup(4))
+
+    def test_reverseLookup(self):
+        self.assertEqual(3, self.sut.reverseLookup('client', 9))
+        self.assertIsNone(self.sut.reverseLookup('client', 7))
+        self.assertIsNone(self.sut.reverseLookup('client', 100))
+        self.assertIsNone(self.sut.reverseLookup('unknown', 9))
+
+    def test_add_replaces(self):
+        """
+        Adding a ticket again replaces both directions.
+        """
+        self.sut.add(3, 'server', 8, 'chevah')
+
+        self.assertEqual(('server', 8), self.sut.lookup(3))
+        self.assertIsNone(self.sut.reverseLookup('client', 9))
+        self.assertEqual(3, self.sut.reverseLookup('server', 8))
+        self.assertEqual(2, len(self.sut))
+
+    def test_copy_update(self):
+        """
+        A copy can be updated without changing the original.
+        """
+        other = TicketMappingStore()
+        other.addURL(3, 'https://github.com/chevah/server/issues/8')
+        other.addURL(4, 'https://github.com/chevah/server/issues/9')
+
+        updated = self.sut.copy()
+        updated.update(other)
+
+        self.assertEqual(('client', 9), self.sut.lookup(3))
+        self.assertEqual(('server', 8), updated.lookup(3))
+        self.assertEqual(3, len(updated))
+
+    def test_maxNumber(self):
+        self.assertEqual(9, self.sut.maxNumber('client'))
+        self.assertEqual(0, self.sut.maxNumber('unknown'))
+
+    def test_repoView(self):
+        """
+        The view of a repository maps Trac ID strings to number strings,
+        and checks its numbers without scanning them.
+        """
+        view = self.sut.repoView('server')
+
+        self.assertEqual({'7': '7'}, view)
+        self.assertEqual('7', view['7'])
+        with self.assertRaises(KeyError):
+            view['3']
+        self.assertIn('7', view.values())
+        self.assertNotIn('9', view.values())
+
+    def test_addURL_comment(self):
+        """
+        Issue comment URLs are mapped to their issue.
+        """
+        self.sut.addURL(
+            5, 'https://github.com/chevah/server/issues/2#issuecomment-10')
+
+        self.assertEqual(('server', 2), self.sut.lookup(5))
+
+    def test_addURL_invalid(self):
+        with self.assertRaises(ValueError):
+            self.sut.addURL(5, 'https://github.com/chevah/server/pull/2')
+
+
+class TestLoad(unittest.TestCase):
+    """
+    A TSV file is read once per process.
+    """
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.path = os.path.join(path, 'tickets_created.tsv')
+        self.addCleanup(ticket_store.forget, self.path)
+        with open(self.path, 'w') as f:
+            f.write(
+                'https://trac.chevah.com/ticket/1\t'
+                'https://github.com/chevah/server/issues/1\n')
+
+    def test_load_once(self):
+        store = ticket_store.load(self.path, TRAC_TICKET_PREFIX)
+        os.remove(self.path)
+
+        self.assertIs(store, ticket_store.load(self.path, TRAC_TICKET_PREFIX))
+
+    def test_remember(self):
+        """
+        Lines appended by the scripts are added to the loaded store.
+        """
+        store = ticket_store.load(self.path, TRAC_TICKET_PREFIX)
+
+        ticket_store.remember(
+            self.path, 2, 'https://github.com/chevah/server/issues/2')
+
+        self.assertEqual(('server', 2), store.lookup(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import config_test
+import fixme_migrator
+import ticket_store
+import trac_references
+from trac_references import Rewriter
+
+# Monkeypatch the SUT to use the test config.
+fixme_migrator.config = config_test
+trac_references.config = config_test
+
+TSV_TEXT = """
+https://trac.chevah.com/ticket/2166	https://github.com/chevah/server/issues/2166
+https://trac.chevah.com/ticket/10	https://github.com/chevah/sftpplus.com/issues/373
+https://trac.chevah.com/ticket/1891	https://github.com/chevah/server/issues/5459
+"""
+
+
+class TestRewriter(unittest.TestCase):
+    """
+    All the forms of Trac references are rewritten with a single pattern.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        store = ticket_store.TicketMappingStore.fromLines(
+            TSV_TEXT.splitlines(), config_test.TRAC_TICKET_PREFIX)
+        self.report = fixme_migrator.Report()
+        self.sut = Rewriter(
+            fixme_migrator.Projects(store, self.path), self.report)
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_rewrite(self):
+        """
+        The references can be to any repository,
+        and the FIXMEs are left to `fixme_migrator`.
+        """
+        self.assertEqual(
+            'FIXME:1891: see https://github.com/chevah/sftpplus.com/issues/373'
+            ' and chevah/server#5459.',
+            self.sut.rewrite(
+                'FIXME:1891: see https://trac.chevah.com/ticket/10'
+                ' and trac#1891.',
+                'server'),
+            )
+
+    def test_rewrite_prefix(self):
+        """
+        The ticket URLs are matched with the prefix from the config.
+        """
+        with patch.object(
+                config_test, 'TRAC_TICKET_PREFIX', 'https://trac.example.com/'):
+            sut = Rewriter(self.sut.projects)
+
+        self.assertEqual(
+            'https://github.com/chevah/server/issues/2166'
+            ' https://trac.chevah.com/ticket/2166',
+            sut.rewrite(
+                'https://trac.example.com/2166'
+                ' https://trac.chevah.com/ticket/2166',
+                'server'),
+            )
+
+    def test_rewrite_unknown(self):
+        """
+        References which can't be rewritten are kept, and reported.
+        """
+        text = (
+            'FIXME:10: https://trac.chevah.com/ticket/99 trac#99 '
+            'https://trac.chevah.com/ticket/10x notrac#10')
+
+        self.assertEqual(text, self.sut.rewrite(text, 'server'))
+
+        self.assertEqual([
+            'server: Ticket IDs not migrated: 99 (2x)',
+            ], self.report.lines())
+
+    def test_rewrite_files(self):
+        """
+        Files with references are replaced, keeping their mode,
+        and the other files are not touched.
+        """
+        notes = self.write(
+            'NEWS.rst', b'* Fixed trac#2166.\r\n* \xc3\xa9 trac#10\r\n')
+        os.chmod(notes, 0o755)
+        other = self.write('other.rst', b'Nothing here.\n')
+        binary = self.write('data.bin', b'\xff trac#10')
+        os.utime(other, (0, 0))
+
+        changed = self.sut.rewriteFiles([notes, other, binary], workers=2)
+
+        self.assertEqual(1, changed)
+        self.assertEqual(
+            b'* Fixed chevah/server#2166.\r\n'
+            b'* \xc3\xa9 chevah/sftpplus.com#373\r\n',
+            self.read(notes))
+        self.assertEqual(0o755, os.stat(notes).st_mode & 0o777)
+        self.assertEqual(0, os.stat(other).st_mtime)
+        self.assertEqual(b'\xff trac#10', self.read(binary))
+        self.assertEqual(
+            ['NEWS.rst', 'data.bin', 'other.rst'],
+            sorted(os.listdir(self.path)))
+
+    def test_rewrite_twice(self):
+        """
+        Rewriting the files again changes nothing,
+        and the FIXMEs are kept.
+        """
+        source = self.write(
+            'source.py',
+            b'# FIXME:10: https://trac.chevah.com/ticket/1891 trac#10\n')
+
+        self.assertEqual(1, self.sut.rewriteFiles([source]))
+        rewritten = self.read(source)
+        self.assertEqual(0, self.sut.rewriteFiles([source]))
+
+        self.assertEqual(
+            b'# FIXME:10: https://github.com/chevah/server/issues/5459'
+            b' chevah/sftpplus.com#373\n',
+            rewritten)
+        self.assertEqual(rewritten, self.read(source))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import config_test
+import wiki_markdown_export
+
+# Monkeypatch the SUT to use the test config.
+wiki_markdown_export.config = config_test
+
+WIKI_SCHEMA = """
+CREATE TABLE wiki (
+    name text, version integer, time integer, author text, ipnr text,
+    text text, comment text, readonly integer
+    )
+"""
+
+
+class TestExportPages(unittest.TestCase):
+    """
+    The latest version of each page is exported as Markdown.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.output = os.path.join(self.path, 'wiki')
+
+    def makeDB(self, rows):
+        db_file = os.path.join(self.path, 'trac.db3')
+        db = sqlite3.connect(db_file)
+        db.execute(WIKI_SCHEMA)
+        db.executemany(
+            'INSERT INTO wiki VALUES (?, ?, ?, ?, "", ?, "", 0)', rows)
+        db.commit()
+        db.close()
+        return db_file
+
+    def read(self, *path):
+        with open(os.path.join(self.output, *path)) as f:
+            return f.read()
+
+    def test_latest_pages(self):
+        """
+        Only the latest version is used,
+        and pages never changed after the install are skipped.
+        """
+        db_file = self.makeDB([
+            ('WikiStart', 1, 1000, 'adi', 'Old'),
+            ('WikiStart', 2, 2000, 'danuker', 'New'),
+            ('TracGuide', 1, 500, 'trac', 'Internal'),
+            ])
+
+        self.assertEqual(
+            [('Home', 2, 2000, 'danuker', 'New')],
+            list(wiki_markdown_export.get_latest_pages(db_file)))
+
+    def test_main(self):
+        """
+        The pages are converted, and written in a directory
+        for each level of their name.
+        """
+        db_file = self.makeDB([
+            ('WikiStart', 1, 1000, 'adi', '= Welcome =\n[wiki:Dev/Start]'),
+            ('Dev/Start', 1, 1000, 'adi', '== Start =='),
+            ('Dev/Process/Review', 1, 1000, 'adi', 'Review'),
+            ])
+
+        wiki_markdown_export.main([db_file, self.output])
+
+        self.assertEqual(
+            '# Welcome\n[Dev/Start](https://example.org/wiki/Dev/Start)',
+            self.read('Home.md'))
+        self.assertEqual('## Start', self.read('Dev', 'Start.md'))
+        self.assertEqual('Review', self.read('Dev', 'Process', 'Review.md'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import unittest
+
+import config_test
+import wiki_migrate
+import wiki_trac_rst_convert
+from git_fast_import import FastImport
+
+# Monkeypatch the SUT to use the test config.
+wiki_migrate.config = config_test
+wiki_trac_rst_convert.config = config_test
+
+WIKI_SCHEMA = """
+CREATE TABLE wiki (
+    name text, version integer, time integer, author text, ipnr text,
+    text text, comment text, readonly integer
+    )
+"""
+
+
+def git(repo, *args):
+    """
+    Return the output of a git command.
+    """
+    return subprocess.run(
+        ('git',) + args,
+        cwd=repo,
+        check=True,
+        stdout=subprocess.PIPE,
+        ).stdout.decode('utf-8')
+
+
+class TestDecodeCopyField(unittest.TestCase):
+    """
+    Fields of the COPY text format are decoded from bytes.
+    """
+    def test_null(self):
+        self.assertIsNone(wiki_migrate.decode_copy_field(b'\\N'))
+        self.assertEqual('', wiki_migrate.decode_copy_field(b''))
+
+    def test_escapes(self):
+        self.assertEqual(
+            '\b\f\n\r\t\v\\N\\',
+            wiki_migrate.decode_copy_field(b'\\b\\f\\n\\r\\t\\v\\\\N\\\\'))
+
+    def test_octal_and_hex(self):
+        """
+        Octal and hex escapes are bytes of the UTF-8 text.
+        """
+        self.assertEqual(
+            'A\u00e9 ', wiki_migrate.decode_copy_field(b'\\101\\xc3\\xa9\\40'))
+
+    def test_other(self):
+        """
+        Any other escaped character is taken literally.
+        """
+        self.assertEqual('q\u00e9', wiki_migrate.decode_copy_field(
+            b'\\q\xc3\xa9'))
+
+
+class TestFastImport(unittest.TestCase):
+    """
+    The wiki history is imported with a single git fast-import process.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.repo = os.path.join(self.path, 'wiki')
+        os.mkdir(self.repo)
+        git(self.repo, 'init', '--quiet')
+        git(self.repo, 'config', 'user.name', 'Migrator')
+        git(self.repo, 'config', 'user.email', 'migrator@example.com')
+
+    def makeSQLite(self, rows):
+        db_file = os.path.join(self.path, 'trac.db3')
+        db = sqlite3.connect(db_file)
+        db.execute(WIKI_SCHEMA)
+        db.executemany(
+            'INSERT INTO wiki VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        db.commit()
+        db.close()
+        return db_file
+
+    def test_sqlite(self):
+        """
+        Each revision is a commit with the author, date and message
+        of the classic git commit, without changing the working tree.
+        """
+        db_file = self.makeSQLite([
+            ('WikiStart', 2, 3000000, 'adi', '', 'Hello\r\nAll', 'Fix', 0),
+            ('WikiStart', 1, 1000000, 'danuker', '', 'Hi', '', 0),
+            ('Dev/Start', 1, 2000000, 'adi', '', 'Ünïcode', None, 0),
+            ('TracLinks', 1, 500000, 'trac', '', 'Internal', '', 0),
+            ])
+
+        wiki_migrate.main(['--fast-import', db_file, self.repo])
+
+        self.assertEqual(
+            'Fix Home.rst modified by adiroiban|'
+            'Adi Roiban <adi.roiban@chevah.com>|3|Migrator\n'
+            'Start.rst modified by adiroiban|'
+            'Adi Roiban <adi.roiban@chevah.com>|2|Migrator\n'
+            'Home.rst modified by danuker|'
+            'Dan Haiduc <danuthaiduc@gmail.com>|1|Migrator\n',
+            git(self.repo, 'log', '--format=%s|%an <%ae>|%at|%cn'),
+            )
+        self.assertEqual(
+            'Hello\r\nAll', git(self.repo, 'show', 'HEAD:Home.rst'))
+        self.assertEqual(
+            'Ünïcode', git(self.repo, 'show', 'HEAD:Dev Start.rst'))
+        self.assertEqual([], [
+            name for name in os.listdir(self.repo) if name != '.git'])
+
+    def test_pq_dump(self):
+        """
+        The rows of a pg_dump file are imported sorted by timestamp,
+        with all the COPY escapes decoded.
+        """
+        db_file = os.path.join(self.path, 'trac.psql')
+        with open(db_file, 'wb') as f:
+            f.write(
+                b'SET client_encoding = \'UTF8\';\n'
+                b'COPY public.wiki (name, version, "time", author, ipnr, '
+                b'text, comment, readonly) FROM stdin;\n'
+                b'WikiStart\t2\t3000000\tadi\t\\N\t'
+                b'a\\tb\\\\n\\r\\n\\303\\251\tFix\t0\n'
+                b'WikiStart\t1\t1000000\tdanuker\t\\N\tHi\t\\N\t0\n'
+                b'TracLinks\t1\t500000\ttrac\t\\N\tInternal\t\t0\n'
+                b'\\.\n'
+                b'\n'
+                )
+
+        wiki_migrate.main(['--fast-import', db_file, self.repo])
+
+        self.assertEqual(
+            'Fix Home.rst modified by adiroiban\n'
+            'Home.rst modified by danuker\n',
+            git(self.repo, 'log', '--format=%s'),
+            )
+        self.assertEqual(
+            'a\tb\\n\r\n\u00e9', git(self.repo, 'show', 'HEAD:Home.rst'))
+        self.assertEqual('Hi', git(self.repo, 'show', 'HEAD~:Home.rst'))
+
+    def test_convert_rst(self):
+        """
+        The text of each revision is converted,
+        and identical texts are converted once.
+        """
+        db_file = self.makeSQLite([
+            ('WikiStart', 1, 1000000, 'adi', '', '= Old =', '', 0),
+            ('WikiStart', 2, 2000000, 'adi', '', '= New =', '', 0),
+            ('WikiStart', 3, 3000000, 'adi', '', '= Old =', 'Revert', 0),
+            ])
+        calls = []
+
+        def convert(text):
+            calls.append(text)
+            return wiki_trac_rst_convert.convert_content(text)
+
+        self.addCleanup(
+            wiki_migrate.CONVERTERS.__setitem__, 'rst',
+            wiki_migrate.CONVERTERS['rst'])
+        wiki_migrate.CONVERTERS['rst'] = (convert, '.rst')
+
+        wiki_migrate.main(
+            ['--fast-import', '--convert=rst', db_file, self.repo])
+
+        self.assertEqual(['= Old =', '= New ='], calls)
+        self.assertEqual(
+            '.. contents::\n\nOld\n===\n',
+            git(self.repo, 'show', 'HEAD:Home.rst'))
+        self.assertEqual(
+            '.. contents::\n\nNew\n===\n',
+            git(self.repo, 'show', 'HEAD~:Home.rst'))
+
+    def test_convert_markdown(self):
+        """
+        Pages converted to Markdown have the `.md` extension.
+        """
+        db_file = self.makeSQLite([
+            ('Dev/Start', 1, 1000000, 'adi', '', '== Sub ==', '', 0),
+            ])
+
+        wiki_migrate.main(
+            ['--fast-import', '--convert=markdown', db_file, self.repo])
+
+        self.assertEqual(
+            'Start.md modified by adiroiban\n',
+            git(self.repo, 'log', '--format=%s'))
+        self.assertEqual(
+            '## Sub', git(self.repo, 'show', 'HEAD:Dev Start.md'))
+
+    def test_existing_history(self):
+        """
+        The revisions are added after the existing commits.
+        """
+        with open(os.path.join(self.repo, '_Sidebar.rst'), 'w') as f:
+            f.write('Sidebar')
+        git(self.repo, 'add', '_Sidebar.rst')
+        git(self.repo, 'commit', '--quiet', '-m', 'Add sidebar.')
+        db_file = self.makeSQLite([
+            ('WikiStart', 1, 1000000, 'unknown', '', 'Hi', '', 0),
+            ])
+
+        wiki_migrate.main(['--fast-import', db_file, self.repo])
+
+        self.assertEqual(
+            'Home.rst modified by unknown|unknown <anonymous@example.com>\n'
+            'Add sidebar.|Migrator <migrator@example.com>\n',
+            git(self.repo, 'log', '--format=%s|%an <%ae>'),
+            )
+        self.assertEqual(
+            'Home.rst\n_Sidebar.rst\n',
+            git(self.repo, 'ls-tree', '--name-only', 'HEAD'))
+
+    def test_blob_marks(self):
+        """
+        A blob written once can be used in multiple commits.
+        """
+        with FastImport(self.repo) as sut:
+            mark = sut.blob(b'\x00binary')
+            sut.commit({'a.bin': mark}, 'A <a@example.com>', 0, 'First')
+            sut.commit({'b.bin': mark}, 'A <a@example.com>', 0, 'Second')
+
+        self.assertEqual(2, sut.commits)
+        self.assertEqual(
+            git(self.repo, 'rev-parse', 'HEAD:a.bin'),
+            git(self.repo, 'rev-parse', 'HEAD:b.bin'),
+            )
+
+    def test_abort(self):
+        """
+        On errors, the branch is not updated.
+        """
+        with self.assertRaises(RuntimeError):
+            with FastImport(self.repo) as sut:
+                sut.commit({'a.txt': 'A'}, 'A <a@example.com>', 0, 'First')
+                raise RuntimeError('Stop')
+
+        self.assertEqual('', git(self.repo, 'branch', '--list'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,7 @@
+import os
+import shutil
+import subprocess
+import tempfile
 import unittest
 
 import config_test
@@ -401,5 +405,340 @@ class TracToGitHubRST(unittest.TestCase):
         )
 
 
+class TestPageIndex(unittest.TestCase):
+    """
+    The names of all the pages are indexed in a prefix tree,
+    to expand the TitleIndex and PageOutline macros.
+    """
+    def setUp(self):
+        self.index = wiki_trac_rst_convert.PageIndex([
+            'Development Start',
+            'Home',
+            'Development',
+            'Development Review Process',
+            'Dev',
+            '_Sidebar',
+            ])
+
+    def test_with_prefix(self):
+        """
+        The names starting with the prefix are sorted,
+        without the special pages.
+        """
+        self.assertEqual(
+            ['Development Review Process', 'Development Start'],
+            self.index.withPrefix('Development '))
+        self.assertEqual(
+            ['Dev', 'Development', 'Development Review Process',
+             'Development Start', 'Home'],
+            self.index.withPrefix(''))
+        self.assertEqual([], self.index.withPrefix('Other'))
+
+    def test_title_index(self):
+        """
+        The TitleIndex macro is replaced by links to the pages
+        having its prefix, with path separators as spaces.
+        """
+        self.assertEqual(
+            '.. contents::\n'
+            '\n'
+            'Pages:\n'
+            '\n'
+            '* `<Development-Review-Process>`_\n'
+            '* `<Development-Start>`_\n',
+
+            convert_content(
+                'Pages:\n'
+                '[[TitleIndex(Development/, format=group)]]\n',
+                index=self.index)
+            )
+
+    def test_title_index_without_index(self):
+        """
+        Without an index, the TitleIndex macro is kept.
+        """
+        self.assertEqual(
+            '.. contents::\n\n[[TitleIndex(Development/)]]\n',
+            convert_content('[[TitleIndex(Development/)]]'))
+
+    def test_page_outline(self):
+        """
+        The PageOutline macro is replaced by links to the sections,
+        instead of the RST local TOC.
+        """
+        self.assertEqual(
+            '.. PageOutline\n'
+            '\n'
+            '* `Intro`_\n'
+            '\n'
+            '  * `Setup`_\n'
+            '\n'
+            'Intro\n'
+            '=====\n'
+            '\n'
+            'Setup\n'
+            '-----\n'
+            'Text\n',
+
+            convert_content(
+                '[[PageOutline]]\n'
+                '\n'
+                '= Intro =\n'
+                '\n'
+                '== Setup ==\n'
+                'Text\n',
+                index=self.index)
+            )
+
+    def test_page_outline_before_heading(self):
+        """
+        The list of sections is separated from a heading following
+        the PageOutline macro.
+        """
+        self.assertEqual(
+            '.. PageOutline\n'
+            '\n'
+            '* `Title`_\n'
+            '\n'
+            '  * `Sub`_\n'
+            '\n'
+            'Title\n'
+            '=====\n'
+            'text\n'
+            '\n'
+            'Sub\n'
+            '---\n',
+
+            convert_content(
+                '[[PageOutline]]\n'
+                '= Title =\n'
+                'text\n'
+                '\n'
+                '== Sub ==\n',
+                index=self.index)
+            )
+
+    def test_page_outline_levels(self):
+        """
+        Only the headings in the range of levels are listed.
+        """
+        self.assertEqual(
+            '.. PageOutline\n'
+            '\n'
+            '* `Setup`_\n'
+            '\n'
+            'Intro\n'
+            '=====\n'
+            '\n'
+            'Setup\n'
+            '-----\n',
+
+            convert_content(
+                '[[PageOutline(2-3, Contents, inline)]]\n'
+                '\n'
+                '= Intro =\n'
+                '\n'
+                '== Setup ==\n',
+                index=self.index)
+            )
+
+    def test_convert_tree(self):
+        """
+        All the pages are indexed when converting a tree.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        for name in ['Home.rst', 'Dev Start.rst', 'Dev Other.rst']:
+            with open(os.path.join(path, name), 'w') as f:
+                f.write('[[TitleIndex(Dev/)]]')
+
+        wiki_trac_rst_convert.convert_tree(path, parallel=True, workers=2)
+
+        with open(os.path.join(path, 'Home.rst')) as f:
+            self.assertEqual(
+                '.. contents::\n'
+                '\n'
+                '* `<Dev-Other>`_\n'
+                '* `<Dev-Start>`_\n',
+                f.read())
+
+
+class TestConvertFiles(unittest.TestCase):
+    """
+    Files are converted in place, only when their content changes.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_convert_file(self):
+        """
+        The converted content replaces the file, keeping its mode.
+        """
+        path = self.write('Home.rst', '= Title =')
+        os.chmod(path, 0o640)
+
+        self.assertTrue(wiki_trac_rst_convert.convert_file(path))
+
+        self.assertEqual(convert_content('= Title ='), self.read(path))
+        self.assertEqual(0o640, os.stat(path).st_mode & 0o777)
+        self.assertEqual(['Home.rst'], os.listdir(self.path))
+
+    def test_convert_file_unchanged(self):
+        """
+        Files which are already converted are not written.
+        """
+        path = self.write('Home.rst', convert_content('= Title ='))
+        os.utime(path, (0, 0))
+
+        self.assertFalse(wiki_trac_rst_convert.convert_file(path))
+
+        self.assertEqual(0, os.stat(path).st_mtime)
+
+    def test_convert_tree_parallel(self):
+        """
+        All the RST files are converted by a pool of processes.
+        """
+        os.mkdir(os.path.join(self.path, 'sub'))
+        first = self.write('Home.rst', '= Title =')
+        second = self.write(os.path.join('sub', 'Dev.rst'), '== Sub ==')
+        converted = self.write('Done.rst', convert_content('Done'))
+        other = self.write('notes.txt', '= Title =')
+
+        changed = wiki_trac_rst_convert.convert_tree(
+            self.path, parallel=True, workers=2)
+
+        self.assertEqual(2, changed)
+        self.assertEqual(convert_content('= Title ='), self.read(first))
+        self.assertEqual(convert_content('== Sub =='), self.read(second))
+        self.assertEqual(convert_content('Done'), self.read(converted))
+        self.assertEqual('= Title =', self.read(other))
+
+
+class TestManifest(unittest.TestCase):
+    """
+    The conversion of each page is recorded in a manifest,
+    to convert only the pages which changed.
+    """
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        subprocess.run(['git', 'init', '--quiet', self.path], check=True)
+        self.page = os.path.join(self.path, 'Home.rst')
+        self.writePage('= Title =')
+
+    def writePage(self, content):
+        with open(self.page, 'w') as f:
+            f.write(content)
+
+    def readPage(self):
+        with open(self.page) as f:
+            return f.read()
+
+    def convert(self):
+        return wiki_trac_rst_convert.convert_tree(self.path)
+
+    def patchRules(self, version, convert):
+        """
+        Use other conversion rules, with a new version.
+        """
+        self.addCleanup(
+            setattr, wiki_trac_rst_convert, 'CONVERTER_VERSION',
+            wiki_trac_rst_convert.CONVERTER_VERSION)
+        self.addCleanup(
+            setattr, wiki_trac_rst_convert, 'convert_content',
+            wiki_trac_rst_convert.convert_content)
+        wiki_trac_rst_convert.CONVERTER_VERSION = version
+        wiki_trac_rst_convert.convert_content = convert
+
+    def test_manifest(self):
+        """
+        The git hashes of the source and of the output are recorded,
+        with the version of the converter.
+        """
+        self.assertEqual(1, self.convert())
+
+        manifest = wiki_trac_rst_convert.Manifest(os.path.join(
+            self.path, '.git', wiki_trac_rst_convert.MANIFEST_NAME))
+        self.assertEqual({'Home.rst': {
+            'source': wiki_trac_rst_convert.blob_hash(b'= Title ='),
+            'version': wiki_trac_rst_convert.CONVERTER_VERSION,
+            'output': wiki_trac_rst_convert.blob_hash(
+                self.readPage().encode('utf-8')),
+            }}, manifest.entries)
+
+    def test_skip_converted(self):
+        """
+        Pages converted with the current rules are not converted again.
+        """
+        self.convert()
+        os.utime(self.page, (0, 0))
+
+        self.assertEqual(0, self.convert())
+
+        self.assertEqual(0, os.stat(self.page).st_mtime)
+        self.assertEqual(convert_content('= Title ='), self.readPage())
+
+    def test_new_rules(self):
+        """
+        After the rules change, pages are converted again from their source.
+        """
+        self.convert()
+        self.patchRules(2, lambda text, index: text.upper())
+
+        self.assertEqual(1, self.convert())
+
+        self.assertEqual('= TITLE =', self.readPage())
+        self.assertEqual(0, self.convert())
+
+    def test_new_source(self):
+        """
+        Pages replaced with a new source are converted.
+        """
+        self.convert()
+        self.writePage('== Other ==')
+
+        self.assertEqual(1, self.convert())
+
+        self.assertEqual(convert_content('== Other =='), self.readPage())
+
+    def test_refuse_converted(self):
+        """
+        Pages which look converted are not converted again,
+        unless they are the output of a recorded conversion.
+        """
+        self.writePage(convert_content('= Title ='))
+        self.patchRules(2, lambda text, index: text.upper())
+
+        self.assertEqual(0, self.convert())
+
+        self.assertEqual(convert_content('= Title ='), self.readPage())
+
+    def test_refuse_converted_outline(self):
+        """
+        Pages converted with their PageOutline macro expanded
+        also look converted.
+        """
+        page = convert_content(
+            '[[PageOutline]]\n= Title =\n',
+            index=wiki_trac_rst_convert.PageIndex())
+        self.writePage(page)
+        self.patchRules(2, lambda text, index: text.upper())
+
+        self.assertEqual(0, self.convert())
+
+        self.assertEqual(page, self.readPage())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 # Migrate Trac tickets to GitHub, with the official (slow) API.
 import datetime
+import os
 import pprint
 import requests
 import sqlite3
 import sys
 import time
-from collections import deque
+from collections import deque, defaultdict
 from typing import Union
 
+import http_cache
+import stage_timer
+import ticket_store
+from progress import Progress
 from wiki_trac_rst_convert import matches, sub
 
 try:
@@ -22,34 +27,51 @@ from trac2down import convert
 # Set to False to perform actual GitHub issue creation.
 DRY_RUN = True
 
+# The progress of the submission, started by `main`.
+PROGRESS = None
+
+# Wait for the rate limit reset when fewer calls are left.
+RATE_LIMIT_RESERVE = 10
+
+# The GitHub API root, which can point to a local stand-in like `fake_github`.
+GITHUB_API = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+
 
 def main():
     """
     Read the Trac DB and post the open tickets to GitHub.
     """
-    tickets = list(select_tickets(read_trac_tickets()))
-    comments = list(read_trac_comments())
-    np = NumberPredictor()
-    tickets, expected_numbers = np.orderTickets(tickets)
-
-    ticket_mapping = get_ticket_mapping(tickets, expected_numbers)
+    global PROGRESS
+    with stage_timer.stage('read tickets'):
+        tickets = list(select_tickets(read_trac_tickets()))
+    with stage_timer.stage('read comments'):
+        comments = list(read_trac_comments())
+    with stage_timer.stage('order tickets'):
+        np = NumberPredictor()
+        tickets, expected_numbers = np.orderTickets(tickets)
+        ticket_mapping = get_ticket_mapping(tickets, expected_numbers)
 
     # Parse tickets into GitHub issue objects.
-    issues = list(GitHubRequest.fromTracDataMultiple(
-        tickets, ticket_mapping=ticket_mapping
-        ))
+    with stage_timer.stage('parse tickets'):
+        issues = list(GitHubRequest.fromTracDataMultiple(
+            tickets, ticket_mapping=ticket_mapping
+            ))
 
     output_stats(issues, expected_numbers)
 
     print("Issues parsed. Starting to submit them.\n"
           "Please don't manually open issues or PRs until this is done.")
 
-    for issue, expected_number in zip(issues, expected_numbers):
-        print(f"Processing GH {expected_number}")
-        issue.submit(expected_number)
-        issue.closeIfNeeded()
-        issue.submitToProject()
-        issue.submitMyComments(comments, ticket_mapping=ticket_mapping)
+    PROGRESS = Progress(total=len(issues), reserve=RATE_LIMIT_RESERVE)
+    with stage_timer.stage('submit issues'):
+        for issue, expected_number in zip(issues, expected_numbers):
+            print(f"Processing GH {expected_number}")
+            issue.submit(expected_number)
+            issue.closeIfNeeded()
+            issue.submitToProject()
+            issue.submitMyComments(comments, ticket_mapping=ticket_mapping)
+            PROGRESS.done()
+    PROGRESS.finish()
 
     print("Issue creation complete. You may now manually open issues and PRs.")
 
@@ -73,31 +95,21 @@ def select_tickets(tickets):
 
 def get_ticket_mapping(tickets, expected_numbers):
     """
-    Returns a dictionary of all known Trac ID -> GitHub URL correspondences.
+    Returns a mapping of all known Trac ID -> GitHub URL correspondences.
     The GitHub URL may either be expected, or read from tickets_created.tsv.
     """
-    mapping = get_tickets()
-    expected_allrepos = get_tickets('tickets_expected_gold.tsv')
-    for ticket, expected_numbers in expected_allrepos.items():
-        mapping[ticket] = expected_numbers
-
+    mapping = get_tickets().copy()
+    mapping.update(get_tickets('tickets_expected_gold.tsv'))
     return mapping
 
 
 def get_tickets(filename='tickets_created.tsv'):
     """
-    Reads the tickets_create.tsv, and returns a dictionary of
-    Trac ID -> GitHub URL of tickets that were sent to GitHub already.
+    Returns the TicketMappingStore of Trac ID -> GitHub URL
+    of the tickets in a TSV file like `tickets_created.tsv`.
+    The file is read only once per process.
     """
-    created_tickets = {}
-    with open(filename) as f:
-        for line in f:
-            if line.startswith(config.TRAC_TICKET_PREFIX):
-                trac_link, github_url = line.strip().split('\t')
-                trac_id = trac_link.split(config.TRAC_TICKET_PREFIX)[1]
-                trac_id = int(trac_id)
-                created_tickets[trac_id] = github_url
-    return created_tickets
+    return ticket_store.load(filename, config.TRAC_TICKET_PREFIX)
 
 
 def read_trac_tickets():
@@ -242,13 +254,14 @@ class NumberPredictor:
         """
         Get the largest GitHub number, for either tickets or pulls.
         `kind` is either "issues" or "pulls".
-        Fortunately GitHub orders them newest first.
+        Fortunately GitHub orders them newest first,
+        so we only need the first item.
         """
-        tickets_or_pulls = requests.get(
-            url=f'https://api.github.com/repos/{config.OWNER}/{repo}/{kind}',
+        tickets_or_pulls = http_cache.get(
+            url=f'{GITHUB_API}/repos/{config.OWNER}/{repo}/{kind}',
             headers={'accept': 'application/vnd.github.v3+json'},
             auth=(config.OAUTH_USER, config.OAUTH_TOKEN),
-            params={'state': 'all'},
+            params={'state': 'all', 'per_page': 1},
             )
         try:
             last_number = tickets_or_pulls.json()[0]['number']
@@ -275,53 +288,68 @@ class NumberPredictor:
         all_repo_ordered_tickets = []
         expected_github_numbers = []
 
+        tickets_by_repo = group_tickets_by_repo(tickets)
         for repo in unique(repositories):
             print('processing repo', repo)
             self.next_numbers[repo] = self.requestNextNumber(repo)
 
-            tickets_by_id = {
-                t['t_id']: t
-                for t in select_tickets_for_repo(tickets, repo)}
-            ordered_tickets = []
-            not_matching = deque()
-
-            # Remember tickets not matching, which we can use to fill gaps.
-            for t_id in list(tickets_by_id.keys()):
-                if t_id < self.next_numbers[repo]:
-                    not_matching.append(tickets_by_id[t_id])
-
-            start = self.next_numbers[repo]
-            end = start + len(tickets_by_id)
-            for github_number in range(start, end):
-                # Check if we have a ticket on this position.
-                ticket = tickets_by_id.pop(github_number, None)
-                if ticket:
-                    ordered_tickets.append(ticket)
-                    continue
-
-                try:
-                    # Use non-matching tickets to fill the gap,
-                    # hoping that we eventually reach a matching one.
-                    ticket = not_matching.popleft()
-                    ordered_tickets.append(ticket)
-                except IndexError:
-                    # Can't fill the gap. Sacrifice new tickets from the end.
-                    t_id = max(tickets_by_id.keys())
-                    ordered_tickets.append(tickets_by_id.pop(t_id))
-
-            # Add what's left of the non-matching.
-            ordered_tickets.extend(not_matching)
+            ordered_tickets = self.orderRepoTickets(
+                tickets_by_repo[repo], self.next_numbers[repo])
 
             # And add to the all-repo list.
             all_repo_ordered_tickets.extend(ordered_tickets)
 
             # Compute GitHub numbers.
+            start = self.next_numbers[repo]
             github_end = start + len(ordered_tickets)
             expected_github_numbers.extend(range(start, github_end))
 
         assert len(all_repo_ordered_tickets) == len(expected_github_numbers)
         return all_repo_ordered_tickets, expected_github_numbers
 
+    @staticmethod
+    def orderRepoTickets(tickets, start):
+        """
+        Order the tickets of a repository whose next GitHub number is `start`.
+
+        Tickets are placed on their Trac ID when possible.
+        Gaps are filled with the tickets below `start`, which can't match,
+        or else with the largest remaining Trac IDs.
+        This takes O(n log n), for sorting the IDs which can still match.
+        """
+        tickets_by_id = {t['t_id']: t for t in tickets}
+        ordered_tickets = []
+
+        # Remember tickets not matching, which we can use to fill gaps.
+        not_matching = deque(
+            t for t_id, t in tickets_by_id.items() if t_id < start)
+        # The IDs which can still match, the largest last.
+        # Matched IDs are skipped when sacrificing from the end.
+        candidates = sorted(t_id for t_id in tickets_by_id if t_id >= start)
+
+        end = start + len(tickets_by_id)
+        for github_number in range(start, end):
+            # Check if we have a ticket on this position.
+            ticket = tickets_by_id.pop(github_number, None)
+            if ticket:
+                ordered_tickets.append(ticket)
+                continue
+
+            if not_matching:
+                # Use non-matching tickets to fill the gap,
+                # hoping that we eventually reach a matching one.
+                ordered_tickets.append(not_matching.popleft())
+                continue
+
+            # Can't fill the gap. Sacrifice new tickets from the end.
+            while candidates[-1] not in tickets_by_id:
+                candidates.pop()
+            ordered_tickets.append(tickets_by_id.pop(candidates.pop()))
+
+        # Add what's left of the non-matching.
+        ordered_tickets.extend(not_matching)
+        return ordered_tickets
+
 
 def unique(elements):
     """
@@ -337,12 +365,15 @@ def unique(elements):
     return uniques
 
 
-def select_tickets_for_repo(tickets, repo: str):
+def group_tickets_by_repo(tickets):
     """
-    From a list of Trac tickets,
-    select the ones that will be posted to a given GitHub repository.
+    From a list of Trac tickets, in a single pass,
+    return a dict of GitHub repository -> tickets to be posted there.
     """
-    return [t for t in tickets if get_repo(t['component']) == repo]
+    tickets_by_repo = defaultdict(list)
+    for ticket in tickets:
+        tickets_by_repo[get_repo(ticket['component'])].append(ticket)
+    return tickets_by_repo
 
 
 def get_repo(component):
@@ -416,7 +447,7 @@ class GitHubRequest:
         API Docs:
         https://docs.github.com/en/rest/reference/issues#create-an-issue
         """
-        url = f'https://api.github.com/repos/{self.owner}/{self.repo}/issues'
+        url = f'{GITHUB_API}/repos/{self.owner}/{self.repo}/issues'
 
         response = protected_request(url=url, data=self.data)
 
@@ -425,6 +456,7 @@ class GitHubRequest:
             with open('tickets_created.tsv', 'a') as f:
                 github_url = response.json()['html_url']
                 f.write(f'{self.trac_url()}\t{github_url}\n')
+            ticket_store.remember('tickets_created.tsv', self.t_id, github_url)
 
             if response.json()['number'] != expected_number:
                 raise ValueError(
@@ -479,7 +511,7 @@ class GitHubRequest:
 
         # We have not created the project. Create it.
         response = protected_request(
-            url=f'https://api.github.com/orgs/{config.PROJECT_ORG}/projects',
+            url=f'{GITHUB_API}/orgs/{config.PROJECT_ORG}/projects',
             data={'name': name}
             )
         project_id = response.json()['id']
@@ -493,7 +525,7 @@ class GitHubRequest:
 
         # Close the project.
         protected_request(
-            url=f'https://api.github.com/projects/{project_id}',
+            url=f'{GITHUB_API}/projects/{project_id}',
             data={'state': 'closed'},
             method=requests.patch,
             expected_status_code=200,
@@ -535,7 +567,7 @@ class GitHubRequest:
             if self.resolution == 'fixed':
                 column_id = done_id
 
-        url = f'https://api.github.com/projects/columns/{column_id}/cards'
+        url = f'{GITHUB_API}/projects/columns/{column_id}/cards'
         data = {
             'content_id': self.github_id,
             'content_type': 'Issue'
@@ -608,13 +640,13 @@ class GitHubRequest:
         """
         Send a POST request to GitHub creating the comment from `comment_data`.
         """
-        url = f'https://api.github.com/repos/' \
+        url = f'{GITHUB_API}/repos/' \
               f'{self.owner}/{self.repo}/issues/{self.github_number}/comments'
 
         response = protected_request(url=url, data=comment_data)
 
         if response:
-            # Remember the GitHub URL assigned to each ticket.
+            # Remember the GitHub URL assigned to each comment.
             with open('comments_created.tsv', 'a') as f:
                 github_url = response.json()['html_url']
                 f.write(f'{self.trac_url()}\t{github_url}\n')
@@ -629,7 +661,7 @@ class GitHubRequest:
         https://docs.github.com/en/rest/reference/issues#update-an-issue
         """
         url = (
-            f'https://api.github.com/repos/{self.owner}/{self.repo}/issues/'
+            f'{GITHUB_API}/repos/{self.owner}/{self.repo}/issues/'
             f'{self.github_number}'
             )
 
@@ -642,6 +674,7 @@ class GitHubRequest:
                 )
 
 
+@stage_timer.timed('protected_request')
 def protected_request(
         url, data, method=requests.post, expected_status_code=201):
     """
@@ -658,7 +691,8 @@ def protected_request(
 
     # Obey secondary rate limit:
     # https://docs.github.com/en/rest/guides/best-practices-for-integrators#dealing-with-secondary-rate-limits
-    time.sleep(10)
+    with stage_timer.stage('pacing'):
+        time.sleep(10)
 
     response = method(
         url=url,
@@ -667,6 +701,9 @@ def protected_request(
         auth=(config.OAUTH_USER, config.OAUTH_TOKEN)
         )
 
+    if PROGRESS is not None:
+        PROGRESS.observe(response)
+
     if response.status_code != expected_status_code:
         print('Error: POST request failed!')
         print(response)
@@ -679,13 +716,14 @@ def protected_request(
     return response
 
 
+@stage_timer.timed('wait_for_rate_reset')
 def wait_for_rate_reset(response):
     """
     Wait for a rate limit reset in case it is near exhaustion.
     """
     remaining = int(response.headers['X-RateLimit-Remaining'])
     reset_time = int(response.headers['X-RateLimit-Reset'])
-    if remaining < 10:
+    if remaining < RATE_LIMIT_RESERVE:
         to_sleep = int(1 + reset_time - time.time())
         print(
             f"Waiting {to_sleep}s (until {reset_time}) for rate limit reset.")
@@ -838,6 +876,7 @@ def labels_from_status_and_resolution(status, resolution):
     return set()
 
 
+@stage_timer.timed('parse_body')
 def parse_body(description, ticket_mapping):
     """
     Parses text with curly-bracketed or backtick-surrounded monospace.
@@ -896,7 +935,8 @@ def convert_issue_content(text, ticket_mapping):
             print("Warning: unknown ticket: #" + str(match))
             pass
 
-    return convert(text, base_path='')
+    with stage_timer.stage('convert'):
+        return convert(text, base_path='')
 
 
 def parse_curly(description, ticket_mapping):
@@ -944,4 +984,5 @@ def parse_backtick(description, ticket_mapping):
 
 
 if __name__ == '__main__':
+    stage_timer.start('ticket_migrate')
     main()
@@ -5,17 +5,28 @@
 
 import datetime
 import difflib
+import hashlib
+import json
+import os
 import pprint
 import re
 import requests
 import sqlite3
 import sys
+import threading
 import time
 from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 from typing import Union
 
+import github_graphql
+import http_cache
+import stage_timer
+import ticket_store
 from attachment_links import get_attachment_path
+from journal import Journal
+from progress import Progress
 from wiki_trac_rst_convert import matches, sub
 
 try:
@@ -30,62 +41,463 @@ from trac2down import convert
 DRY_RUN = True
 # DRY_RUN = False
 
+# Set to True to never stop in the debugger, for unattended runs.
+# Failed tickets are retried, or recorded in DEAD_LETTER_FILE
+# and replaced by placeholder issues.
+UNATTENDED = False
+DEAD_LETTER_FILE = 'tickets_failed.jsonl'
+# How many times to try submitting a ticket, in unattended mode.
+MAX_ATTEMPTS = 5
+
+# The most closed placeholder issues to create in each repository,
+# as fillers allowing more tickets to get their Trac ID as GitHub number.
+MAX_FILLERS = 0
+
+# The most repositories submitted at once, each by its own worker.
+# None submits all the repositories at once.
+REPOSITORY_WORKERS = None
+
+# The state journal, opened by `main` when not in DRY_RUN.
+JOURNAL = None
+
+# The progress of the submission, started by `main`.
+PROGRESS = None
+
+# Wait for the rate limit reset when fewer calls are left.
+RATE_LIMIT_RESERVE = 50
+
+# The GitHub API root, which can point to a local stand-in like `fake_github`.
+GITHUB_API = os.environ.get('GITHUB_API_URL', 'https://api.github.com')
+
+
+class SubmitError(Exception):
+    """
+    A request to GitHub failed, in unattended mode.
+
+    `retry` tells whether the request might succeed if sent again,
+    after `retry_after` seconds, if known.
+    """
+    def __init__(self, message, response=None, retry=False, retry_after=None):
+        super().__init__(message)
+        self.response = response
+        self.retry = retry
+        self.retry_after = retry_after
+
+    @classmethod
+    def fromResponse(cls, response):
+        """
+        Classify a failed response as temporary or permanent.
+
+        Rate limit errors and server errors are temporary:
+        https://docs.github.com/en/rest/overview/resources-in-the-rest-api#rate-limiting
+        """
+        headers = response.headers
+        retry_after = None
+        if 'Retry-After' in headers:
+            retry_after = int(headers['Retry-After'])
+        elif headers.get('X-RateLimit-Remaining') == '0':
+            retry_after = int(
+                1 + int(headers['X-RateLimit-Reset']) - time.time())
+
+        rate_limited = response.status_code in (403, 429) and (
+            retry_after is not None or 'rate limit' in response.text)
+        return cls(
+            f'{response.request.method} {response.url} '
+            f'failed with {response.status_code}.',
+            response=response,
+            retry=rate_limited or response.status_code >= 500,
+            retry_after=retry_after,
+            )
+
+
+class MigrationStopped(ValueError):
+    """
+    Continuing would break the preservation of the ticket numbers.
+    """
+
 
 MAIL_REGEX = r'([a-zA-Z0-9_.+-]+)@([a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)'
 
+# The `issue_url` of an import job.
+IMPORTED_ISSUE_REGEX = re.compile(r'/repos/([^/]+)/([^/]+)/issues/(\d+)$')
+
+# The repository workers share the same GitHub rate limit.
+# Hold this lock while pacing requests or waiting for a rate limit reset.
+RATE_LIMIT_LOCK = threading.Lock()
+# Serialize appends to the TSV files between the repository workers.
+TSV_LOCK = threading.Lock()
+
 
 def main():
     """
     Read the Trac DB and post the tickets to GitHub.
     """
-    to_submit = list(select_tickets(read_trac_tickets()))
-    submitted_already = get_tickets('tickets_created.tsv').values()
-    np = NumberPredictor()
-    attach_attachments(tickets=to_submit, attachments=read_trac_attachments())
-    to_submit, expected_numbers = np.orderTickets(
-        to_submit, already_created=submitted_already
-        )
+    global JOURNAL, PROGRESS
+    if not DRY_RUN:
+        # A dry run must not leave history for the real run to resume.
+        JOURNAL = Journal()
+        # Before planning, so the tickets imported before a crash
+        # are not planned again.
+        resume_pending_imports()
+
+    with stage_timer.stage('read tickets'):
+        to_submit = list(select_tickets(read_trac_tickets()))
+        submitted_already = get_tickets('tickets_created.tsv').values()
+    with stage_timer.stage('read attachments'):
+        attach_attachments(
+            tickets=to_submit, attachments=read_trac_attachments())
+    with stage_timer.stage('order tickets'):
+        np = NumberPredictor()
+        to_submit, expected_numbers = np.orderTickets(
+            to_submit,
+            already_created=submitted_already,
+            max_fillers=MAX_FILLERS,
+            )
+        ticket_mapping = get_ticket_mapping(to_submit, expected_numbers)
 
-    ticket_mapping = get_ticket_mapping(to_submit, expected_numbers)
-    raw_comments = chain(
+    # The comments are read from the DB while they are grouped.
+    raw_comments = stage_timer.iterate('read comments', chain(
         read_trac_owner_changes(),
         read_trac_status_changes(),
         read_trac_comments(),
-        )
+        ))
     comments_by_ticket_and_time = group_comments(raw_comments)
-    trac_numbers = [t['t_id'] for t in to_submit]
-    comments = {
-        t_id: [
-            comment_from_trac_changes(
-                comments_by_ticket_and_time[t_id][created_time],
-                ticket_mapping
-                )
-            for created_time in comments_by_ticket_and_time[t_id]
-            ]
-        for t_id in comments_by_ticket_and_time if t_id in trac_numbers
-        }
+    with stage_timer.stage('parse comments'):
+        trac_numbers = [t['t_id'] for t in to_submit]
+        comments = {
+            t_id: [
+                comment_from_trac_changes(
+                    comments_by_ticket_and_time[t_id][created_time],
+                    ticket_mapping
+                    )
+                for created_time in comments_by_ticket_and_time[t_id]
+                ]
+            for t_id in comments_by_ticket_and_time if t_id in trac_numbers
+            }
 
     # Parse tickets into GitHub issue objects.
-    issues = list(GitHubRequest.fromTracDataMultiple(
-        to_submit, ticket_mapping=ticket_mapping
-        ))
+    with stage_timer.stage('parse tickets'):
+        issues = list(GitHubRequest.fromTracDataMultiple(
+            to_submit, ticket_mapping=ticket_mapping
+            ))
 
-    output_stats(issues, expected_numbers)
+    output_stats(issues, expected_numbers, fillers=np.fillers)
 
     print("Issues parsed. Starting to submit them.\n"
           "Please don't manually open issues or PRs until this is done.")
 
+    # Issue numbers are allocated independently for each repository,
+    # so each repository gets its own worker, submitting in order.
+    issues_by_repo = defaultdict(list)
     for issue, expected_number in zip(issues, expected_numbers):
-        print(f"Processing GH {expected_number}")
-        issue.submit(
-            expected_number,
-            all_comments=comments,
-            ticket_mapping=ticket_mapping
-            )
+        issues_by_repo[issue.repo].append((issue, expected_number))
+    add_fillers(issues_by_repo, np.fillers)
+    PROGRESS = Progress(
+        total=sum(map(len, issues_by_repo.values())),
+        reserve=RATE_LIMIT_RESERVE,
+        )
+
+    max_workers = len(issues_by_repo)
+    if REPOSITORY_WORKERS is not None:
+        max_workers = min(max_workers, REPOSITORY_WORKERS)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        workers = [
+            pool.submit(
+                submit_issues,
+                repo_issues,
+                all_comments=comments,
+                ticket_mapping=ticket_mapping,
+                )
+            for repo_issues in issues_by_repo.values()
+            ]
+        # Wait for all the workers, raising the first error, if any.
+        stopped = []
+        for worker in workers:
+            try:
+                worker.result()
+            except MigrationStopped as error:
+                print(f'Migration stopped: {error}')
+                stopped.append(error)
+    PROGRESS.finish()
+
+    if stopped:
+        sys.exit(1)
 
     print("Issue creation complete. You may now manually open issues and PRs.")
 
 
+@stage_timer.timed('submit issues')
+def submit_issues(issues, all_comments, ticket_mapping):
+    """
+    Submit, in order, a list of (GitHubRequest, expected number) pairs
+    belonging to the same repository.
+
+    The imported issues are verified in batches, once their IDs are resolved.
+    """
+    imported = []
+    for issue, expected_number in issues:
+        print(f"Processing GH {issue.repo} {expected_number}")
+        try:
+            submit_with_retries(
+                issue,
+                expected_number,
+                all_comments=all_comments,
+                ticket_mapping=ticket_mapping
+                )
+        except SubmitError as error:
+            dead_letter(issue, expected_number, error)
+            if issue.github_number is None:
+                # The import failed, so the number is still free.
+                failed = issue
+                if failed.t_id is None:
+                    # A filler is already a placeholder, so a new import
+                    # of the same filler is started.
+                    issue = failed.filler()
+                else:
+                    issue = failed.placeholder()
+                try:
+                    submit_with_retries(
+                        issue,
+                        expected_number,
+                        all_comments={},
+                        ticket_mapping=ticket_mapping,
+                        )
+                except SubmitError as placeholder_error:
+                    raise MigrationStopped(
+                        f'Could not create a placeholder for '
+                        f'{failed.describe()} as {failed.repo} '
+                        f'#{expected_number}: {placeholder_error}'
+                        )
+                if issue.github_number is not None:
+                    record(
+                        failed.t_id, 'failed',
+                        detail=(
+                            f'Placeholder created as '
+                            f'{issue.repo} #{issue.github_number}.'),
+                        )
+
+        if issue.github_number is not None:
+            imported.append(issue)
+        if len(imported) >= github_graphql.BATCH_SIZE:
+            imported = verify_issues(imported)
+        if PROGRESS is not None:
+            PROGRESS.done()
+
+    wait_for_issues(imported)
+
+
+def verify_issues(issues):
+    """
+    Resolve the GitHub IDs of imported issues from the same repository,
+    with one GraphQL query for each batch.
+
+    Return the issues which can not be read back yet.
+    """
+    if not issues:
+        return []
+
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            ids = github_graphql.resolve_issue_ids(
+                issues[0].owner,
+                issues[0].repo,
+                [issue.github_number for issue in issues],
+                post=graphql_request,
+                )
+            break
+        except SubmitError as error:
+            if not error.retry:
+                raise MigrationStopped(
+                    f'Could not verify the issues of {issues[0].repo}: '
+                    f'{error}')
+            failure, to_sleep = error, error.retry_after
+        except ValueError as error:
+            # An invalid response, or GraphQL errors.
+            failure, to_sleep = error, None
+
+        if attempt == MAX_ATTEMPTS:
+            raise MigrationStopped(
+                f'Could not verify the issues of {issues[0].repo}: '
+                f'{failure}')
+        if to_sleep is None:
+            to_sleep = 10 * 2 ** attempt
+        print(
+            f'Error: {failure} Retrying the verification in {to_sleep}s '
+            f'(attempt {attempt} of {MAX_ATTEMPTS}).')
+        time.sleep(to_sleep)
+
+    missing = []
+    for issue in issues:
+        if issue.github_number not in ids:
+            missing.append(issue)
+            continue
+        issue.github_node_id, issue.github_id = ids[issue.github_number]
+        print(f"Issue #{issue.github_number} has GHID {issue.github_id}.")
+        issue.record('verified', github_id=issue.github_id)
+    return missing
+
+
+def wait_for_issues(issues):
+    """
+    Verify the imported issues, waiting for the ones not readable yet.
+
+    There is a risk of GitHub reporting that the import job is done,
+    but accessing the issue immediately after fails.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        issues = verify_issues(issues)
+        if not issues:
+            return
+        time.sleep(2 ** attempt)
+
+    raise MigrationStopped(
+        'Imported issues not found: ' +
+        ', '.join(issue.trac_url() for issue in issues)
+        )
+
+
+def graphql_request(data):
+    """
+    Send a GraphQL query.
+
+    Raise a `SubmitError` if it failed.
+    """
+    response = protected_request(
+        url=f'{GITHUB_API}/graphql',
+        data=data,
+        expected_status_codes=(200,),
+        )
+    if response is not None and response.status_code != 200:
+        raise SubmitError.fromResponse(response)
+    return response
+
+
+def add_fillers(issues_by_repo, fillers):
+    """
+    Insert the placeholder issues planned as fillers
+    in the lists of (GitHubRequest, expected number) of each repository.
+    """
+    for repo, numbers in fillers.items():
+        if not numbers:
+            continue
+        repo_issues = issues_by_repo[repo]
+        template = repo_issues[0][0]
+        repo_issues.extend((template.filler(), number) for number in numbers)
+        repo_issues.sort(key=lambda pair: pair[1])
+
+
+def resume_pending_imports():
+    """
+    Wait for the imports posted before a crash,
+    and remember the created tickets in `tickets_created.tsv`.
+
+    The tickets with a failed import are planned again.
+    """
+    for trac_id, import_url in JOURNAL.pendingImports().items():
+        print(f'Resuming import {import_url} of ticket {trac_id}.')
+        response = check_import(import_url)
+        while response.json()['status'] == 'pending':
+            print('Waiting for import to finish...')
+            response = check_import(import_url)
+
+        if response.json()['status'] != 'imported':
+            record(
+                trac_id, 'failed',
+                detail=f'Import failed before resuming: {response.text}')
+            continue
+
+        owner, repo, number = IMPORTED_ISSUE_REGEX.search(
+            response.json()['issue_url']).groups()
+        github_url = f'https://github.com/{owner}/{repo}/issues/{number}'
+        remember_created(trac_id, github_url)
+        record(
+            trac_id, 'imported',
+            github_number=int(number),
+            github_url=github_url,
+            )
+
+
+def check_import(import_url):
+    """
+    Send a GET request for the status of an import job.
+    """
+    return protected_request(
+        url=import_url,
+        data=None,
+        method=requests.get,
+        expected_status_codes=(200,)
+        )
+
+
+def remember_created(trac_id, github_url):
+    """
+    Append a created ticket to `tickets_created.tsv`, and to its store.
+    """
+    with TSV_LOCK, open('tickets_created.tsv', 'a') as f:
+        f.write(f'{config.TRAC_TICKET_PREFIX}{trac_id}\t{github_url}\n')
+        ticket_store.remember('tickets_created.tsv', trac_id, github_url)
+
+
+def record(trac_id, state, detail=None, **columns):
+    """
+    Record a ticket state transition in the journal, if one is open.
+    Filler issues, not migrated from a ticket, are not recorded.
+    """
+    if JOURNAL is not None and trac_id is not None:
+        JOURNAL.transition(trac_id, state, detail=detail, **columns)
+
+
+def submit_with_retries(issue, expected_number, all_comments, ticket_mapping):
+    """
+    Submit an issue, retrying on temporary errors.
+
+    Raise the `SubmitError` if the error is permanent,
+    or if it persists after MAX_ATTEMPTS.
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return issue.submit(
+                expected_number,
+                all_comments=all_comments,
+                ticket_mapping=ticket_mapping
+                )
+        except SubmitError as error:
+            if not error.retry or attempt == MAX_ATTEMPTS:
+                raise
+
+            to_sleep = error.retry_after
+            if to_sleep is None:
+                to_sleep = 10 * 2 ** attempt
+            print(
+                f'Error: {error} Retrying {issue.trac_url()} '
+                f'in {to_sleep}s (attempt {attempt} of {MAX_ATTEMPTS}).')
+            time.sleep(to_sleep)
+
+
+def dead_letter(issue, expected_number, error):
+    """
+    Record a ticket which could not be submitted in DEAD_LETTER_FILE,
+    together with the response from GitHub.
+
+    Fillers are recorded without a Trac URL.
+    """
+    print(f'Error: giving up on {issue.describe()}: {error}')
+    record(issue.t_id, 'failed', detail=str(error))
+    response = error.response
+    with TSV_LOCK, open(DEAD_LETTER_FILE, 'a') as f:
+        f.write(json.dumps({
+            'trac_url': None if issue.t_id is None else issue.trac_url(),
+            'filler': issue.t_id is None,
+            'repo': issue.repo,
+            'expected_number': expected_number,
+            'error': str(error),
+            'status_code': None if response is None else response.status_code,
+            'response': None if response is None else response.text,
+            'time': datetime.datetime.utcnow().isoformat(),
+            }) + '\n')
+
+
+@stage_timer.timed('group_comments')
 def group_comments(raw_comments):
     """
     Group comments by ticket and time.
@@ -128,31 +540,21 @@ def select_tickets(tickets):
 
 def get_ticket_mapping(tickets, expected_numbers):
     """
-    Returns a dictionary of all known Trac ID -> GitHub URL correspondences.
+    Returns a mapping of all known Trac ID -> GitHub URL correspondences.
     The GitHub URL may either be expected, or read from tickets_created.tsv.
     """
-    mapping = get_tickets()
-    expected_allrepos = get_tickets('tickets_expected_gold.tsv')
-    for ticket, expected_numbers in expected_allrepos.items():
-        mapping[ticket] = expected_numbers
-
+    mapping = get_tickets().copy()
+    mapping.update(get_tickets('tickets_expected_gold.tsv'))
     return mapping
 
 
 def get_tickets(filename='tickets_created.tsv'):
     """
-    Reads the tickets_created.tsv, and returns a dictionary of
-    Trac ID -> GitHub URL of tickets that were sent to GitHub already.
+    Returns the TicketMappingStore of Trac ID -> GitHub URL
+    of the tickets in a TSV file like `tickets_created.tsv`.
+    The file is read only once per process.
     """
-    created_tickets = {}
-    with open(filename) as f:
-        for line in f:
-            if line.startswith(config.TRAC_TICKET_PREFIX):
-                trac_link, github_url = line.strip().split('\t')
-                trac_id = trac_link.split(config.TRAC_TICKET_PREFIX)[1]
-                trac_id = int(trac_id)
-                created_tickets[trac_id] = github_url
-    return created_tickets
+    return ticket_store.load(filename, config.TRAC_TICKET_PREFIX)
 
 
 def read_trac_tickets():
@@ -473,6 +875,8 @@ class NumberPredictor:
         Store a cache of repository -> next issue numbers.
         """
         self.next_numbers = {}
+        # Repository -> numbers planned for placeholder issues.
+        self.fillers = {}
 
     def requestNextNumber(self, repo, tickets_from_file):
         """
@@ -521,18 +925,19 @@ class NumberPredictor:
         Get the largest GitHub number, for either tickets or pulls.
         `kind` is either "issues" or "pulls".
 
-        By default GitHub orders them newest first.
+        By default GitHub orders them newest first,
+        so we only need the first item.
 
         Issue API docs:
         https://docs.github.com/en/rest/reference/issues#list-repository-issues
         PR API docs:
         https://docs.github.com/en/rest/reference/pulls#list-pull-requests
         """
-        tickets_or_pulls = requests.get(
-            url=f'https://api.github.com/repos/{config.OWNER}/{repo}/{kind}',
+        tickets_or_pulls = http_cache.get(
+            url=f'{GITHUB_API}/repos/{config.OWNER}/{repo}/{kind}',
             headers={'accept': 'application/vnd.github.v3+json'},
             auth=(config.OAUTH_USER, config.OAUTH_TOKEN),
-            params={'state': 'all'},
+            params={'state': 'all', 'per_page': 1},
             )
         try:
             last_number = tickets_or_pulls.json()[0]['number']
@@ -549,63 +954,89 @@ class NumberPredictor:
 
         return last_number
 
-    def orderTickets(self, tickets, already_created):
+    def orderTickets(self, tickets, already_created, max_fillers=0):
         """
         Choose an order to create tickets on GitHub so that we maximize
         matches of GitHub IDs with Trac IDs.
 
         Return the ticket objects in order, and their expected GitHub numbers.
+        The numbers planned for placeholder issues are kept in `fillers`.
         """
-        repositories = [config.REPOSITORY]
+        repositories = (
+            list(config.REPOSITORY_MAPPING.values()) +
+            [config.FALLBACK_REPOSITORY]
+            )
         all_repo_ordered_tickets = []
         expected_github_numbers = []
 
+        tickets_by_repo = group_tickets_by_repo(tickets)
         for repo in unique(repositories):
             print('processing repo', repo)
             self.next_numbers[repo] = self.requestNextNumber(
                 repo, already_created)
 
-            tickets_by_id = {t['t_id']: t for t in tickets}
-            ordered_tickets = []
-            not_matching = deque()
-
-            # Remember tickets not matching, which we can use to fill gaps.
-            for t_id in list(tickets_by_id.keys()):
-                if t_id < self.next_numbers[repo]:
-                    not_matching.append(tickets_by_id[t_id])
-
-            start = self.next_numbers[repo]
-            end = start + len(tickets_by_id)
-            for github_number in range(start, end):
-                # Check if we have a ticket on this position.
-                ticket = tickets_by_id.pop(github_number, None)
-                if ticket:
-                    ordered_tickets.append(ticket)
-                    continue
-
-                try:
-                    # Use non-matching tickets to fill the gap,
-                    # hoping that we eventually reach a matching one.
-                    ticket = not_matching.popleft()
-                    ordered_tickets.append(ticket)
-                except IndexError:
-                    # Can't fill the gap. Sacrifice new tickets from the end.
-                    t_id = max(tickets_by_id.keys())
-                    ordered_tickets.append(tickets_by_id.pop(t_id))
-
-            # Add what's left of the non-matching.
-            ordered_tickets.extend(not_matching)
+            ordered_tickets, numbers, fillers = self.planRepoTickets(
+                tickets_by_repo[repo], self.next_numbers[repo], max_fillers)
+            self.fillers[repo] = fillers
 
             # And add to the all-repo list.
             all_repo_ordered_tickets.extend(ordered_tickets)
-
-            # Compute GitHub numbers.
-            github_end = start + len(ordered_tickets)
-            expected_github_numbers.extend(range(start, github_end))
+            expected_github_numbers.extend(numbers)
 
         assert len(all_repo_ordered_tickets) == len(expected_github_numbers)
         return all_repo_ordered_tickets, expected_github_numbers
 
+    @staticmethod
+    def planRepoTickets(tickets, start, max_fillers=0):
+        """
+        Plan the tickets of a repository whose next GitHub number is `start`,
+        for the most tickets getting their Trac ID as GitHub number.
+
+        With N issues created, numbered from `start`,
+        all the tickets with IDs from `start` to `start + N - 1` can match,
+        and the other tickets fill the gaps between them:
+        first the ones below `start`, then the newest ones.
+        Up to `max_fillers` placeholder issues are added to the N issues,
+        only as many as needed to reach the largest ticket ID in range.
+
+        Return the ordered tickets, their expected GitHub numbers,
+        and the numbers of the placeholder issues.
+        This takes O(n log n), for sorting the newest tickets.
+        """
+        tickets_by_id = {t['t_id']: t for t in tickets}
+        count = len(tickets_by_id)
+
+        reachable = start + count + max_fillers - 1
+        largest = max(
+            (t_id for t_id in tickets_by_id if start <= t_id <= reachable),
+            default=0,
+            )
+        end = max(start + count, largest + 1)
+
+        # Tickets which can't match, used to fill the gaps.
+        gap_tickets = deque(
+            t for t_id, t in tickets_by_id.items() if t_id < start)
+        gap_tickets.extend(
+            tickets_by_id[t_id]
+            for t_id in sorted(
+                (t_id for t_id in tickets_by_id if t_id >= end), reverse=True)
+            )
+
+        ordered_tickets = []
+        numbers = []
+        fillers = []
+        for github_number in range(start, end):
+            ticket = tickets_by_id.get(github_number)
+            if ticket is None and gap_tickets:
+                ticket = gap_tickets.popleft()
+            if ticket is None:
+                fillers.append(github_number)
+            else:
+                ordered_tickets.append(ticket)
+                numbers.append(github_number)
+
+        return ordered_tickets, numbers, fillers
+
 
 def unique(elements):
     """
@@ -621,22 +1052,53 @@ def unique(elements):
     return uniques
 
 
-def output_stats(tickets, expected_numbers):
+def group_tickets_by_repo(tickets):
+    """
+    From a list of Trac tickets, in a single pass,
+    return a dict of GitHub repository -> tickets to be posted there.
+    """
+    tickets_by_repo = defaultdict(list)
+    for ticket in tickets:
+        tickets_by_repo[get_repo(ticket['component'])].append(ticket)
+    return tickets_by_repo
+
+
+def get_repo(component):
+    """
+    Given the Trac component,
+    choose the GitHub repository to create the issue in.
+    """
+    return config.REPOSITORY_MAPPING.get(component, config.FALLBACK_REPOSITORY)
+
+
+def output_stats(tickets, expected_numbers, fillers=None):
     """
     Show how many tickets will preserve their Trac ID.
 
-    Generate a file with the expected GitHub numbers.
+    Generate a file with the expected GitHub numbers,
+    and the ones of the placeholder issues planned as fillers.
     """
+    fillers = fillers or {}
     zipped = list(zip(tickets, expected_numbers))
     with open('tickets_expected.tsv', 'w') as f:
         f.write('Trac link\tExpected GitHub link\n')
         for t, e in zipped:
             _github_link = github_link(t.repo, e)
             f.write(f"{t.trac_url()}\t{_github_link}\n")
+        for repo, numbers in fillers.items():
+            for number in numbers:
+                f.write(f"Placeholder\t{github_link(repo, number)}\n")
 
     match_count = sum(1 for t, e in zipped if t.t_id == e)
     print('Expected GitHub numbers to match Trac ID: '
           f'{match_count} out of {len(tickets)}')
+    filler_count = sum(len(numbers) for numbers in fillers.values())
+    if filler_count:
+        print(f'Placeholder issues planned as fillers: {filler_count}')
+    if UNATTENDED:
+        print(f'Tickets will be submitted to GitHub: {not DRY_RUN}')
+        return
+
     print(
         'Check tickets_expected.tsv, and if correct, continue the debugger. '
         f'Tickets will be submitted to GitHub: {not DRY_RUN}'
@@ -673,7 +1135,7 @@ class GitHubRequest:
     Transform Trac tickets, comments, and their metadata to GitHub format,
     and allow submitting that format.
     """
-    # Cache for milestone title -> GitHub ID.
+    # Cache for (repository, milestone title) -> GitHub ID.
     milestones = {}
     # Cache for milestone title -> description.
     milestoneDescriptions = {}
@@ -717,22 +1179,29 @@ class GitHubRequest:
             # We are assuming closure is the last modification.
             self.data['closed_at'] = updated_at
 
-        # We get the issue number and ID after submitting.
+        # We get the import job and issue number after submitting,
+        # and the IDs from `verify_issues`.
+        self.import_check_url = None
+        self.issue_api_url = None
         self.github_number = None
+        self.github_node_id = None
         self.github_id = None
+        # A placeholder keeps the Trac ID of its failed ticket.
+        self.is_placeholder = False
 
     def submit(self, expected_number, all_comments, ticket_mapping):
         """
         Execute the POST request to create a GitHub issue.
 
-        In case of an unexpected state, go into debug mode.
+        In case of an unexpected state, go into debug mode,
+        or raise `SubmitError` in unattended mode.
+        Calling it again after a `SubmitError` resumes the submission,
+        without importing the issue twice.
 
         API Docs:
         https://gist.github.com/jonmagic/5282384165e0f86ef105#supported-issue-and-comment-fields
-        Get issue ID after created:
-        https://docs.github.com/en/rest/reference/issues#get-an-issue
         """
-        url = f'https://api.github.com/repos/{self.owner}/{self.repo}/import/issues'
+        url = f'{GITHUB_API}/repos/{self.owner}/{self.repo}/import/issues'
         if (
                 'assignee' in self.data and
                 self.data['assignee'] not in config.ASSIGNABLE_USERS
@@ -741,31 +1210,54 @@ class GitHubRequest:
             print(f"Skipping assignee {self.data['assignee']}.")
             self.data['assignee'] = None
 
-        if self.t_id not in all_comments:
-            all_comments[self.t_id] = []
-
+        # The comments are shared between the repository workers,
+        # so they are not changed.
         data = {
             'issue': self.data,
-            'comments': [c['github_comment'] for c in all_comments[self.t_id]]
+            'comments': [
+                c['github_comment'] for c in all_comments.get(self.t_id, [])]
             }
 
-        response = protected_request(
-            url=url, data=data, expected_status_codes=(202,))
-
-        if response:
-            # Remember the GitHub URL assigned to each ticket.
-            github_import_id = response.json()['id']
+        if self.github_number is None:
+            rendered_hash = hashlib.sha1(
+                json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+            if self.import_check_url is None and JOURNAL is not None:
+                # Resume an import started before a crash,
+                # if the ticket data did not change since.
+                journaled = JOURNAL.getTicket(self.t_id)
+                if (
+                        journaled and
+                        journaled['state'] == 'posted' and
+                        journaled['rendered_hash'] == rendered_hash
+                ):
+                    print(f"Resuming import {journaled['import_url']}.")
+                    self.import_check_url = journaled['import_url']
+
+            if self.import_check_url is None:
+                self.record(
+                    'rendered',
+                    repo=self.repo,
+                    expected_number=expected_number,
+                    rendered_hash=rendered_hash,
+                    )
+                response = protected_request(
+                    url=url, data=data, expected_status_codes=(202,))
+                if not response:
+                    # Dry run.
+                    return response
+
+                # Remember the import job, so that on retries
+                # we check it instead of importing the issue again.
+                github_import_id = response.json()['id']
+                self.import_check_url = f'{url}/{github_import_id}'
+                self.record('posted', import_url=self.import_check_url)
+            else:
+                response = self._checkImport()
 
             while response.json()['status'] == 'pending':
                 # Wait until our issue is created.
                 print('Waiting for import to finish...')
-                check_url = f'{url}/{github_import_id}'
-                response = protected_request(
-                    url=check_url,
-                    data=None,
-                    method=requests.get,
-                    expected_status_codes=(200,)
-                    )
+                response = self._checkImport()
 
             if response.json()['status'] != 'imported':
                 if (
@@ -784,23 +1276,30 @@ class GitHubRequest:
                         # Already removed.
                         pass
                     self.data['assignee'] = None
+                    self.import_check_url = None
                     return self.submit(expected_number, all_comments, ticket_mapping)
 
                 response = debug_response(response)
 
             number = int(response.json()['issue_url'].rsplit('/', 1)[1])
             self.github_number = number
+            self.issue_api_url = response.json()['issue_url']
             print(f"Import {response.json()['id']} succeeded for #{number}.")
 
-            with open('tickets_created.tsv', 'a') as f:
-                github_url = (
-                    f'https://github.com/{self.owner}/{self.repo}/issues/'
-                    f'{self.github_number}'
-                    )
-                f.write(f'{self.trac_url()}\t{github_url}\n')
+            github_url = (
+                f'https://github.com/{self.owner}/{self.repo}/issues/'
+                f'{self.github_number}'
+                )
+            if self.t_id is not None:
+                remember_created(self.t_id, github_url)
+            self.record(
+                'imported',
+                github_number=number,
+                github_url=github_url,
+                )
 
             if number != expected_number:
-                raise ValueError(
+                raise MigrationStopped(
                     f"Ticket number mismatch: "
                     f"expected {expected_number}, created {github_url}.\n"
                     f"Please manually add the comments and project of the issue, "
@@ -808,22 +1307,66 @@ class GitHubRequest:
                     f"and then restart the script."
                     )
 
-            # There is a risk of GitHub reporting that the import job is done,
-            # but accessing the issue immediately after returns a 404.
-            created = False
-            issue_api_url = response.json()['issue_url']
-            while not created:
-                response = protected_request(
-                    url=issue_api_url,
-                    data=None,
-                    method=requests.get,
-                    expected_status_codes=(200, 404)
-                    )
-                if response.status_code == 200:
-                    created = True
-            self.github_id = response.json()['id']
-            print(f"Issue #{self.github_number} has GHID {self.github_id}.")
-        return response
+    def record(self, state, detail=None, **columns):
+        """
+        Record a state transition of the ticket in the journal.
+
+        The transitions of a placeholder are not recorded,
+        so its ticket stays failed.
+        """
+        if not self.is_placeholder:
+            record(self.t_id, state, detail=detail, **columns)
+
+    def _checkImport(self):
+        """
+        Send a GET request for the status of the import job.
+        """
+        return check_import(self.import_check_url)
+
+    def placeholder(self):
+        """
+        Return a closed issue taking the place of this one on GitHub,
+        so that the following issues still get their expected numbers.
+        """
+        placeholder = GitHubRequest(
+            owner=self.owner,
+            repo=self.repo,
+            trac_id=self.t_id,
+            title=f'Placeholder for Trac ticket {self.t_id}',
+            body=(
+                f'Trac ticket {self.trac_url()} could not be migrated.\n'
+                f'This issue keeps its place in the numbering.'
+                ),
+            closed=True,
+            resolution=None,
+            milestone=None,
+            labels=['placeholder'],
+            assignees=[],
+            created_at=self.data['created_at'],
+            updated_at=self.data['updated_at'],
+            )
+        placeholder.is_placeholder = True
+        return placeholder
+
+    def filler(self):
+        """
+        Return a closed issue not migrated from any ticket,
+        only taking a number so that the following issues match their ID.
+        """
+        return GitHubRequest(
+            owner=self.owner,
+            repo=self.repo,
+            trac_id=None,
+            title='Placeholder',
+            body='This issue keeps the numbering of the Trac tickets.',
+            closed=True,
+            resolution=None,
+            milestone=None,
+            labels=['placeholder'],
+            assignees=[],
+            created_at=self.data['created_at'],
+            updated_at=self.data['updated_at'],
+            )
 
     def trac_url(self):
         """
@@ -831,13 +1374,25 @@ class GitHubRequest:
         """
         return config.TRAC_TICKET_PREFIX + str(self.t_id)
 
+    def describe(self):
+        """
+        Return the Trac URL, or a description for fillers.
+        """
+        if self.t_id is None:
+            return f'a filler of {self.repo}'
+        return self.trac_url()
+
     @classmethod
-    def getOrCreateMilestone(cls, title, ticket_mapping):
+    def getOrCreateMilestone(cls, repo, title, ticket_mapping):
         """
-        If a GitHub milestone exists named like the Trac one, return its ID,
+        If a GitHub milestone exists named like the Trac one
+        in the `repo` repository, return its ID,
         otherwise create it and return its ID.
         Remembers milestones in `milestones_created.tsv`.
 
+        Lines without a repository column were created before
+        the multi-repository support, in the fallback repository.
+
         API docs:
         https://docs.github.com/en/rest/issues/milestones#create-a-milestone
         """
@@ -845,15 +1400,17 @@ class GitHubRequest:
             # Some tickets don't have a milestone.
             return
 
-        if title in cls.milestones:
-            return cls.milestones[title]
+        if (repo, title) in cls.milestones:
+            return cls.milestones[(repo, title)]
 
         # Check whether we have already created the project.
         with open('milestones_created.tsv') as f:
-            projects_data = [line.split('\t') for line in f]
-            for line_title, number in projects_data:
-                if line_title == title:
-                    cls.milestones[title] = int(number)
+            projects_data = [line.rstrip('\n').split('\t') for line in f]
+            for line_title, number, *line_repo in projects_data:
+                line_repo = line_repo[0] if line_repo else (
+                    config.FALLBACK_REPOSITORY)
+                if line_title == title and line_repo == repo:
+                    cls.milestones[(repo, title)] = int(number)
                     return int(number)
 
         description = parse_body(
@@ -862,7 +1419,7 @@ class GitHubRequest:
 
         # We have not created the project. Create it.
         response = protected_request(
-            url=f'https://api.github.com/repos/{config.OWNER}/{config.REPOSITORY}/milestones',
+            url=f'{GITHUB_API}/repos/{config.OWNER}/{repo}/milestones',
             data={
                 'title': title,
                 'description': description,
@@ -873,7 +1430,10 @@ class GitHubRequest:
             milestone_number = response.json()['number']
 
             with open('milestones_created.tsv', 'a') as f:
-                f.write('\t'.join([title, str(milestone_number)]) + '\n')
+                f.write(
+                    '\t'.join([title, str(milestone_number), repo]) + '\n')
+            if JOURNAL is not None:
+                JOURNAL.append('milestones', [title, milestone_number, repo])
         except AttributeError as e:
             if "'NoneType' object has no attribute 'json'" in str(e):
                 if DRY_RUN:
@@ -885,7 +1445,7 @@ class GitHubRequest:
             else:
                 raise
 
-        cls.milestones[title] = milestone_number
+        cls.milestones[(repo, title)] = milestone_number
         return milestone_number
 
     @classmethod
@@ -909,10 +1469,11 @@ class GitHubRequest:
         assignees = [
             a for a in desired_assignees if a in config.ASSIGNABLE_USERS
             ]
+        repo = get_repo(kwargs['component'])
 
         return cls(
             owner=config.OWNER,
-            repo=config.REPOSITORY,
+            repo=repo,
             trac_id=kwargs['t_id'],
             title=kwargs['summary'],
             body=get_body(
@@ -923,7 +1484,7 @@ class GitHubRequest:
             closed=kwargs['status'] == 'closed',
             resolution=kwargs['resolution'],
             milestone=cls.getOrCreateMilestone(
-                kwargs['milestone'], ticket_mapping=ticket_mapping),
+                repo, kwargs['milestone'], ticket_mapping=ticket_mapping),
             labels=get_labels(**kwargs),
             assignees=assignees,
             created_at=isotime(kwargs['time']),
@@ -941,6 +1502,7 @@ class GitHubRequest:
                 )
 
 
+@stage_timer.timed('protected_request')
 def protected_request(
         url, data, method=requests.post, expected_status_codes=(201,), debug=True):
     """
@@ -956,6 +1518,8 @@ def protected_request(
     if original != noemails:
         print(original)
         print(''.join(difflib.context_diff(original, noemails)))
+        if UNATTENDED:
+            raise SubmitError(f'Refusing to send an e-mail to {url}.')
         import pdb; pdb.set_trace()
 
     if DRY_RUN and debug:
@@ -966,14 +1530,25 @@ def protected_request(
     # Import takes more than 0.2 seconds. Avoid checking excessively.
     # Also, there may be a risk of secondary rate limit:
     # https://docs.github.com/en/rest/guides/best-practices-for-integrators#dealing-with-secondary-rate-limits
-    time.sleep(0.2)
+    with stage_timer.stage('pacing'), RATE_LIMIT_LOCK:
+        time.sleep(0.2)
 
-    response = method(
-        url=url,
-        headers={'accept': 'application/vnd.github.golden-comet-preview+json'},
-        json=data,
-        auth=(config.OAUTH_USER, config.OAUTH_TOKEN)
-        )
+    headers = {'accept': 'application/vnd.github.golden-comet-preview+json'}
+    auth = (config.OAUTH_USER, config.OAUTH_TOKEN)
+    try:
+        if method is requests.get:
+            # Repeated GETs are sent as conditional requests,
+            # which don't count against the rate limit when not modified.
+            response = http_cache.get(url=url, headers=headers, auth=auth)
+        else:
+            response = method(url=url, headers=headers, json=data, auth=auth)
+    except requests.RequestException as error:
+        if UNATTENDED:
+            raise SubmitError(f'Request to {url} failed: {error}', retry=True)
+        raise
+
+    if PROGRESS is not None:
+        PROGRESS.observe(response)
 
     if (response.status_code not in expected_status_codes) and debug:
         print(f'Error: {method} request failed!')
@@ -982,7 +1557,10 @@ def protected_request(
         wait_for_rate_reset(response)
     except KeyError:
         # No rate limit headers?
-        import pdb; pdb.set_trace()
+        if UNATTENDED:
+            print(f'Warning: no rate limit headers from {url}.')
+        else:
+            import pdb; pdb.set_trace()
 
     return response
 
@@ -990,30 +1568,46 @@ def protected_request(
 def debug_response(response):
     """
     Debug a response from a server.
+
+    In unattended mode, raise a `SubmitError` instead.
     """
     print(response)
     pprint.pprint(dict(response.headers))
+    if UNATTENDED:
+        print(response.text)
+        raise SubmitError.fromResponse(response)
     import pdb
     pdb.set_trace()
     print('Done debugging!')
     return response
 
 
+@stage_timer.timed('wait_for_rate_reset')
 def wait_for_rate_reset(response):
     """
     Wait for a rate limit reset in case it is near exhaustion.
     """
     remaining = int(response.headers['X-RateLimit-Remaining'])
     reset_time = int(response.headers['X-RateLimit-Reset'])
-    if remaining < 50:
-        to_sleep = int(1 + reset_time - time.time())
-        print(
-            f"Waiting {to_sleep / 60} minutes "
-            f"(until {reset_time}) for rate limit reset.")
-        time.sleep(to_sleep)
+    if remaining < RATE_LIMIT_RESERVE:
+        # Other workers block on the lock until the limit is reset.
+        with RATE_LIMIT_LOCK:
+            to_sleep = int(1 + reset_time - time.time())
+            if to_sleep > 0:
+                print(
+                    f"Waiting {to_sleep / 60} minutes "
+                    f"(until {reset_time}) for rate limit reset.")
+                time.sleep(to_sleep)
+
 
+def branch_link(raw_branch, repo=None):
+    """
+    Convert a Trac branch name into a link to the branch
+    in the GitHub `repo`, or in the fallback repository if not given.
+    """
+    if repo is None:
+        repo = config.FALLBACK_REPOSITORY
 
-def branch_link(raw_branch):
     if '://' in raw_branch:
         # We leave URLs alone.
         return raw_branch
@@ -1029,7 +1623,7 @@ def branch_link(raw_branch):
     if ':' in branchname:
         owner, branchname = branchname.split(':')
 
-    return f'https://github.com/{owner}/{config.REPOSITORY}/tree/{branchname}'
+    return f'https://github.com/{owner}/{repo}/tree/{branchname}'
 
 
 
@@ -1041,7 +1635,8 @@ def get_body(description, data, ticket_mapping):
 
     branch_message = ''
     if data['branch']:
-        branch_message = f"|Branch|{branch_link(data['branch'])}|\n"
+        repo = get_repo(data.get('component'))
+        branch_message = f"|Branch|{branch_link(data['branch'], repo)}|\n"
 
     attachments_message = ''
     if 'attachments' in data and data['attachments']:
@@ -1207,6 +1802,7 @@ def format_attachments(ticket_id, attachment_list):
         )
 
 
+@stage_timer.timed('sanitize_email')
 def sanitize_email(text):
     """
     Sanitize emails like Trac, by replacing the domain with 3 dots.
@@ -1287,6 +1883,7 @@ def format_metadata(ticket_data):
         )
 
 
+@stage_timer.timed('parse_body')
 def parse_body(description, ticket_mapping):
     """
     Parses text with curly-bracketed or backtick-surrounded monospace.
@@ -1347,7 +1944,9 @@ def convert_issue_content(text, ticket_mapping):
                 f"Warning: ticket #{match} not in tickets_expected_gold.tsv"
                 f" - leaving it as #{match}")
 
-    return convert(text, base_path='', wiki_prefix=config.MIGRATED_WIKI_PREFIX)
+    with stage_timer.stage('convert'):
+        return convert(
+            text, base_path='', wiki_prefix=config.MIGRATED_WIKI_PREFIX)
 
 
 def update_changeset(text):
@@ -1415,4 +2014,5 @@ def parse_backtick(description, ticket_mapping):
 
 
 if __name__ == '__main__':
+    stage_timer.start('ticket_migrate_golden_comet_preview')
     main()
@@ -0,0 +1,260 @@
+"""
+Compact Trac ID <-> GitHub issue mapping, shared by the migration scripts.
+
+The mapping is read from a TSV file like `tickets_created.tsv`,
+once per process, with lines like:
+
+    https://trac.chevah.com/ticket/1234	https://github.com/chevah/server/issues/5678
+"""
+import os
+import re
+from array import array
+from collections.abc import Mapping, ValuesView
+from itertools import repeat
+
+GITHUB_ISSUE_REGEX = re.compile(
+    r'https://github\.com/([^/]+)/([^/]+)/issues/(\d+)')
+
+# Absolute path -> TicketMappingStore, for the files already loaded.
+_loaded = {}
+
+
+class TicketMappingStore(Mapping):
+    """
+    Map Trac IDs to GitHub issue URLs, like the dicts of `get_tickets`.
+
+    Instead of a URL string for each ticket, it keeps arrays indexed
+    by Trac ID (the repository index and the GitHub number),
+    and an array for each repository indexed by GitHub number
+    (the Trac ID), for O(1) lookups in both directions.
+    """
+    def __init__(self):
+        # Repository index -> (owner, repository name).
+        self.repos = []
+        # Repository name -> repository index.
+        self.repo_indexes = {}
+        # Trac ID -> repository index, or -1 for unknown tickets.
+        self.forward_repo = array('h')
+        # Trac ID -> GitHub number.
+        self.forward_number = array('l')
+        # Repository index -> GitHub number -> Trac ID, or 0 if unknown.
+        self.reverse = []
+        self.count = 0
+
+    @classmethod
+    def fromLines(cls, lines, trac_ticket_prefix):
+        """
+        Create a store from the lines of a TSV file.
+        Lines not starting with the Trac ticket prefix are ignored.
+        """
+        store = cls()
+        for line in lines:
+            if line.startswith(trac_ticket_prefix):
+                trac_link, github_url = line.strip().split('\t')
+                trac_id = int(trac_link.split(trac_ticket_prefix)[1])
+                store.addURL(trac_id, github_url)
+        return store
+
+    @classmethod
+    def fromTSV(cls, filename, trac_ticket_prefix):
+        """
+        Create a store from a TSV file.
+        """
+        with open(filename) as f:
+            return cls.fromLines(f, trac_ticket_prefix)
+
+    def copy(self):
+        """
+        Return an independent copy of the store.
+        """
+        other = TicketMappingStore()
+        other.repos = list(self.repos)
+        other.repo_indexes = dict(self.repo_indexes)
+        other.forward_repo = array('h', self.forward_repo)
+        other.forward_number = array('l', self.forward_number)
+        other.reverse = [array('l', r) for r in self.reverse]
+        other.count = self.count
+        return other
+
+    def update(self, other):
+        """
+        Add, or replace, all the tickets of another store.
+        """
+        for trac_id in other:
+            owner, repo, number = other.lookupWithOwner(trac_id)
+            self.add(trac_id, repo, number, owner)
+
+    def addURL(self, trac_id, github_url):
+        """
+        Add a ticket, given its GitHub URL.
+        """
+        match = GITHUB_ISSUE_REGEX.match(github_url)
+        if not match:
+            raise ValueError(f'Not a GitHub issue URL: {github_url}')
+        owner, repo, number = match.groups()
+        self.add(trac_id, repo, int(number), owner)
+
+    def add(self, trac_id, repo, number, owner):
+        """
+        Add a ticket created as `owner/repo#number`, replacing any previous.
+        """
+        index = self.repo_indexes.get(repo)
+        if index is None:
+            index = len(self.repos)
+            self.repos.append((owner, repo))
+            self.repo_indexes[repo] = index
+            self.reverse.append(array('l'))
+
+        _grow(self.forward_repo, trac_id + 1, -1)
+        _grow(self.forward_number, trac_id + 1, 0)
+
+        old_index = self.forward_repo[trac_id]
+        if old_index == -1:
+            self.count += 1
+        else:
+            old_number = self.forward_number[trac_id]
+            self.reverse[old_index][old_number] = 0
+
+        self.forward_repo[trac_id] = index
+        self.forward_number[trac_id] = number
+        _grow(self.reverse[index], number + 1, 0)
+        self.reverse[index][number] = trac_id
+
+    def lookupWithOwner(self, trac_id):
+        """
+        Return the (owner, repository, number) of a Trac ID, or None.
+        """
+        if not 0 <= trac_id < len(self.forward_repo):
+            return None
+        index = self.forward_repo[trac_id]
+        if index == -1:
+            return None
+        owner, repo = self.repos[index]
+        return owner, repo, self.forward_number[trac_id]
+
+    def lookup(self, trac_id):
+        """
+        Return the (repository, GitHub number) of a Trac ID, or None.
+        """
+        found = self.lookupWithOwner(trac_id)
+        if found is None:
+            return None
+        return found[1:]
+
+    def reverseLookup(self, repo, number):
+        """
+        Return the Trac ID migrated as `repo#number`, or None.
+        """
+        index = self.repo_indexes.get(repo)
+        if index is None:
+            return None
+        reverse = self.reverse[index]
+        if not 0 <= number < len(reverse) or not reverse[number]:
+            return None
+        return reverse[number]
+
+    def maxNumber(self, repo):
+        """
+        Return the largest GitHub number used in `repo`, or 0.
+        """
+        index = self.repo_indexes.get(repo)
+        if index is None:
+            return 0
+        reverse = self.reverse[index]
+        for number in range(len(reverse) - 1, 0, -1):
+            if reverse[number]:
+                return number
+        return 0
+
+    def repoView(self, repo):
+        """
+        Return a mapping of Trac ID -> GitHub number, as strings,
+        for the tickets migrated to `repo`.
+        """
+        return RepoView(self, repo)
+
+    def __getitem__(self, trac_id):
+        found = self.lookupWithOwner(trac_id) if isinstance(
+            trac_id, int) else None
+        if found is None:
+            raise KeyError(trac_id)
+        owner, repo, number = found
+        return f'https://github.com/{owner}/{repo}/issues/{number}'
+
+    def __iter__(self):
+        for trac_id, index in enumerate(self.forward_repo):
+            if index != -1:
+                yield trac_id
+
+    def __len__(self):
+        return self.count
+
+
+class RepoView(Mapping):
+    """
+    The tickets of a single repository,
+    as Trac ID -> GitHub number strings.
+    """
+    def __init__(self, store, repo):
+        self.store = store
+        self.repo = repo
+
+    def __getitem__(self, trac_id):
+        found = self.store.lookup(int(trac_id))
+        if found is None or found[0] != self.repo:
+            raise KeyError(trac_id)
+        return str(found[1])
+
+    def __iter__(self):
+        for trac_id in self.store:
+            if self.store.lookup(trac_id)[0] == self.repo:
+                yield str(trac_id)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def values(self):
+        return RepoNumbers(self)
+
+
+class RepoNumbers(ValuesView):
+    """
+    The GitHub numbers of a repository, with O(1) membership checks.
+    """
+    def __contains__(self, number):
+        return self._mapping.store.reverseLookup(
+            self._mapping.repo, int(number)) is not None
+
+
+def _grow(numbers, size, fill):
+    """
+    Extend an array up to `size` items, with `fill` values.
+    """
+    if len(numbers) < size:
+        numbers.extend(repeat(fill, size - len(numbers)))
+
+
+def load(filename, trac_ticket_prefix):
+    """
+    Return the store for a TSV file, reading the file only once per process.
+    """
+    path = os.path.abspath(filename)
+    if path not in _loaded:
+        _loaded[path] = TicketMappingStore.fromTSV(path, trac_ticket_prefix)
+    return _loaded[path]
+
+
+def remember(filename, trac_id, github_url):
+    """
+    Add a line just appended to a TSV file to its store, if already loaded.
+    """
+    store = _loaded.get(os.path.abspath(filename))
+    if store is not None:
+        store.addURL(trac_id, github_url)
+
+
+def forget(filename):
+    """
+    Discard the store of a TSV file, so that the next `load` reads it again.
+    """
+    _loaded.pop(os.path.abspath(filename), None)
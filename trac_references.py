@@ -0,0 +1,177 @@
+"""
+Rewrite the Trac ticket references in source trees and docs
+to their GitHub issues, using `tickets_created.tsv`.
+
+    python trac_references.py [--project=NAME] [--map=PREFIX=PROJECT] ROOT
+
+All the reference forms are matched with a single pattern:
+
+* `https://trac.chevah.com/ticket/1234`, with the `TRAC_TICKET_PREFIX`
+  from `config.py` - the GitHub issue URL.
+* `trac#1234` - the `owner/repo#number` GitHub reference.
+
+The `FIXME:1234:` markers are left to `fixme_migrator.py`,
+as a migrated marker can not be told apart from a Trac one.
+The rewritten references no longer match,
+so running it again changes nothing.
+
+Only the files containing a reference are decoded.
+They are rewritten line by line into a temporary file,
+which replaces the file only when something changed.
+"""
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import ticket_store
+from fixme_migrator import (
+    SKIPPED_PATHS,
+    WORKERS,
+    Projects,
+    Report,
+    list_files,
+    parse_arguments,
+    )
+
+try:
+    import config
+except ModuleNotFoundError:
+    # In the tests, we monkeypatch this module.
+    config = None
+
+# Unlike the FIXMEs, the references in the release notes are rewritten.
+SKIPPED = tuple(path for path in SKIPPED_PATHS if path != 'release-notes')
+
+
+class Rewriter:
+    """
+    Replace the Trac references of the files in the `projects`.
+    """
+
+    def __init__(self, projects, report=None):
+        self.projects = projects
+        self.store = projects.store
+        self.report = report
+
+        prefix = config.TRAC_TICKET_PREFIX
+        # Any reference, searched in the bytes of the files.
+        self.markers = re.compile(
+            b'trac#|' + re.escape(prefix.encode('utf-8')))
+        self.regex = re.compile(
+            re.escape(prefix) + r'(?P<url>\d+)\b'
+            r'|\btrac#(?P<short>\d+)\b'
+            )
+
+    def replaceMatch(self, match, project):
+        """
+        Return the GitHub reference for a matched Trac reference.
+        """
+        trac_id = match.group('url') or match.group('short')
+        found = self.store.lookupWithOwner(int(trac_id))
+        if found is None:
+            self._report(project, Report.NOT_MIGRATED, trac_id)
+            return match.group(0)
+
+        owner, repo, number = found
+        if match.group('url'):
+            return f'https://github.com/{owner}/{repo}/issues/{number}'
+        return f'{owner}/{repo}#{number}'
+
+    def _report(self, project, kind, trac_id):
+        if self.report is not None:
+            self.report.add(project, kind, trac_id)
+
+    def rewrite(self, text, project):
+        """
+        Return the text with the references replaced,
+        reporting the IDs not migrated for the `project` of the text.
+        """
+        return self.regex.sub(
+            lambda match: self.replaceMatch(match, project), text)
+
+    def rewriteFile(self, fpath):
+        """
+        Rewrite the file in-place, streaming it line by line.
+
+        Return `True` if the file was changed.
+        """
+        try:
+            if not has_reference(fpath, self.markers):
+                return False
+        except OSError:
+            # Most likely a broken link.
+            return False
+
+        project = self.projects.getProject(fpath)
+        directory, name = os.path.split(fpath)
+        handle, temporary = tempfile.mkstemp(
+            dir=directory or '.', prefix=f'.{name}.')
+        changed = False
+        try:
+            with open(fpath, 'rb') as source, os.fdopen(handle, 'wb') as f:
+                for line in source:
+                    text = line.decode('utf-8')
+                    new_text = self.rewrite(text, project)
+                    if new_text != text:
+                        changed = True
+                        line = new_text.encode('utf-8')
+                    f.write(line)
+            if changed:
+                shutil.copymode(fpath, temporary)
+                os.replace(temporary, fpath)
+        except UnicodeDecodeError:
+            # Likely a binary file. Skip it.
+            changed = False
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return changed
+
+    def rewriteFiles(self, paths, workers=WORKERS):
+        """
+        Rewrite the files with a pool of threads.
+
+        Return the number of changed files.
+        """
+        with ThreadPoolExecutor(workers) as pool:
+            return sum(pool.map(self.rewriteFile, paths))
+
+
+def has_reference(fpath, markers):
+    """
+    Return `True` if the file contains a match of the `markers`,
+    like a Trac reference.
+    """
+    with open(fpath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped.
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return markers.search(content) is not None
+
+
+def main():
+    """
+    Rewrite the Trac references of all the files under the root.
+    """
+    root, project, paths, _ = parse_arguments(sys.argv[1:])
+
+    store = ticket_store.load(
+        'tickets_created.tsv', config.TRAC_TICKET_PREFIX)
+    projects = Projects(store, root, paths, default=project)
+    report = Report()
+
+    fpaths = list_files(root, projects.names, SKIPPED)
+    changed = Rewriter(projects, report).rewriteFiles(fpaths)
+    print(f'Changed {changed} of {len(fpaths)} files.')
+
+    for line in report.lines():
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Export the latest version of each wiki page as a Markdown file,
+in a directory structure matching the hierarchical page names.
+
+    python wiki_markdown_export.py PATH/TO/Trac.db3 PATH/TO/OUTPUT
+
+The pages are streamed from the SQLite3 DB,
+and converted and written by a pool of processes.
+Links to other wiki pages use `config.MIGRATED_WIKI_PREFIX`.
+"""
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import trac2down
+from wiki_migrate import PAGE_NAME_MAPPING
+
+try:
+    import config
+except ModuleNotFoundError:
+    # In the tests, we monkeypatch this module.
+    config = None
+
+# Pages sent at once to the pool, to keep a bounded number in memory.
+BATCH_SIZE = 256
+
+# Pages sent at once to a worker process.
+CHUNK_SIZE = 16
+
+
+def main(args):
+    """
+    Do the job.
+    """
+    if len(args) != 2:
+        print("Need to pass the path to DB file and output directory.")
+        sys.exit(1)
+
+    db_file, output = args
+    start = time.perf_counter()
+    count = export_pages(get_latest_pages(db_file), output)
+    elapsed = time.perf_counter() - start
+    print(
+        f'Exported {count} pages in {elapsed:.1f}s '
+        f'({count / max(elapsed, 1e-6):.0f} pages/s).'
+        )
+
+
+def get_latest_pages(db_file):
+    """
+    Yield the (name, version, time, author, text)
+    of the latest version of each page.
+
+    Pages which were never changed after the Trac install are skipped.
+    """
+    db = sqlite3.connect(db_file)
+    try:
+        # SQLite takes the other columns from the row with the max version.
+        for name, version, timestamp, author, text in db.execute(
+                'SELECT name, MAX(version), time, author, text '
+                'FROM wiki GROUP BY name ORDER BY name'):
+            if author == 'trac':
+                continue
+            name = PAGE_NAME_MAPPING.get(name, name)
+            yield name, version, timestamp, author, text
+    finally:
+        db.close()
+
+
+def export_pages(pages, output, workers=None):
+    """
+    Convert and write the pages in the `output` directory,
+    with a process for each CPU by default.
+
+    Return the number of exported pages.
+    """
+    directories = set()
+    count = 0
+    with ProcessPoolExecutor(workers) as pool:
+        batch = []
+        for page in pages:
+            # Each directory is created once, before its pages are written.
+            directory = os.path.join(output, *page[0].split('/')[:-1])
+            if directory not in directories:
+                os.makedirs(directory, exist_ok=True)
+                directories.add(directory)
+
+            batch.append((output,) + page)
+            if len(batch) >= BATCH_SIZE:
+                count += sum(pool.map(_export, batch, chunksize=CHUNK_SIZE))
+                batch = []
+        count += sum(pool.map(_export, batch, chunksize=CHUNK_SIZE))
+    return count
+
+
+def _export(job):
+    """
+    Convert and write a page, in a worker process.
+    """
+    output, name, version, timestamp, author, text = job
+    markdown = trac2down.convert(
+        text,
+        base_path=os.path.dirname('/wikis/' + name),
+        wiki_prefix=config.MIGRATED_WIKI_PREFIX,
+        )
+    trac2down.save_file(
+        markdown, name, version, timestamp, author, output)
+    return 1
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,18 +4,57 @@ Generate local wiki files based on Trac DB file.
 Accepted DB formats:
 * SQlite3 DB (.db3)
 * PSQL dump (.psql)
+
+With `--fast-import`, all the revisions are streamed
+into a single `git fast-import` process,
+instead of running `git add` and `git commit` for each revision:
+
+    python wiki_migrate.py --fast-import PATH/TO/Trac.db3 PATH/TO/GIT-REPO
+
+With `--convert=rst` or `--convert=markdown`, the text of each revision
+is converted as it is committed, so the whole history is converted:
+
+    python wiki_migrate.py --convert=rst PATH/TO/Trac.db3 PATH/TO/GIT-REPO
 """
 import os
+import re
 import sqlite3
 import subprocess
 import sys
 from datetime import datetime
+from functools import lru_cache
+
+import stage_timer
+import trac2down
+import wiki_trac_rst_convert
+from git_fast_import import FastImport
 
-from config import USER_MAPPING, DEFAULT_GITHUB_USER, FILE_EXTENSION
+try:
+    import config
+except ModuleNotFoundError:
+    # In the tests, we monkeypatch this module.
+    config = None
 
 # Set to True to not commit.
 DRY_RUN = False
 
+# Rows of a pg_dump file inserted at once in the timestamp index.
+INDEX_BATCH_SIZE = 1000
+
+# Backslash sequences of the COPY text format.
+COPY_ESCAPE = re.compile(rb'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))', re.S)
+COPY_ESCAPES = {
+    b'b': b'\b',
+    b'f': b'\f',
+    b'n': b'\n',
+    b'r': b'\r',
+    b't': b'\t',
+    b'v': b'\v',
+    }
+
+
+# Converted texts kept for revisions with identical text.
+CONVERSION_CACHE_SIZE = 1024
 
 # Wiki names to file names.
 PAGE_NAME_MAPPING = {
@@ -27,6 +66,16 @@ def main(args):
     """
     Do the job.
     """
+    options = [arg for arg in args if arg.startswith('--')]
+    args = [arg for arg in args if not arg.startswith('--')]
+    fast_import = '--fast-import' in options
+    converter = None
+    for option in options:
+        if option.startswith('--convert='):
+            converter = option.split('=', 1)[1]
+            if converter not in CONVERTERS:
+                print("Unknown converter:", converter)
+                sys.exit(1)
 
     if len(args) != 2:
         print("Need to pass the path to DB file and git repo as arguments.")
@@ -36,99 +85,219 @@ def main(args):
     target_repo = args[1]
 
     if db_file.endswith('.db3'):
-        return _migrate_sqlite(db_file, target_repo)
+        changes = _read_sqlite(db_file)
+    elif db_file.endswith('.psql'):
+        changes = _read_pq_dump(db_file)
+    else:
+        print("Unknown DB format:", db_file)
+        sys.exit(1)
+
+    # The stages are interleaved, as the changes are streamed.
+    changes = stage_timer.iterate('read', changes)
+    if converter:
+        changes = convert_changes(changes, converter)
 
-    if db_file.endswith('.psql'):
-        return _migrate_pq_dump(db_file, target_repo)
+    with stage_timer.stage('commit'):
+        if fast_import:
+            return _fast_import_changes(changes, target_repo)
+        return _commit_changes(changes, target_repo)
 
 
-def _migrate_sqlite(db_file, target_repo):
+def _read_sqlite(db_file):
     """
-    Generate files based on SQLite3 db file.
+    Return an iterator over the changes from the SQLite3 db file,
+    sorted by timestamp.
     """
     db = sqlite3.connect(db_file)
+    rows = db.execute('SELECT * FROM wiki ORDER BY time')
+    # Ignore the internal trac updates.
+    return (_sqlite_change(row) for row in rows if row[3] != 'trac')
 
-    start_dir = os.getcwd()
+
+def _sqlite_change(row):
+    """
+    Return the change for a row of the wiki table.
+    """
+    name, version, timestamp, author, ipnr, text, comment, ro = row
+    return {
+        'name': get_page_name(name),
+        'timestamp': timestamp,
+        'author': author,
+        'text': text,
+        'comment': comment,
+        }
+
+
+def _read_pq_dump(db_file):
+    """
+    Return an iterator over the changes from the pg_dump file,
+    sorted by timestamp.
+
+    pg_dump  --no-owner --data-only  --file=trac-wiki.dump --table=wiki trac
+
+    The dump is not sorted by timestamp.
+    Instead of keeping all pages in memory, only the offsets of the rows
+    are sorted, in a temporary on-disk SQLite DB,
+    and each row is read again from the dump when its turn comes.
+    """
+    stream = open(db_file, 'rb')
     try:
-        os.chdir(target_repo)
+        index = _index_pq_dump(stream)
+    except Exception:
+        stream.close()
+        raise
+    return _read_indexed_rows(stream, index)
+
+
+def _index_pq_dump(stream):
+    """
+    Return a temporary DB with the timestamp and the offset
+    of each wiki row in the COPY data of the dump `stream`.
+    """
+    # An empty name is a temporary DB, which spills to disk.
+    index = sqlite3.connect('')
+    index.execute('CREATE TABLE row (timestamp INTEGER, offset INTEGER)')
+
+    rows = []
+    for offset, line in _copy_lines(stream):
+        name, version, timestamp, author, _ = line.split(b'\t', 4)
+        if author == b'trac':
+            # This is internal trac update.
+            continue
+        rows.append((int(timestamp), offset))
+        if len(rows) >= INDEX_BATCH_SIZE:
+            index.executemany('INSERT INTO row VALUES (?, ?)', rows)
+            rows = []
+    index.executemany('INSERT INTO row VALUES (?, ?)', rows)
+    return index
+
+
+def _copy_lines(stream):
+    """
+    Yield the offset and the line of each row in the COPY data
+    of the dump `stream`, without the end of line.
+    """
+    copy_started = False
+    offset = 0
+    for line in stream:
+        line_offset = offset
+        offset += len(line)
+
+        if line == b'\\.\n':
+            # End of COPY dump.
+            break
 
-        for row in db.execute('SELECT * FROM wiki ORDER BY time'):
-            name, version, timestamp, author, ipnr, text, comment, ro = row
-            if author == 'trac':
-                continue
+        if line.startswith(b'COPY '):
+            # We can start to process the next line.
+            copy_started = True
+            continue
 
-            name = get_page_name(name)
+        if not copy_started:
+            # We are still in the header
+            continue
 
-            print("Adding", name)
+        yield line_offset, line.rstrip(b'\n')
 
-            write_file(name, text)
-            commit_change(name, author, comment, timestamp / 1000000)
 
+def _read_indexed_rows(stream, index):
+    """
+    Yield the changes of the dump `stream`,
+    in the order of the rows from the `index` DB.
+    """
+    try:
+        for offset, in index.execute(
+                'SELECT offset FROM row ORDER BY timestamp, offset'):
+            stream.seek(offset)
+            yield _pq_change(stream.readline().rstrip(b'\n'))
     finally:
-        os.chdir(start_dir)
+        index.close()
+        stream.close()
 
 
-def _migrate_pq_dump(db_file, target_repo):
+def _pq_change(line):
+    """
+    Return the change for a row of the COPY data.
     """
-    Generate files based on pg_dump file.
+    name, version, timestamp, author, ipnr, text, comment, ro = [
+        decode_copy_field(field) for field in line.split(b'\t')]
+    return {
+        'name': get_page_name(name),
+        'timestamp': int(timestamp),
+        'author': author,
+        'text': text,
+        'comment': comment,
+        }
+
+
+def decode_copy_field(field):
+    """
+    Return the str value of a bytes field of the COPY text format,
+    or None for NULL.
 
-    pg_dump  --no-owner --data-only  --file=trac-wiki.dump --table=wiki trac
+    https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.2
     """
+    if field == b'\\N':
+        return None
+    if b'\\' in field:
+        field = COPY_ESCAPE.sub(_unescape_copy, field)
+    return field.decode('utf-8')
 
-    copy_started = False
-    # The dump is not sorted by timestamp, so we need to manually sort it
-    # and keep all pages in memory.
-    changes = []
-
-    with open(db_file, 'rb') as stream:
-        while True:
-            line = stream.readline()
-
-            if not line:
-                # End of stream.
-                # Most likely this is not heat.
-                break
-
-            if line == b'\\.\n':
-                # End of COPY dump.
-                break
-
-            if line.startswith(b'COPY '):
-                # We can start to process the next line.
-                copy_started = True
-                continue
-
-            if not copy_started:
-                # We are still in the header
-                continue
-
-            line = line.decode('utf-8')
-
-            name, version, timestamp, author, ipnr, rest = line.split('\t', 5)
-            text, comment, ro = rest.rsplit('\t', 2)
-
-            if author == 'trac':
-                # This is internal trac update.
-                continue
-
-            timestamp = int(timestamp)
-            name = get_page_name(name)
-
-            text = text.replace('\\r\\n', '\r\n')
-            text = text.replace('\\n', '\n')
-            changes.append({
-                'name': name,
-                'timestamp': timestamp,
-                'author': author,
-                'text': text,
-                'comment': comment,
-                })
 
+def _unescape_copy(match):
+    """
+    Return the bytes for a backslash escape sequence.
+    """
+    octal, hexadecimal, char = match.groups()
+    if octal:
+        return bytes([int(octal, 8) & 0xff])
+    if hexadecimal:
+        return bytes([int(hexadecimal, 16)])
+    return COPY_ESCAPES.get(char, char)
+
+
+def _convert_markdown(text):
+    """
+    Convert TracWiki to Markdown.
+    """
+    return trac2down.convert(
+        text, base_path='', wiki_prefix=config.MIGRATED_WIKI_PREFIX)
+
+
+# Name of the converter -> (conversion function, page file extension).
+CONVERTERS = {
+    'rst': (wiki_trac_rst_convert.convert_content, '.rst'),
+    'markdown': (_convert_markdown, '.md'),
+    }
+
+
+def convert_changes(changes, converter):
+    """
+    Yield the changes with their text converted by the `converter`,
+    and with its file extension.
+
+    Revisions with the same text are only converted once.
+    """
+    convert, extension = CONVERTERS[converter]
+    convert = stage_timer.timed('convert')(convert)
+    convert = lru_cache(maxsize=CONVERSION_CACHE_SIZE)(convert)
+
+    for change in changes:
+        name = change['name']
+        if name.endswith(config.FILE_EXTENSION):
+            name = name[:-len(config.FILE_EXTENSION)]
+        yield dict(
+            change, name=name + extension, text=convert(change['text']))
+
+
+def _commit_changes(changes, target_repo):
+    """
+    Write and commit each change in the working tree of the git repo.
+    """
     start_dir = os.getcwd()
     try:
         os.chdir(target_repo)
 
-        for change in sorted(changes, key=lambda k: k['timestamp']):
+        for change in changes:
 
             print("Adding", change['name'])
 
@@ -144,6 +313,41 @@ def _migrate_pq_dump(db_file, target_repo):
         os.chdir(start_dir)
 
 
+def _fast_import_changes(changes, target_repo):
+    """
+    Commit all the changes with a single `git fast-import` process.
+
+    The working tree of the git repo is not updated.
+    """
+    if DRY_RUN:
+        for change in changes:
+            commit_change(
+                change['name'],
+                change['author'],
+                change['comment'],
+                change['timestamp'] / 1000000,
+                )
+        return
+
+    with FastImport(target_repo) as git:
+        committer = git.committer()
+        for change in changes:
+            message, git_author = get_commit_details(
+                change['name'], change['author'], change['comment'])
+            git.commit(
+                {change['name']: change['text']},
+                author=git_author,
+                timestamp=change['timestamp'] / 1000000,
+                message=message,
+                committer=committer,
+                )
+
+    print(
+        f'Imported {git.commits} revisions into {git.branch}. '
+        f'Run `git reset --hard` in {target_repo} to update its files.'
+        )
+
+
 def get_page_name(name):
     """
     Return the full GitHub page file name.
@@ -152,7 +356,7 @@ def get_page_name(name):
     """
     name = PAGE_NAME_MAPPING.get(name, name)
 
-    return name.replace('/', ' ').strip() + FILE_EXTENSION
+    return name.replace('/', ' ').strip() + config.FILE_EXTENSION
 
 
 def write_file(name, text):
@@ -163,16 +367,16 @@ def write_file(name, text):
         stream.write(text)
 
 
-def commit_change(path, author, comment, timestamp):
+def get_commit_details(path, author, comment):
     """
-    Commit the current file.
+    Return the commit message and the git author for a change of a page.
     """
-    default_user = DEFAULT_GITHUB_USER
+    default_user = config.DEFAULT_GITHUB_USER
     if not default_user:
         # Create a default git user on the fly if one is not configured.
         default_user = (author, '{} <anonymous@example.com>'.format(author))
 
-    git_user, git_author = USER_MAPPING.get(author, default_user)
+    git_user, git_author = config.USER_MAPPING.get(author, default_user)
 
     name = path.rsplit(' ', 1)[-1]
 
@@ -181,6 +385,14 @@ def commit_change(path, author, comment, timestamp):
     else:
         message = name + ' modified by ' + git_user
 
+    return message, git_author
+
+
+def commit_change(path, author, comment, timestamp):
+    """
+    Commit the current file.
+    """
+    message, git_author = get_commit_details(path, author, comment)
     git_date = datetime.fromtimestamp(timestamp).isoformat()
 
     if DRY_RUN:
@@ -197,4 +409,5 @@ def commit_change(path, author, comment, timestamp):
 
 
 if __name__ == '__main__':
+    stage_timer.start('wiki_migrate')
     main(sys.argv[1:])
@@ -1,7 +1,15 @@
 # Convert local files formated in Trac Wiki RST to GitHub RST.
+import hashlib
+import json
 import re
+import shutil
+import subprocess
 import sys
 import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 
 try:
     import config
@@ -9,33 +17,295 @@ except ModuleNotFoundError:
     # In the tests, we monkeypatch this module.
     config = None
 
+# Files sent at once to a worker process, in parallel mode.
+CHUNK_SIZE = 16
+
+# Increase it after changing the conversion rules,
+# so that the pages converted with the previous rules are converted again.
+CONVERTER_VERSION = 1
+
+# Records the conversion of each page, in the `.git` dir of the wiki.
+MANIFEST_NAME = 'trac-rst-manifest.json'
+
+# Start of all the pages produced by `convert_content`,
+# with a local TOC, or with the sections listed from a PageOutline macro.
+CONVERTED_START = (b'.. contents::\n\n', b'.. PageOutline\n\n')
+
+# Placeholder of a PageOutline macro, until the headings are converted.
+OUTLINE_MARKER = '\0PageOutline:{}\0'
+
+# Characters used to underline the RST section titles.
+RST_ADORNMENTS = '=-~^"\'`#*+:._'
+
+# States of a page after `convert_page`.
+CONVERTED = 'converted'
+SKIPPED = 'skipped'
+REFUSED = 'refused'
+
 
 def main():
     """
     Do the job.
     """
-    if len(sys.argv) != 2:
+    args = sys.argv[1:]
+    parallel = '--parallel' in args
+    if parallel:
+        args.remove('--parallel')
+
+    if len(args) != 1:
         print("Need to pass the path to wiki base directory.")
         sys.exit(1)
 
-    for root, _, files in os.walk(sys.argv[1]):
-        for name in files:
-            convert_file(os.path.join(root, name))
+    convert_tree(args[0], parallel=parallel)
+
+
+def convert_tree(base, parallel=False, workers=None):
+    """
+    Convert all the RST files under `base` directory.
+
+    The conversions are recorded in a manifest, so that
+    pages which were already converted with the current rules are skipped,
+    and pages converted with older rules are converted again
+    from their source.
+
+    In parallel mode, the files are converted by a pool of processes,
+    one for each CPU by default.
+    Return the number of changed files.
+    """
+    git_dir = os.path.join(base, '.git')
+    if not os.path.isdir(git_dir):
+        git_dir = None
+    manifest = Manifest(os.path.join(git_dir or base, MANIFEST_NAME))
+
+    names = [
+        os.path.relpath(os.path.join(root, name), base)
+        for root, _, files in os.walk(base)
+        for name in files
+        if _is_rst_file(name)
+        ]
+    jobs = [
+        (os.path.join(base, name), manifest.get(name), git_dir)
+        for name in names
+        ]
+    index = PageIndex(
+        os.path.splitext(os.path.basename(name))[0] for name in names)
+
+    start = time.perf_counter()
+    if parallel:
+        # The index is sent once to each worker.
+        with ProcessPoolExecutor(
+                workers, initializer=_set_page_index, initargs=(index,),
+                ) as pool:
+            results = list(pool.map(_convert_job, jobs, chunksize=CHUNK_SIZE))
+    else:
+        _set_page_index(index)
+        results = [_convert_job(job) for job in jobs]
+    elapsed = time.perf_counter() - start
+
+    # Pages which were removed are forgotten.
+    manifest.entries = {}
+    counts = {CONVERTED: 0, SKIPPED: 0, REFUSED: 0}
+    for name, (state, entry) in zip(names, results):
+        counts[state] += 1
+        manifest.set(name, entry)
+        if state == CONVERTED:
+            print('Converted ', name)
+        elif state == REFUSED:
+            print('Refused to convert again', name)
+    manifest.save()
+
+    print(
+        f'Conversion complete. {counts[CONVERTED]} of {len(names)} files '
+        f'converted, {counts[SKIPPED]} up to date, '
+        f'{counts[REFUSED]} refused, '
+        f'in {elapsed:.1f}s ({len(names) / max(elapsed, 1e-6):.0f} files/s).'
+        )
+    return counts[CONVERTED]
+
+
+def _set_page_index(index):
+    """
+    Set the index of the pages, used by `convert_page`.
+    """
+    global _page_index
+    _page_index = index
+
+
+_page_index = None
+
+
+def _convert_job(job):
+    """
+    Call `convert_page` in a worker process.
+    """
+    return convert_page(*job)
+
+
+def convert_page(path, entry, git_dir=None):
+    """
+    In-place conversion of a page with its `entry` from the manifest.
+
+    Return the new state of the page and its new manifest entry.
+
+    Pages which look converted, and are not the output of
+    a recorded conversion, are refused.
+    When `git_dir` is given, the sources are kept in the git object DB,
+    and used when the page is converted again with new rules.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    current = _decode(data)
+    digest = blob_hash(data)
+
+    if entry and digest == entry['output']:
+        if entry['version'] == CONVERTER_VERSION:
+            return SKIPPED, entry
+        source = entry['source']
+        data = read_blob(git_dir, source)
+        if data is None:
+            # The source was lost.
+            return REFUSED, entry
+    elif entry and digest == entry['source']:
+        # The converted page was reverted to its source.
+        source = digest
+    elif data.startswith(CONVERTED_START):
+        return REFUSED, entry
+    else:
+        source = digest
+        if git_dir:
+            store_blob(git_dir, data)
+
+    output = convert_content(_decode(data), index=_page_index)
+    write_if_changed(path, current, output)
+
+    return CONVERTED, {
+        'source': source,
+        'version': CONVERTER_VERSION,
+        'output': blob_hash(output.encode('utf-8')),
+        }
+
+
+class Manifest:
+    """
+    The source hash, converter version and output hash
+    for each converted page, stored as JSON.
+    """
 
-    print('Conversion complete.')
+    def __init__(self, path):
+        self.path = path
+        self._text = ''
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._text = f.read()
+            self.entries = json.loads(self._text)
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def set(self, name, entry):
+        if entry is None:
+            self.entries.pop(name, None)
+        else:
+            self.entries[name] = entry
+
+    def save(self):
+        """
+        Write the manifest, if it was changed.
+        """
+        text = json.dumps(self.entries, indent=1, sort_keys=True) + '\n'
+        write_if_changed(self.path, self._text, text)
+        self._text = text
+
+
+def _decode(data: bytes):
+    """
+    Return the text of a file, with universal newlines.
+    """
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def blob_hash(data: bytes):
+    """
+    Return the git blob hash of `data`.
+    """
+    header = f'blob {len(data)}\0'.encode('ascii')
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def store_blob(git_dir, data: bytes):
+    """
+    Write `data` as a loose object in the git object DB,
+    if it's not already there.
+    """
+    digest = blob_hash(data)
+    path = os.path.join(git_dir, 'objects', digest[:2], digest[2:])
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = f'blob {len(data)}\0'.encode('ascii')
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(handle, 'wb') as f:
+        f.write(zlib.compress(header + data))
+    os.chmod(temporary, 0o444)
+    os.replace(temporary, path)
+
+
+def read_blob(git_dir, digest):
+    """
+    Return the content of the git blob, or None if it's not found.
+    """
+    if not git_dir:
+        return None
+    result = subprocess.run(
+        ['git', '--git-dir', git_dir, 'cat-file', 'blob', digest],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        )
+    if result.returncode:
+        return None
+    return result.stdout
 
 
 def convert_file(path: str):
     """
     In-place conversion of files; no backup.
+
+    The file is only written when the converted content is different.
+    Return `True` if the file was changed.
     """
-    if _is_rst_file(path):
-        print('Converting ', path)
-        with open(path) as f:
-            text = f.read()
+    if not _is_rst_file(path):
+        return False
+
+    with open(path) as f:
+        text = f.read()
+
+    return write_if_changed(path, text, convert_content(text))
 
-        with open(path, 'w') as f:
-            f.write(convert_content(text))
+
+def write_if_changed(path: str, old: str, new: str):
+    """
+    Atomically replace the `old` content of the file with `new` content,
+    by renaming a temporary file over it.
+
+    Return `True` if the file was changed.
+    """
+    if new == old:
+        return False
+
+    directory, name = os.path.split(path)
+    handle, temporary = tempfile.mkstemp(
+        dir=directory or '.', prefix=f'.{name}.')
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(new)
+        if os.path.exists(path):
+            shutil.copymode(path, temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return True
 
 
 def _is_rst_file(path: str):
@@ -46,22 +316,34 @@ def _is_rst_file(path: str):
     return path.endswith('rst') or path.endswith('rest')
 
 
-def convert_content(text: str):
+def convert_content(text: str, index=None):
     """
     Convert from Trac wiki RST format to GitHub RST format.
 
     * Remove RST wrapping
     * Convert Trac wiki directives to GitHub wiki links.
     * Convert TracWiki headings, subheadings, and lists to RST.
+
+    With the `PageIndex` of all the pages, the TitleIndex macros
+    are converted to lists of pages, and the PageOutline macros
+    to lists of the sections of the page.
     """
 
     to_remove = ['{{{', '#!rst', '}}}']
     for seq in to_remove:
         text = text.replace(seq, '')
-    text = _remove_pageoutline(text)
+    outline = False
+    if index is None:
+        text = _remove_pageoutline(text)
+    else:
+        text = _tracwiki_title_index(text, index)
+        text, outline = _mark_pageoutline(text)
     text = _remove_rst_contents(text)
     text = text.strip() + '\n'
-    text = _ensure_rst_content_directive(text)
+    if outline:
+        text = _ensure_rst_outline_comment(text)
+    else:
+        text = _ensure_rst_content_directive(text)
     text = _trac_to_github_wiki_links(text)
     text = _tracwiki_to_rst_links(text)
     text = _tracwiki_wiki_link_with_text_to_github_links(text)
@@ -70,10 +352,150 @@ def convert_content(text: str):
     text = _tracwiki_subheading_to_rst_subheading(text)
     text = _tracwiki_list_dedent(text)
     text = _tracwiki_list_separate_from_paragraph(text)
+    if outline:
+        text = _expand_pageoutline(text)
 
     return text
 
 
+class PageIndex:
+    """
+    Prefix tree of the page names, as generated by `wiki_migrate.py`,
+    without the file extension.
+
+    Each node is a dict of the next character -> child node.
+    The name of a page is kept in the node of its last character,
+    with the `None` key.
+    """
+
+    def __init__(self, names=()):
+        self._root = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        # Special pages, like _Sidebar, are not listed.
+        if name.startswith('_'):
+            return
+        node = self._root
+        for char in name:
+            node = node.setdefault(char, {})
+        node[None] = name
+
+    def withPrefix(self, prefix):
+        """
+        Return the sorted names starting with `prefix`.
+        """
+        node = self._root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        names = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if None in node:
+                names.append(node[None])
+            stack.extend(
+                node[char] for char in sorted(
+                    (char for char in node if char is not None),
+                    reverse=True,
+                    ))
+        return names
+
+
+def _tracwiki_title_index(text: str, index: PageIndex):
+    """
+    Replace the TracWiki TitleIndex macros with a list of links
+    to the pages starting with its prefix.
+    """
+    def replace(match):
+        arguments = [
+            argument.strip()
+            for argument in (match.group(1) or '').split(',')
+            ]
+        prefix = ''
+        if arguments and '=' not in arguments[0]:
+            prefix = arguments[0]
+        # Page names have spaces instead of path separators.
+        names = index.withPrefix(prefix.replace('/', ' '))
+        links = '\n'.join(
+            f'* `<{name.replace(" ", "-")}>`_' for name in names)
+        return f'\n{links}\n'
+
+    return re.sub(r'\[\[TitleIndex(?:\((.*?)\))?]]', replace, text)
+
+
+def _mark_pageoutline(text: str):
+    """
+    Replace the TracWiki PageOutline macros with a marker,
+    with their range of heading levels.
+
+    Return the new text, and `True` if there are PageOutline macros.
+    """
+    def replace(match):
+        levels = re.match(r'\s*(\d)(?:-(\d))?', match.group(1) or '')
+        if not levels:
+            return OUTLINE_MARKER.format('1-6')
+        first, last = levels.groups()
+        return OUTLINE_MARKER.format(f'{first}-{last or first}')
+
+    text, count = re.subn(
+        r'\[\[PageOutline(?:\((.*?)\))?]]', replace, text)
+    return text, bool(count)
+
+
+def _expand_pageoutline(text: str):
+    """
+    Replace the PageOutline markers with a list of links
+    to the RST sections of the page.
+
+    The list is always separated by a blank line from what follows.
+    """
+    headings = get_rst_headings(text)
+
+    def replace(match):
+        first, last = int(match.group(1)), int(match.group(2))
+        items = [
+            '  ' * (level - first) + f'* `{title}`_'
+            for level, title in headings
+            if first <= level <= last
+            ]
+        return '\n\n'.join(items + [''])
+
+    marker = re.escape(OUTLINE_MARKER).replace(
+        re.escape('{}'), r'(\d)-(\d)')
+    return re.sub(marker + r'\n*', replace, text)
+
+
+def get_rst_headings(text: str):
+    """
+    Return the (level, title) of the RST section titles in the text.
+
+    The level is given by the order in which the underline styles
+    are first used.
+    """
+    styles = []
+    headings = []
+    lines = text.split('\n')
+    for title, underline in zip(lines, lines[1:]):
+        if (
+                not title.strip() or
+                title[0].isspace() or
+                title.startswith('.. ') or
+                len(underline) < len(title.rstrip()) or
+                underline[0] not in RST_ADORNMENTS or
+                underline != underline[0] * len(underline)
+                ):
+            continue
+        if underline[0] not in styles:
+            styles.append(underline[0])
+        headings.append((styles.index(underline[0]) + 1, title.strip()))
+    return headings
+
+
 def _remove_pageoutline(text: str):
     """
     Remove any TracWiki PageOutline directives
@@ -100,6 +522,18 @@ def _ensure_rst_content_directive(text: str):
         )
 
 
+def _ensure_rst_outline_comment(text: str):
+    """
+    Mark a document listing its own sections with a comment at the top,
+    instead of the `contents` directive.
+    """
+    return (
+        '.. PageOutline\n'
+        '\n' +
+        text
+        )
+
+
 def _trac_to_github_wiki_links(text: str):
     """
     Takes content with Trac wiki link directives and coverts